@@ -0,0 +1,267 @@
+"""
+LLM批量查询与品牌提及分析
+不依赖Flask应用，可以在后台线程或分片子进程中直接使用
+"""
+import json
+import time
+import asyncio
+import aiohttp
+from functools import lru_cache
+
+async def query_llm_api(session, prompt, api_config):
+    """异步查询LLM API"""
+    try:
+        # 基础请求头
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'GEO-Insight-MVP/1.0'
+        }
+        
+        # 添加认证头
+        if api_config.get('api_key'):
+            if 'xeduapi' in api_config['endpoint'].lower():
+                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
+            elif 'openai' in api_config['endpoint'].lower():
+                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
+            elif 'claude' in api_config['endpoint'].lower() or 'anthropic' in api_config['endpoint'].lower():
+                headers['x-api-key'] = api_config["api_key"]
+                headers['anthropic-version'] = '2023-06-01'
+            else:
+                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
+        
+        # 根据不同的API类型构造请求体
+        if 'openai' in api_config['endpoint'].lower():
+            data = {
+                'model': api_config.get('model', 'gpt-3.5-turbo'),
+                'messages': [{'role': 'user', 'content': prompt}],
+                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
+                'temperature': 0.7
+            }
+        elif 'claude' in api_config['endpoint'].lower() or 'anthropic' in api_config['endpoint'].lower():
+            data = {
+                'model': api_config.get('model', 'claude-3-sonnet-20240229'),
+                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
+                'messages': [{'role': 'user', 'content': prompt}]
+            }
+        elif 'xeduapi' in api_config['endpoint'].lower():
+            # XeduAPI格式
+            data = {
+                'model': api_config.get('model', 'gpt-3.5-turbo'),
+                'messages': [{'role': 'user', 'content': prompt}],
+                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
+                'temperature': 0.7,
+                'stream': False
+            }
+        else:
+            # 通用格式 - 尝试多种可能的格式
+            data = {
+                'model': api_config.get('model', 'gpt-3.5-turbo'),
+                'messages': [{'role': 'user', 'content': prompt}],
+                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
+                'prompt': prompt  # 备用字段
+            }
+        
+        print(f"发送请求到: {api_config['endpoint']}")
+        print(f"请求头: {headers}")
+        print(f"请求数据: {data}")
+        
+        async with session.post(
+            api_config['endpoint'], 
+            json=data, 
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=30)
+        ) as response:
+            
+            print(f"响应状态: {response.status}")
+            print(f"响应头: {dict(response.headers)}")
+            
+            # 获取响应内容
+            response_text = await response.text()
+            print(f"响应内容前200字符: {response_text[:200]}")
+            
+            if response.status == 200:
+                # 检查响应类型
+                content_type = response.headers.get('content-type', '').lower()
+                
+                if 'application/json' in content_type:
+                    try:
+                        result = await response.json()
+                        
+                        # 提取回复内容 - 支持多种格式
+                        content = None
+                        
+                        # OpenAI格式
+                        if 'choices' in result and len(result['choices']) > 0:
+                            if 'message' in result['choices'][0]:
+                                content = result['choices'][0]['message']['content']
+                            elif 'text' in result['choices'][0]:
+                                content = result['choices'][0]['text']
+                        
+                        # Claude格式
+                        elif 'content' in result:
+                            if isinstance(result['content'], list) and len(result['content']) > 0:
+                                content = result['content'][0].get('text', str(result['content'][0]))
+                            else:
+                                content = str(result['content'])
+                        
+                        # 其他可能的格式
+                        elif 'response' in result:
+                            content = result['response']
+                        elif 'text' in result:
+                            content = result['text']
+                        elif 'output' in result:
+                            content = result['output']
+                        else:
+                            content = str(result)
+                        
+                        if content:
+                            return {
+                                'prompt': prompt,
+                                'response': content,
+                                'status': 'success'
+                            }
+                        else:
+                            return {
+                                'prompt': prompt,
+                                'response': f'无法解析API响应: {str(result)}',
+                                'status': 'error'
+                            }
+                            
+                    except json.JSONDecodeError as e:
+                        return {
+                            'prompt': prompt,
+                            'response': f'JSON解析失败: {str(e)}. 响应内容: {response_text[:200]}',
+                            'status': 'error'
+                        }
+                else:
+                    return {
+                        'prompt': prompt,
+                        'response': f'API返回非JSON格式 (Content-Type: {content_type}). 响应: {response_text[:200]}',
+                        'status': 'error'
+                    }
+            else:
+                return {
+                    'prompt': prompt,
+                    'response': f'API调用失败 - 状态码: {response.status}, 响应: {response_text[:200]}',
+                    'status': 'error'
+                }
+                
+    except aiohttp.ClientError as e:
+        return {
+            'prompt': prompt,
+            'response': f'网络请求错误: {str(e)}',
+            'status': 'error'
+        }
+    except Exception as e:
+        return {
+            'prompt': prompt,
+            'response': f'请求错误: {str(e)}',
+            'status': 'error'
+        }
+
+@lru_cache(maxsize=256)
+def build_mention_patterns(brands, domains):
+    """品牌+域名的小写匹配模式，按配置内容缓存，同一配置的任务不重复构建
+
+    brands/domains: 元组（需要可哈希）
+    """
+    return tuple(name.lower() for name in brands + domains)
+
+def find_mentions(response_text, patterns):
+    """返回回复中命中的品牌/域名位置（二元：提及即命中，不计次数）
+
+    patterns: 小写的 brands + domains 列表，每个任务只构建一次
+    """
+    response_lower = response_text.lower()
+    return [position for position, pattern in enumerate(patterns) if pattern in response_lower]
+
+async def batch_query_llms(prompts, api_config, brands, domains, progress, sink, concurrency=3, request_delay=0.5, rate_limiter=None):
+    """流式批量查询：prompt迭代器 -> 有界队列 -> N个worker -> 结果写入器
+    
+    prompts: 可迭代的 (index, prompt)，sink中已完成的index会被跳过
+    结果逐条写入sink，不在内存中保留；支持进度更新和暂停/取消
+    rate_limiter: 可选的全局限速器，分片执行时在多个进程间共享
+    """
+    patterns = build_mention_patterns(tuple(brands), tuple(domains))
+    
+    # 有界队列：生产者最多领先worker两轮，prompt迭代器不会被一次性展开
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    
+    async def producer():
+        for index, prompt in prompts:
+            # 已请求暂停或取消时不再派发新的请求
+            if progress.stop_reason:
+                break
+            if sink.is_done(index):
+                continue
+            await queue.put((index, prompt))
+        for _ in range(concurrency):
+            await queue.put(None)
+    
+    async def worker(session):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if progress.stop_reason:
+                continue  # 排空队列，让生产者尽快退出
+            
+            index, prompt = item
+            if rate_limiter:
+                await rate_limiter.wait()
+            progress.request_started()
+            started = time.monotonic()
+            finished = False
+            try:
+                try:
+                    result = await query_llm_api(session, prompt, api_config)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # 处理异常情况
+                    result = {
+                        'prompt': prompt,
+                        'response': f'查询异常: {str(e)}',
+                        'status': 'error'
+                    }
+                
+                # 只保存命中位置，品牌/域名名单由任务统一保存
+                result['hits'] = find_mentions(result['response'], patterns) if result['status'] == 'success' else []
+                sink.write(index, result)
+                
+                # 更新进度
+                progress.request_finished(time.monotonic() - started, result['status'] == 'success')
+                finished = True
+            finally:
+                # 被取消或写入结果失败时，进行中的请求计数也要归还
+                if not finished:
+                    progress.request_aborted()
+            # 添加请求延迟
+            if request_delay > 0 and not progress.stop_reason:
+                await asyncio.sleep(request_delay)
+    
+    async def abort_on_cancel(tasks):
+        """取消任务时中断正在进行的请求"""
+        while not all(t.done() for t in tasks):
+            if progress.stop_reason == 'cancelled':
+                for t in tasks:
+                    t.cancel()
+                return
+            await asyncio.sleep(0.2)
+    
+    async with aiohttp.ClientSession() as session:
+        tasks = [asyncio.ensure_future(producer())]
+        tasks += [asyncio.ensure_future(worker(session)) for _ in range(concurrency)]
+        watcher = asyncio.ensure_future(abort_on_cancel(tasks))
+        try:
+            # 任一worker出错（例如结果写入失败）时停止其余worker和生产者并抛出异常，
+            # 否则生产者会阻塞在有界队列上，任务永远不会结束
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            error = next((t.exception() for t in done if not t.cancelled() and t.exception()), None)
+            if error:
+                for t in pending:
+                    t.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise error
+        finally:
+            watcher.cancel()
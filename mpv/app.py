@@ -3,24 +3,63 @@ GEO Insight MVP - 简化版品牌监测工具
 主要功能：用户注册登录、上传prompt清单、配置品牌信息和LLM API、批量查询
 """
 import os
-import pandas as pd
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, send_file, session, g
+from flask import (Flask, render_template, request, flash, redirect, url_for, jsonify, send_file, session, g,
+                   Response, stream_with_context, make_response)
 from werkzeug.utils import secure_filename
 import uuid
 import json
+import math
+import base64
+import zlib
+import hashlib
 import asyncio
 import aiohttp
-from datetime import datetime
+import glob
+import shutil
+from datetime import datetime, timedelta, timezone
 import re
 import threading
 import time
 from database import db
+from progress import TaskProgress, endpoint_history, endpoint_key, estimate_task_seconds
+from compression import (COMPRESSION_SUFFIXES, resolve_compression, find_compressed, get_current_dictionary,
+                         train_dictionary)
+from result_store import (ResultSink, spool_prompts, iter_prompts, write_result_file, load_result_file, sample_results,
+                          write_mention_state, compute_mention_delta, build_result_db,
+                          load_result_summary, query_result_rows, iter_result_csv, iter_search_rows)
+from analysis import query_llm_api, batch_query_llms
+from export import EXPORT_FORMATS, export_available, write_export
+from task_diff import load_task_diff
+from artifacts import (file_sha256, make_etag, get_artifact_path, remove_artifacts, tee_artifact,
+                       load_cached_summary)
+from sharding import run_sharded, open_shard_results, plan_shard_count
+from scheduler import (MonitorScheduler, first_run_time, next_run_time, MIN_INTERVAL_HOURS, MAX_INTERVAL_HOURS,
+                       MAX_CONCURRENCY)
+from maintenance import MaintenanceRunner, RetentionPolicy
+from prompt_files import iter_prompt_file, scan_prompt_file
 from auth import login_required, get_current_user, create_user_directories, get_user_file_path
 
 app = Flask(__name__)
 app.secret_key = 'geo-insight-mvp-secret-key-change-in-production'
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# 上传文件流式解析，不再整体读入内存，默认上限64MB
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('GEO_MAX_UPLOAD_MB', 64)) * 1024 * 1024
+# 文本框输入的提示词条数上限
+app.config['MAX_TEXT_PROMPTS'] = int(os.environ.get('GEO_MAX_TEXT_PROMPTS', 10000))
+# 单个任务默认的prompt配额，可在users.prompt_quota中按用户覆盖
+app.config['DEFAULT_PROMPT_QUOTA'] = int(os.environ.get('GEO_DEFAULT_PROMPT_QUOTA', 1000))
+# 分片执行：每个任务拆分到多少个子进程（1表示在后台线程中直接执行）
+app.config['ANALYSIS_SHARDS'] = int(os.environ.get('GEO_ANALYSIS_SHARDS', 1))
+# 所有分片合计的每秒请求上限，0表示不限速
+app.config['GLOBAL_RATE_LIMIT'] = float(os.environ.get('GEO_GLOBAL_RATE_LIMIT', 0))
+# 定时监测调度器
+app.config['SCHEDULER_ENABLED'] = os.environ.get('GEO_SCHEDULER_ENABLED', '1') == '1'
+app.config['SCHEDULER_POLL_INTERVAL'] = int(os.environ.get('GEO_SCHEDULER_POLL_INTERVAL', 60))
+# 后台维护：清理过期会话和文件、更新数据库统计信息，保留策略见maintenance.RetentionPolicy
+app.config['MAINTENANCE_ENABLED'] = os.environ.get('GEO_MAINTENANCE_ENABLED', '1') == '1'
+app.config['MAINTENANCE_INTERVAL'] = int(os.environ.get('GEO_MAINTENANCE_INTERVAL', 600))
+# 结果文件压缩方式：auto（优先zstd，未安装zstandard时用gzip）/ zstd / gzip / none
+app.config['RESULT_COMPRESSION'] = os.environ.get('GEO_RESULT_COMPRESSION', 'auto')
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -30,7 +69,10 @@ os.makedirs('results', exist_ok=True)
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 
 # 后台任务状态管理
-task_status = {}  # {task_id: {'status': 'running|completed|failed', 'processed_count': 0, 'total_count': 0, 'start_time': datetime}}
+task_status = {}  # {task_id: TaskProgress}
+
+# API端点的历史延迟和吞吐保存在数据库中，各worker进程共享，重启后仍可用于预估耗时
+endpoint_history.configure(db.get_endpoint_stats, db.record_endpoint_stats)
 
 @app.before_request
 def load_user():
@@ -40,271 +82,6 @@ def load_user():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_uploaded_file(file_path):
-    """解析上传的CSV或Excel文件"""
-    try:
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
-        
-        # 假设第一列是prompts
-        if len(df.columns) > 0:
-            prompts = df.iloc[:, 0].dropna().tolist()
-            return prompts
-        return []
-    except Exception as e:
-        print(f"文件解析错误: {e}")
-        return []
-
-async def query_llm_api(session, prompt, api_config):
-    """异步查询LLM API"""
-    try:
-        # 基础请求头
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'GEO-Insight-MVP/1.0'
-        }
-        
-        # 添加认证头
-        if api_config.get('api_key'):
-            if 'xeduapi' in api_config['endpoint'].lower():
-                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
-            elif 'openai' in api_config['endpoint'].lower():
-                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
-            elif 'claude' in api_config['endpoint'].lower() or 'anthropic' in api_config['endpoint'].lower():
-                headers['x-api-key'] = api_config["api_key"]
-                headers['anthropic-version'] = '2023-06-01'
-            else:
-                headers['Authorization'] = f'Bearer {api_config["api_key"]}'
-        
-        # 根据不同的API类型构造请求体
-        if 'openai' in api_config['endpoint'].lower():
-            data = {
-                'model': api_config.get('model', 'gpt-3.5-turbo'),
-                'messages': [{'role': 'user', 'content': prompt}],
-                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
-                'temperature': 0.7
-            }
-        elif 'claude' in api_config['endpoint'].lower() or 'anthropic' in api_config['endpoint'].lower():
-            data = {
-                'model': api_config.get('model', 'claude-3-sonnet-20240229'),
-                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
-                'messages': [{'role': 'user', 'content': prompt}]
-            }
-        elif 'xeduapi' in api_config['endpoint'].lower():
-            # XeduAPI格式
-            data = {
-                'model': api_config.get('model', 'gpt-3.5-turbo'),
-                'messages': [{'role': 'user', 'content': prompt}],
-                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
-                'temperature': 0.7,
-                'stream': False
-            }
-        else:
-            # 通用格式 - 尝试多种可能的格式
-            data = {
-                'model': api_config.get('model', 'gpt-3.5-turbo'),
-                'messages': [{'role': 'user', 'content': prompt}],
-                'max_tokens': 2000,  # 增加token上限以获取更完整的响应
-                'prompt': prompt  # 备用字段
-            }
-        
-        print(f"发送请求到: {api_config['endpoint']}")
-        print(f"请求头: {headers}")
-        print(f"请求数据: {data}")
-        
-        async with session.post(
-            api_config['endpoint'], 
-            json=data, 
-            headers=headers,
-            timeout=aiohttp.ClientTimeout(total=30)
-        ) as response:
-            
-            print(f"响应状态: {response.status}")
-            print(f"响应头: {dict(response.headers)}")
-            
-            # 获取响应内容
-            response_text = await response.text()
-            print(f"响应内容前200字符: {response_text[:200]}")
-            
-            if response.status == 200:
-                # 检查响应类型
-                content_type = response.headers.get('content-type', '').lower()
-                
-                if 'application/json' in content_type:
-                    try:
-                        result = await response.json()
-                        
-                        # 提取回复内容 - 支持多种格式
-                        content = None
-                        
-                        # OpenAI格式
-                        if 'choices' in result and len(result['choices']) > 0:
-                            if 'message' in result['choices'][0]:
-                                content = result['choices'][0]['message']['content']
-                            elif 'text' in result['choices'][0]:
-                                content = result['choices'][0]['text']
-                        
-                        # Claude格式
-                        elif 'content' in result:
-                            if isinstance(result['content'], list) and len(result['content']) > 0:
-                                content = result['content'][0].get('text', str(result['content'][0]))
-                            else:
-                                content = str(result['content'])
-                        
-                        # 其他可能的格式
-                        elif 'response' in result:
-                            content = result['response']
-                        elif 'text' in result:
-                            content = result['text']
-                        elif 'output' in result:
-                            content = result['output']
-                        else:
-                            content = str(result)
-                        
-                        if content:
-                            return {
-                                'prompt': prompt,
-                                'response': content,
-                                'status': 'success'
-                            }
-                        else:
-                            return {
-                                'prompt': prompt,
-                                'response': f'无法解析API响应: {str(result)}',
-                                'status': 'error'
-                            }
-                            
-                    except json.JSONDecodeError as e:
-                        return {
-                            'prompt': prompt,
-                            'response': f'JSON解析失败: {str(e)}. 响应内容: {response_text[:200]}',
-                            'status': 'error'
-                        }
-                else:
-                    return {
-                        'prompt': prompt,
-                        'response': f'API返回非JSON格式 (Content-Type: {content_type}). 响应: {response_text[:200]}',
-                        'status': 'error'
-                    }
-            else:
-                return {
-                    'prompt': prompt,
-                    'response': f'API调用失败 - 状态码: {response.status}, 响应: {response_text[:200]}',
-                    'status': 'error'
-                }
-                
-    except aiohttp.ClientError as e:
-        return {
-            'prompt': prompt,
-            'response': f'网络请求错误: {str(e)}',
-            'status': 'error'
-        }
-    except Exception as e:
-        return {
-            'prompt': prompt,
-            'response': f'请求错误: {str(e)}',
-            'status': 'error'
-        }
-
-def analyze_brand_mentions(response_text, brands, domains):
-    """分析回复中的品牌和域名提及（二元计数：0或1）"""
-    mentions = {
-        'brands': {},
-        'domains': {},
-        'has_brand_mention': False,   # 是否提及任何品牌
-        'has_domain_mention': False,  # 是否提及任何域名
-        'total_brand_mentions': 0,    # 提及的品牌数量
-        'total_domain_mentions': 0    # 提及的域名数量
-    }
-    
-    response_lower = response_text.lower()
-    
-    # 检查品牌名提及（二元：0或1）
-    for brand in brands:
-        if brand.lower() in response_lower:
-            mentions['brands'][brand] = 1
-            mentions['has_brand_mention'] = True
-            mentions['total_brand_mentions'] += 1
-        else:
-            mentions['brands'][brand] = 0
-    
-    # 检查域名提及（二元：0或1）
-    for domain in domains:
-        if domain.lower() in response_lower:
-            mentions['domains'][domain] = 1
-            mentions['has_domain_mention'] = True
-            mentions['total_domain_mentions'] += 1
-        else:
-            mentions['domains'][domain] = 0
-    
-    return mentions
-
-async def batch_query_llms(prompts, api_config, brands, domains, task_id, concurrency=3, request_delay=0.5):
-    """批量查询LLM并分析结果，支持进度更新"""
-    results = []
-    
-    # 初始化任务状态
-    task_status[task_id] = {
-        'status': 'running',
-        'processed_count': 0,
-        'total_count': len(prompts),
-        'start_time': datetime.now()
-    }
-    
-    # 创建信号量来控制并发数
-    semaphore = asyncio.Semaphore(concurrency)
-    
-    async def query_with_semaphore(session, prompt, index):
-        async with semaphore:
-            result = await query_llm_api(session, prompt, api_config)
-            # 更新进度
-            task_status[task_id]['processed_count'] = index + 1
-            # 添加请求延迟
-            if request_delay > 0:
-                await asyncio.sleep(request_delay)
-            return result
-    
-    async with aiohttp.ClientSession() as session:
-        tasks = [query_with_semaphore(session, prompt, i) for i, prompt in enumerate(prompts)]
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for i, response in enumerate(responses):
-            if isinstance(response, Exception):
-                # 处理异常情况
-                result = {
-                    'prompt': prompts[i],
-                    'response': f'查询异常: {str(response)}',
-                    'status': 'error',
-                    'analysis': {
-                        'brands': {brand: 0 for brand in brands},
-                        'domains': {domain: 0 for domain in domains},
-                        'has_brand_mention': False,
-                        'has_domain_mention': False,
-                        'total_brand_mentions': 0,
-                        'total_domain_mentions': 0
-                    }
-                }
-            else:
-                if response['status'] == 'success':
-                    mentions = analyze_brand_mentions(response['response'], brands, domains)
-                    response['analysis'] = mentions
-                else:
-                    response['analysis'] = {
-                        'brands': {brand: 0 for brand in brands},
-                        'domains': {domain: 0 for domain in domains},
-                        'has_brand_mention': False,
-                        'has_domain_mention': False,
-                        'total_brand_mentions': 0,
-                        'total_domain_mentions': 0
-                    }
-                result = response
-            
-            results.append(result)
-    
-    return results
-
 # 用户认证路由
 @app.route('/')
 def index():
@@ -377,17 +154,15 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    """用户仪表板"""
-    # 获取用户的查询历史
-    history = db.get_user_query_history(g.current_user['id'], limit=10)
-    
-    # 获取用户的API配置
-    api_configs = db.get_user_api_configs(g.current_user['id'])
+    """用户仪表板：只读取汇总行和最近几个任务，与历史记录多少无关"""
+    # 多取一条用来判断是否显示"查看全部"
+    history = db.get_user_query_history(g.current_user['id'], limit=6)
+    summary = db.get_user_summary(g.current_user['id'])
     
     return render_template('dashboard.html', 
                          user=g.current_user, 
                          history=history, 
-                         api_configs=api_configs)
+                         summary=summary)
 
 @app.route('/profile')
 @login_required
@@ -498,6 +273,7 @@ def upload_page():
         # 处理文件上传或文本输入
         try:
             prompts = []
+            total_prompts = 0
             file_path = None
             
             # 检查是否是文本输入
@@ -505,11 +281,13 @@ def upload_page():
             if prompts_text:
                 # 处理文本输入的提示词
                 prompts = [line.strip() for line in prompts_text.split('\n') if line.strip()]
+                total_prompts = len(prompts)
                 if not prompts:
                     flash('未检测到有效的提示词')
                     return redirect(url_for('upload_page'))
-                if len(prompts) > 1000:
-                    flash('提示词数量超出限制（最多1000条）')
+                max_text_prompts = app.config['MAX_TEXT_PROMPTS']
+                if total_prompts > max_text_prompts:
+                    flash(f'提示词数量超出限制（最多{max_text_prompts}条）')
                     return redirect(url_for('upload_page'))
             
             # 检查是否是重用历史文件
@@ -535,8 +313,8 @@ def upload_page():
                     flash('文件已被删除，无法重新使用')
                     return redirect(url_for('upload_page'))
                 
-                # 重新解析文件
-                prompts = parse_uploaded_file(file_path)
+                # 重新解析文件，只保留预览和总数
+                prompts, total_prompts = scan_prompt_file(file_path)
                 file_path = upload_record['stored_filename']  # 用于后续处理
                 
                 if not prompts:
@@ -563,9 +341,9 @@ def upload_page():
                     
                     # 获取文件大小并解析内容
                     file_size = os.path.getsize(file_path)
-                    prompts = parse_uploaded_file(file_path)
+                    prompts, total_prompts = scan_prompt_file(file_path)
                     
-                    if not prompts:
+                    if not total_prompts:
                         flash('文件解析失败或文件为空')
                         return redirect(url_for('upload_page'))
                     
@@ -575,7 +353,7 @@ def upload_page():
                         original_filename=file.filename,
                         stored_filename=unique_filename,
                         file_size=file_size,
-                        prompts_count=len(prompts)
+                        prompts_count=total_prompts
                     )
                     
                     # 清理旧记录，只保留最近10个
@@ -596,7 +374,7 @@ def upload_page():
             
             return render_template('upload.html', 
                                  prompts=prompts[:10],  # 只显示前10个预览
-                                 total_prompts=len(prompts),
+                                 total_prompts=total_prompts,
                                  file_path=file_path,
                                  prompts_text=prompts_text if prompts_text else None,
                                  api_configs=api_configs,
@@ -670,6 +448,7 @@ def run_analysis():
     try:
         prompts = []
         file_path = None
+        new_upload = None
         
         # 检查是否是文本输入
         prompts_text = request.form.get('prompts_text', '').strip()
@@ -699,34 +478,16 @@ def run_analysis():
                     # 保存文件
                     file.save(file_path)
                     
-                    # 获取文件大小并记录上传历史
-                    file_size = os.path.getsize(file_path)
-                    prompts = parse_uploaded_file(file_path)
-                    
-                    if prompts:
-                        db.add_upload_history(
-                            user_id=g.current_user['id'],
-                            original_filename=file.filename,
-                            stored_filename=unique_filename,
-                            file_size=file_size,
-                            prompts_count=len(prompts)
-                        )
-                        db.cleanup_old_uploads(g.current_user['id'], keep_count=10)
-                    
+                    # 上传历史在解析文件、得到prompt数量后记录
+                    new_upload = (file.filename, unique_filename, os.path.getsize(file_path))
                     file_path = unique_filename  # 用于后续处理
                 else:
                     flash('不支持的文件格式，请上传CSV或Excel文件')
                     return redirect(url_for('upload_page'))
             else:
-                # 从表单获取已上传的文件路径
+                # 从表单获取已上传的文件路径，文件在创建任务时解析
                 file_path = request.form.get('file_path')
-                if file_path:
-                    # 重新解析文件
-                    user_upload_dir, _ = create_user_directories(g.current_user['id'])
-                    full_file_path = os.path.join(user_upload_dir, file_path)
-                    prompts = parse_uploaded_file(full_file_path)
-                
-                if not prompts:
+                if not file_path:
                     flash('请选择文件或输入提示词')
                     return redirect(url_for('upload_page'))
         
@@ -761,7 +522,7 @@ def run_analysis():
         request_delay = 0.5  # 固定延迟时间
         
         # 验证必填字段
-        if not prompts or not api_config:
+        if not (prompts or file_path) or not api_config:
             flash('请输入提示词和选择API配置')
             return redirect(url_for('upload_page'))
         
@@ -777,22 +538,58 @@ def run_analysis():
                 flash('文件不存在，请重新上传')
                 return redirect(url_for('upload_page'))
         
+        # 按用户配额限制单个任务的查询数量
+        max_prompts = db.get_user_prompt_quota(g.current_user['id']) or app.config['DEFAULT_PROMPT_QUOTA']
+        if file_path:
+            # 上传文件只读取一遍：逐条写入prompt文件（最多max_prompts条），剩余部分只计数
+            spooled_path = get_task_file(g.current_user['id'], uuid.uuid4(), '.prompts.jsonl')
+            try:
+                source = iter_prompt_file(full_file_path)
+                total_prompts = spool_prompts(spooled_path, source, limit=max_prompts)
+                file_prompts = total_prompts + sum(1 for _ in source)
+            except Exception as e:
+                print(f"文件解析错误: {e}")
+                total_prompts = file_prompts = 0
+            
+            if new_upload and file_prompts:
+                original_filename, stored_filename, file_size = new_upload
+                db.add_upload_history(
+                    user_id=g.current_user['id'],
+                    original_filename=original_filename,
+                    stored_filename=stored_filename,
+                    file_size=file_size,
+                    prompts_count=file_prompts
+                )
+                db.cleanup_old_uploads(g.current_user['id'], keep_count=10)
+            
+            if not total_prompts:
+                if os.path.exists(spooled_path):
+                    os.remove(spooled_path)
+                flash('文件解析失败或文件为空')
+                return redirect(url_for('upload_page'))
+        else:
+            file_prompts = len(prompts)
+            total_prompts = min(file_prompts, max_prompts)
+        if file_prompts > max_prompts:
+            flash(f'超出单任务配额，只处理前{max_prompts}个prompts')
+        
         # 创建查询任务记录
         task_id = db.create_query_task(
-            g.current_user['id'], task_name, file_path or 'text_input', len(prompts), 
-            api_config_id, brand_config_id
+            g.current_user['id'], task_name, file_path or 'text_input', total_prompts, 
+            api_config_id, brand_config_id, concurrency=concurrency, request_delay=request_delay
         )
         
-        # 限制查询数量（MVP版本）
-        max_prompts = 20
-        if len(prompts) > max_prompts:
-            prompts = prompts[:max_prompts]
-            flash(f'为了演示，只处理前{max_prompts}个prompts')
+        # prompt写入任务文件，后台任务从文件中流式读取
+        prompts_file = get_task_file(g.current_user['id'], task_id, '.prompts.jsonl')
+        if file_path:
+            os.replace(spooled_path, prompts_file)
+        else:
+            spool_prompts(prompts_file, prompts, limit=max_prompts)
         
         # 启动后台任务
         thread = threading.Thread(
             target=run_analysis_background,
-            args=(task_id, prompts, api_config, brands, domains, g.current_user['id'], task_name, concurrency, request_delay)
+            args=(task_id, api_config, brands, domains, g.current_user['id'], task_name, concurrency, request_delay)
         )
         thread.daemon = True
         thread.start()
@@ -814,14 +611,21 @@ def view_results(result_id):
             flash('任务不存在或无权访问')
             return redirect(url_for('dashboard'))
         
-        # 读取结果文件
-        user_upload_dir, user_results_dir = create_user_directories(g.current_user['id'])
-        result_file = os.path.join(user_results_dir, f'{result_id}.json')
-        
-        with open(result_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # 只读取摘要，逐条结果由页面通过分页API加载
+        user_id = g.current_user['id']
+        content_hash = get_result_hash(user_id, task)
+        if not content_hash:
+            data = load_result_summary(ensure_result_db(user_id, result_id))
+            return render_template('results.html', data=data, result_id=result_id, task=task)
         
-        return render_template('results.html', data=data, result_id=result_id, task=task)
+        # 已完成任务的页面不再变化，客户端缓存有效时直接返回304
+        etag, last_modified = make_etag(content_hash, 'view'), get_last_modified(task)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        data = load_cached_summary(content_hash, ensure_result_db(user_id, result_id))
+        response = make_response(render_template('results.html', data=data, result_id=result_id, task=task))
+        return set_cache_headers(response, etag, last_modified)
     except FileNotFoundError:
         flash('结果文件未找到')
         return redirect(url_for('dashboard'))
@@ -829,6 +633,51 @@ def view_results(result_id):
         flash(f'加载结果失败: {str(e)}')
         return redirect(url_for('dashboard'))
 
+@app.route('/api/results/<result_id>')
+@login_required
+def get_result_rows(result_id):
+    """分页获取任务结果，支持按状态、品牌/域名命中、提及情况和文本筛选"""
+    try:
+        task = db.get_query_task(result_id, g.current_user['id'])
+        if not task:
+            return jsonify({'success': False, 'message': '任务不存在或无权访问'}), 404
+        
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(max(1, request.args.get('per_page', 50, type=int)), 200)
+        
+        content_hash = get_result_hash(g.current_user['id'], task)
+        if content_hash:
+            query_key = hashlib.sha1(request.query_string).hexdigest()[:16]
+            etag, last_modified = make_etag(content_hash, f'rows-{query_key}'), get_last_modified(task)
+            cached = not_modified(etag, last_modified)
+            if cached:
+                return cached
+        
+        total, rows = query_result_rows(
+            ensure_result_db(g.current_user['id'], result_id),
+            page=page,
+            per_page=per_page,
+            status=request.args.get('status') or None,
+            brand=request.args.get('brand') or None,
+            domain=request.args.get('domain') or None,
+            mention=request.args.get('mention') or None,
+            search=request.args.get('q', '').strip() or None
+        )
+        response = jsonify({
+            'success': True,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'rows': rows
+        })
+        if content_hash:
+            set_cache_headers(response, etag, last_modified)
+        return response
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': '结果文件未找到'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'加载结果失败: {str(e)}'}), 500
+
 @app.route('/download/<result_id>')
 @login_required
 def download_results(result_id):
@@ -839,52 +688,299 @@ def download_results(result_id):
             flash('任务不存在或无权访问')
             return redirect(url_for('dashboard'))
         
-        # 读取结果文件
-        user_upload_dir, user_results_dir = create_user_directories(g.current_user['id'])
-        result_file = os.path.join(user_results_dir, f'{result_id}.json')
-        
-        with open(result_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 转换为CSV格式
-        csv_data = []
-        for result in data['results']:
-            row = {
-                'Prompt': result['prompt'],
-                'Response': result['response'],  # 保留完整响应，不再截断
-                'Status': result['status'],
-                'Has_Brand_Mention': 1 if result['analysis']['has_brand_mention'] else 0,
-                'Has_Domain_Mention': 1 if result['analysis']['has_domain_mention'] else 0,
-                'Brand_Mention_Count': result['analysis']['total_brand_mentions'],
-                'Domain_Mention_Count': result['analysis']['total_domain_mentions']
-            }
-            
-            # 添加品牌提及列
-            for brand in data['brands']:
-                row[f'Brand_{brand}'] = result['analysis']['brands'].get(brand, 0)
-            
-            # 添加域名提及列
-            for domain in data['domains']:
-                row[f'Domain_{domain}'] = result['analysis']['domains'].get(domain, 0)
-            
-            csv_data.append(row)
+        # 直接从结果库逐块生成CSV，不在内存或磁盘上拼装整个文件
+        user_id = g.current_user['id']
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        headers = {
+            'Content-Disposition': f'attachment; filename=geo_insight_results_{result_id}.csv',
+            'Vary': 'Accept-Encoding'
+        }
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
         
-        df = pd.DataFrame(csv_data)
-        csv_file = os.path.join(user_results_dir, f'{result_id}.csv')
-        df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+        content_hash = get_result_hash(user_id, task)
+        if content_hash:
+            variant = 'csv.gz' if use_gzip else 'csv'
+            etag, last_modified = make_etag(content_hash, variant), get_last_modified(task)
+            cached = not_modified(etag, last_modified)
+            if cached:
+                cached.headers['Vary'] = 'Accept-Encoding'
+                return cached
+            
+            # 同一结果只生成一次CSV，之后直接发送缓存的文件
+            _, user_results_dir = create_user_directories(user_id)
+            artifact_path = get_artifact_path(user_results_dir, content_hash, f'results.{variant}')
+            if os.path.exists(artifact_path):
+                response = send_file(os.path.abspath(artifact_path), mimetype='text/csv', conditional=False,
+                                     etag=False)
+                response.headers.update(headers)
+            else:
+                chunks = csv_chunks(ensure_result_db(user_id, result_id), use_gzip)
+                response = Response(stream_with_context(tee_artifact(artifact_path, chunks)),
+                                    mimetype='text/csv', headers=headers)
+            return set_cache_headers(response, etag, last_modified)
         
-        return send_file(csv_file, as_attachment=True, download_name=f'geo_insight_results_{result_id}.csv')
+        chunks = csv_chunks(ensure_result_db(user_id, result_id), use_gzip)
+        return Response(stream_with_context(chunks), mimetype='text/csv', headers=headers)
         
     except Exception as e:
         flash(f'下载失败: {str(e)}')
         return redirect(url_for('dashboard'))
 
+@app.route('/download/<result_id>/<fmt>')
+@login_required
+def download_export(result_id, fmt):
+    """下载Parquet/Arrow/Excel格式的结果，导出文件生成一次后按结果内容哈希缓存"""
+    try:
+        task = db.get_query_task(result_id, g.current_user['id'])
+        if not task:
+            flash('任务不存在或无权访问')
+            return redirect(url_for('dashboard'))
+        
+        if fmt not in EXPORT_FORMATS:
+            flash('不支持的导出格式')
+            return redirect(url_for('view_results', result_id=result_id))
+        if not export_available(fmt):
+            flash('服务器未安装pyarrow，无法导出Parquet/Arrow格式')
+            return redirect(url_for('view_results', result_id=result_id))
+        
+        user_id = g.current_user['id']
+        content_hash = get_result_hash(user_id, task)
+        if not content_hash:
+            flash('任务尚未完成，无法导出')
+            return redirect(url_for('history'))
+        
+        etag, last_modified = make_etag(content_hash, fmt), get_last_modified(task)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        # 导出文件按结果内容哈希缓存，结果重新生成后哈希变化，旧导出自然失效
+        _, user_results_dir = create_user_directories(user_id)
+        export_path = get_artifact_path(user_results_dir, content_hash, f"results{EXPORT_FORMATS[fmt]['suffix']}")
+        if not os.path.exists(export_path):
+            write_export(ensure_result_db(user_id, result_id), fmt, export_path)
+        response = send_file(
+            os.path.abspath(export_path),
+            mimetype=EXPORT_FORMATS[fmt]['mimetype'],
+            as_attachment=True,
+            download_name=f"geo_insight_results_{result_id}{EXPORT_FORMATS[fmt]['suffix']}",
+            conditional=False,
+            etag=False
+        )
+        return set_cache_headers(response, etag, last_modified)
+        
+    except Exception as e:
+        flash(f'导出失败: {str(e)}')
+        return redirect(url_for('dashboard'))
+
+@app.route('/search')
+@login_required
+def search_page():
+    """跨任务全文检索页面"""
+    return render_template('search.html', query=request.args.get('q', ''))
+
+@app.route('/api/search')
+@login_required
+def search_results():
+    """在当前用户所有任务的prompt和回复中检索"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': '请输入检索内容'}), 400
+    
+    user_id = g.current_user['id']
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 20, type=int)), 100)
+    try:
+        # 索引功能上线前完成的任务在第一次检索时补建索引
+        for task_id in db.get_unindexed_tasks(user_id):
+            try:
+                db.index_task_results(user_id, task_id, iter_search_rows(ensure_result_db(user_id, task_id)))
+            except Exception as e:
+                print(f"补建全文索引失败 ({task_id}): {e}")
+        
+        results = db.search_results(user_id, query, limit=limit + 1, offset=offset)
+        return jsonify({
+            'success': True,
+            'results': results[:limit],
+            'offset': offset,
+            'has_more': len(results) > limit
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'检索失败: {str(e)}'}), 500
+
+@app.route('/trends')
+@login_required
+def trends_page():
+    """品牌/域名提及率趋势页面"""
+    targets = db.get_trend_targets(g.current_user['id'])
+    return render_template('trends.html', targets=targets)
+
+@app.route('/api/trends')
+@login_required
+def get_trends():
+    """读取趋势表中的时间序列，target参数形如 brand:品牌名 或 domain:域名，可重复"""
+    try:
+        days = request.args.get('days', type=int)
+        since = (datetime.now() - timedelta(days=days)).isoformat() if days else None
+        
+        series = []
+        for target in request.args.getlist('target'):
+            kind, _, name = target.partition(':')
+            if kind not in ('brand', 'domain') or not name:
+                return jsonify({'success': False, 'message': f'无效的监测目标: {target}'}), 400
+            series.append({
+                'kind': kind,
+                'name': name,
+                'points': db.get_trend_series(g.current_user['id'], kind, name, since)
+            })
+        return jsonify({'success': True, 'series': series})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取趋势数据失败: {str(e)}'}), 500
+
+@app.route('/diff')
+@login_required
+def diff_page():
+    """两个任务的结果对比页面"""
+    tasks = [task for task in db.get_user_query_history(g.current_user['id'], limit=50)
+             if task['status'] in ('completed', 'cancelled') and task.get('results_file')]
+    return render_template('diff.html', tasks=tasks, task_a=request.args.get('a', ''),
+                           task_b=request.args.get('b', ''))
+
+@app.route('/api/diff')
+@login_required
+def get_task_diff():
+    """按prompt对齐两个任务的结果，返回各品牌/域名的新增、丢失提及和提及率变化，以及分页的翻转prompt
+
+    参数: a=基准任务ID, b=对比任务ID, target=brand:名称 或 domain:名称, change=gained/lost, offset, limit
+    """
+    user_id = g.current_user['id']
+    task_a = db.get_query_task(request.args.get('a', ''), user_id)
+    task_b = db.get_query_task(request.args.get('b', ''), user_id)
+    if not task_a or not task_b:
+        return jsonify({'success': False, 'message': '任务不存在或无权访问'}), 404
+    
+    target = None
+    if request.args.get('target'):
+        kind, _, name = request.args['target'].partition(':')
+        if kind not in ('brand', 'domain') or not name:
+            return jsonify({'success': False, 'message': f"无效的监测目标: {request.args['target']}"}), 400
+        target = (kind, name)
+    change = request.args.get('change') or None
+    if change not in (None, 'gained', 'lost'):
+        return jsonify({'success': False, 'message': f'无效的变化类型: {change}'}), 400
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 50, type=int)), 200)
+    
+    try:
+        hash_a, hash_b = get_result_hash(user_id, task_a), get_result_hash(user_id, task_b)
+        if not hash_a or not hash_b:
+            return jsonify({'success': False, 'message': '只能对比已完成的任务'}), 400
+        
+        # 两个任务的结果都不再变化，对比结果同样可以按ETag缓存
+        query_key = hashlib.sha1(request.query_string).hexdigest()[:16]
+        etag = make_etag(hash_a, f'diff-{hash_b[:16]}-{query_key}')
+        last_modified = max(filter(None, (get_last_modified(task_a), get_last_modified(task_b))), default=None)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        diff = load_task_diff(hash_a, hash_b, ensure_result_db(user_id, task_a['task_id']),
+                              ensure_result_db(user_id, task_b['task_id']))
+        total, rows = diff.flipped_rows(offset=offset, limit=limit, target=target, change=change)
+        response = jsonify({
+            'success': True,
+            'task_a': {'task_id': task_a['task_id'], 'task_name': task_a['task_name']},
+            'task_b': {'task_id': task_b['task_id'], 'task_name': task_b['task_name']},
+            **diff.summary(),
+            'flipped': {'total': total, 'offset': offset, 'limit': limit, 'rows': rows}
+        })
+        return set_cache_headers(response, etag, last_modified)
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': '结果文件未找到'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'对比失败: {str(e)}'}), 500
+
+TASK_STATUSES = ('completed', 'pending', 'paused', 'cancelled', 'failed')
+
+def encode_cursor(sort_value, record_id):
+    """键集分页游标：上一页最后一条记录的 (排序时间, id)，编码后对客户端不透明"""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, record_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """解析分页游标，没有游标时返回None，格式错误时抛出ValueError"""
+    if not cursor:
+        return None
+    try:
+        sort_value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if not isinstance(sort_value, str) or not isinstance(record_id, int):
+        raise ValueError('无效的分页游标')
+    return sort_value, record_id
+
+def get_history_filters():
+    """从请求参数中读取历史记录的筛选条件：status、name（任务名前缀）、api_config"""
+    status = request.args.get('status') or None
+    if status and status not in TASK_STATUSES:
+        raise ValueError(f'无效的任务状态: {status}')
+    return {
+        'status': status,
+        'name_prefix': request.args.get('name', '').strip() or None,
+        'api_config_id': request.args.get('api_config', type=int)
+    }
+
+def load_history_page(user_id, limit):
+    """按请求参数中的筛选条件和游标读取一页历史记录，返回 (记录, 下一页游标)；没有更多记录时游标为None"""
+    tasks = db.get_user_query_history(user_id, limit=limit + 1, before=decode_cursor(request.args.get('cursor')),
+                                      **get_history_filters())
+    if len(tasks) <= limit:
+        return tasks, None
+    tasks = tasks[:limit]
+    return tasks, encode_cursor(tasks[-1]['created_at'], tasks[-1]['id'])
+
 @app.route('/history')
 @login_required
 def history():
-    """查询历史页面"""
-    history = db.get_user_query_history(g.current_user['id'], limit=50)
-    return render_template('history.html', history=history)
+    """查询历史页面，按游标分页，筛选条件和游标都在URL参数中"""
+    user_id = g.current_user['id']
+    try:
+        history, next_cursor = load_history_page(user_id, limit=50)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('history'))
+    return render_template('history.html', history=history, next_cursor=next_cursor,
+                           task_counts=db.get_user_task_counts(user_id),
+                           api_configs=db.get_user_api_configs(user_id),
+                           filters=request.args)
+
+@app.route('/api/history')
+@login_required
+def get_history():
+    """分页读取查询历史，参数: status, name, api_config, cursor, limit；返回的next_cursor用于读取下一页"""
+    limit = min(max(1, request.args.get('limit', 50, type=int)), 200)
+    try:
+        tasks, next_cursor = load_history_page(g.current_user['id'], limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'tasks': tasks, 'next_cursor': next_cursor, 'has_more': next_cursor is not None})
+
+@app.route('/api/uploads')
+@login_required
+def get_uploads():
+    """分页读取文件上传历史，参数: cursor, limit"""
+    limit = min(max(1, request.args.get('limit', 50, type=int)), 200)
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    uploads = db.get_user_upload_history(g.current_user['id'], limit=limit + 1, before=before)
+    next_cursor = None
+    if len(uploads) > limit:
+        uploads = uploads[:limit]
+        next_cursor = encode_cursor(uploads[-1]['upload_time'], uploads[-1]['id'])
+    return jsonify({'success': True, 'uploads': uploads, 'next_cursor': next_cursor,
+                    'has_more': next_cursor is not None})
 
 # API路由 - 查询任务状态
 @app.route('/api/task_status/<task_id>')
@@ -899,12 +995,7 @@ def get_task_status(task_id):
         
         # 从内存中获取实时状态
         if task_id in task_status:
-            status_info = task_status[task_id].copy()
-            # 计算已运行时间
-            elapsed_time = (datetime.now() - status_info['start_time']).total_seconds()
-            status_info['elapsed_time'] = round(elapsed_time, 1)
-            status_info['start_time'] = status_info['start_time'].isoformat()
-            return jsonify(status_info)
+            return jsonify(task_status[task_id].snapshot())
         else:
             # 从数据库获取状态
             return jsonify({
@@ -916,95 +1007,360 @@ def get_task_status(task_id):
     except Exception as e:
         return jsonify({'error': f'获取任务状态失败: {str(e)}'}), 500
 
-def run_analysis_background(task_id, prompts, api_config, brands, domains, user_id, task_name, concurrency=3, request_delay=0.5):
-    """在后台运行分析任务"""
+# 任务控制API - 暂停/取消/恢复
+@app.route('/api/task/<task_id>/pause', methods=['POST'])
+@login_required
+def pause_task(task_id):
+    """暂停运行中的任务，已完成的结果保留用于恢复"""
+    task = db.get_query_task(task_id, g.current_user['id'])
+    if not task:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    progress = task_status.get(task_id)
+    if task['status'] != 'pending' or not progress or progress.status != 'running':
+        return jsonify({'success': False, 'message': '只能暂停运行中的任务'}), 400
+    
+    progress.request_stop('paused')
+    return jsonify({'success': True, 'message': '正在暂停，进行中的请求完成后停止'})
+
+@app.route('/api/task/<task_id>/cancel', methods=['POST'])
+@login_required
+def cancel_task(task_id):
+    """取消任务，立即中断进行中的请求，已完成的结果仍然保存"""
+    task = db.get_query_task(task_id, g.current_user['id'])
+    if not task:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    if task['status'] == 'paused':
+        # 已暂停的任务没有运行线程，直接用已落盘的结果生成结果文件；
+        # 先认领任务，避免同时恢复的请求在同一份结果上启动后台任务
+        checkpoint = load_checkpoint(g.current_user['id'], task_id)
+        if not db.claim_query_task(task_id, 'paused', 'pending' if checkpoint else 'cancelled'):
+            return jsonify({'success': False, 'message': '任务已被恢复或取消'}), 409
+        if checkpoint:
+            sink = open_task_results(g.current_user['id'], task_id, checkpoint['brands'],
+                                     checkpoint['domains'], checkpoint.get('shards', 1))
+            finalize_analysis(task_id, g.current_user['id'], checkpoint, sink, 'cancelled')
+        else:
+            db.update_query_task(task_id, completed_at=datetime.now().isoformat())
+        return jsonify({'success': True, 'message': '任务已取消'})
+    
+    progress = task_status.get(task_id)
+    if task['status'] != 'pending' or not progress or progress.status != 'running':
+        return jsonify({'success': False, 'message': '只能取消运行中或已暂停的任务'}), 400
+    
+    progress.request_stop('cancelled')
+    return jsonify({'success': True, 'message': '正在取消任务'})
+
+@app.route('/api/task/<task_id>/resume', methods=['POST'])
+@login_required
+def resume_task(task_id):
+    """恢复已暂停的任务，只执行尚未完成的prompt"""
+    task = db.get_query_task(task_id, g.current_user['id'])
+    if not task:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    if task['status'] != 'paused':
+        return jsonify({'success': False, 'message': '只能恢复已暂停的任务'}), 400
+    
+    checkpoint = load_checkpoint(g.current_user['id'], task_id)
+    if not checkpoint:
+        return jsonify({'success': False, 'message': '暂停数据已丢失，无法恢复'}), 400
+    
+    api_config = db.get_api_config(task['api_config_id'], g.current_user['id'])
+    if not api_config:
+        return jsonify({'success': False, 'message': 'API配置不存在'}), 400
+    
+    # 认领任务，同时到达的恢复或取消请求只有一个能成功
+    if not db.claim_query_task(task_id, 'paused', 'pending'):
+        return jsonify({'success': False, 'message': '任务已被恢复或取消'}), 409
+    
+    # 已完成的结果保存在结果JSONL中，恢复后会被跳过
+    thread = threading.Thread(
+        target=run_analysis_background,
+        args=(task_id, api_config, checkpoint['brands'], checkpoint['domains'],
+              g.current_user['id'], checkpoint['task_name'], checkpoint['concurrency'],
+              checkpoint['request_delay'], checkpoint.get('shards', 1))
+    )
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({
+        'success': True,
+        'message': '任务已恢复',
+        'redirect': url_for('processing_page', task_id=task_id)
+    })
+
+def get_task_file(user_id, task_id, suffix):
+    """任务相关文件路径，例如 results/<user_id>/<task_id>.results.jsonl"""
+    create_user_directories(user_id)
+    return get_user_file_path(user_id, f'{task_id}{suffix}', file_type='result')
+
+def open_task_results(user_id, task_id, brands, domains, shards=1):
+    """打开任务已落盘的结果，分片任务会合并各分片的结果文件"""
+    results_path = get_task_file(user_id, task_id, '.results.jsonl')
+    if shards > 1:
+        return open_shard_results(results_path, shards, brands, domains)
+    return ResultSink(results_path, brands, domains)
+
+def get_result_hash(user_id, task):
+    """已完成任务结果文件的内容哈希，旧任务首次访问时计算并保存；结果仍可能变化时返回None"""
+    if task['status'] not in ('completed', 'cancelled') or not task.get('results_file'):
+        return None
+    if not task.get('result_hash'):
+        task['result_hash'] = file_sha256(get_result_file(user_id, task['task_id']))
+        db.update_query_task(task['task_id'], result_hash=task['result_hash'])
+    return task['result_hash']
+
+def get_last_modified(task):
+    """任务完成时间（UTC，精确到秒），用于Last-Modified"""
+    if not task.get('completed_at'):
+        return None
+    return datetime.fromisoformat(task['completed_at']).astimezone(timezone.utc).replace(microsecond=0)
+
+def set_cache_headers(response, etag, last_modified):
+    """设置强ETag和Last-Modified，要求客户端每次重新验证"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified(etag, last_modified):
+    """客户端缓存仍然有效时返回304响应，否则返回None；不读取任何结果文件"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = bool(last_modified and request.if_modified_since
+                     and request.if_modified_since >= last_modified)
+    if not fresh:
+        return None
+    return set_cache_headers(Response(status=304), etag, last_modified)
+
+def csv_chunks(db_path, use_gzip=False):
+    """结果CSV的字节块流，可选gzip压缩"""
+    chunks = (chunk.encode('utf-8') for chunk in iter_result_csv(db_path))
+    return gzip_chunks(chunks) if use_gzip else chunks
+
+def gzip_chunks(chunks, level=6):
+    """把字节块流压缩为gzip流"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def get_result_file(user_id, task_id):
+    """任务结果文件路径（<task_id>.json，可能带有.zst/.gz压缩扩展名）"""
+    result_file = find_compressed(get_task_file(user_id, task_id, '.json'))
+    if not result_file:
+        raise FileNotFoundError(f'结果文件不存在: {task_id}')
+    return result_file
+
+def ensure_result_db(user_id, task_id):
+    """返回任务结果库路径，旧任务只有JSON结果文件时先导入一次"""
+    db_path = get_task_file(user_id, task_id, '.db')
+    if not os.path.exists(db_path):
+        data = load_result_file(get_result_file(user_id, task_id))
+        build_result_db(db_path, data, data['results'])
+    return db_path
+
+def load_checkpoint(user_id, task_id):
+    """读取暂停任务的检查点，不存在时返回None"""
     try:
-        # 异步执行批量查询
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        results = loop.run_until_complete(
-            batch_query_llms(prompts, api_config, brands, domains, task_id, concurrency, request_delay)
-        )
-        loop.close()
+        with open(get_task_file(user_id, task_id, '.checkpoint.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def finalize_analysis(task_id, user_id, context, sink, status='completed'):
+    """根据结果写入器中的结果和统计生成结果文件，并清理任务的中间文件
+    
+    context: 任务上下文（task_name, total_prompts, brands, domains, settings）
+    """
+    compression = resolve_compression(app.config['RESULT_COMPRESSION'])
+    result_filename = f'{task_id}.json{COMPRESSION_SUFFIXES[compression]}'
+    result_file = get_task_file(user_id, task_id, '.json' + COMPRESSION_SUFFIXES[compression])
+    results_dir = os.path.dirname(result_file)
+    
+    analysis_summary = {
+        'task_id': task_id,
+        'task_name': context['task_name'],
+        'user_id': user_id,
+        'total_prompts': context['total_prompts'],
+        **sink.stats(),
+        'brands': context['brands'],
+        'domains': context['domains'],
+        'timestamp': datetime.now().isoformat(),
+        'settings': context['settings']
+    }
+    
+    # zstd压缩使用该用户的共享字典，还没有字典时用本次结果训练一个
+    dictionary = None
+    if compression == 'zstd':
+        dictionary = (get_current_dictionary(results_dir)
+                      or train_dictionary(results_dir, sample_results(sink.iter_results())))
+    write_result_file(result_file, analysis_summary, sink.iter_results(), compression, dictionary)
+    for suffix in COMPRESSION_SUFFIXES.values():
+        # 重新生成时删除其他压缩方式的旧结果文件
+        stale_file = get_task_file(user_id, task_id, '.json' + suffix)
+        if stale_file != result_file and os.path.exists(stale_file):
+            os.remove(stale_file)
+    db_path = get_task_file(user_id, task_id, '.db')
+    build_result_db(db_path, analysis_summary, sink.iter_results())
+    try:
+        db.index_task_results(user_id, task_id, iter_search_rows(db_path))
+    except Exception as e:
+        print(f"写入全文索引失败: {e}")
+    if status == 'completed':
+        try:
+            db.save_task_trends(user_id, task_id, analysis_summary['timestamp'], analysis_summary)
+        except Exception as e:
+            print(f"写入趋势数据失败: {e}")
+    result_hash = file_sha256(result_file)
+    
+    # 结果文件重新生成时，删除按旧内容哈希缓存的导出产物
+    task = db.get_query_task(task_id, user_id)
+    if task and task.get('result_hash') and task['result_hash'] != result_hash:
+        remove_artifacts(results_dir, task['result_hash'])
+    
+    # 定时监测任务：计算与上一次运行相比的提及变化
+    if status == 'completed' and task and task.get('schedule_id'):
+        try:
+            record_schedule_delta(task_id, user_id, task['schedule_id'], sink,
+                                  context['brands'], context['domains'])
+        except Exception as e:
+            print(f"计算增量变化失败: {e}")
+    sink.close()
+    
+    # 更新任务状态
+    db.update_query_task(
+        task_id, 
+        completed_prompts=sink.count,
+        status=status,
+        results_file=result_filename,
+        completed_at=datetime.now().isoformat(),
+        result_hash=result_hash,
+        successful_queries=analysis_summary['successful_queries'],
+        brand_mention_count=analysis_summary['brand_mention_count']
+    )
+    
+    # 结果已保存，删除中间文件
+    for suffix in ('.prompts.jsonl', '.results.jsonl', '.checkpoint.json'):
+        path = get_task_file(user_id, task_id, suffix)
+        if os.path.exists(path):
+            os.remove(path)
+    for path in glob.glob(get_task_file(user_id, task_id, '.shard*.results.jsonl')):
+        os.remove(path)
+    
+    # 更新内存中的任务状态
+    if task_id in task_status:
+        task_status[task_id].finish(status)
+
+def record_schedule_delta(task_id, user_id, schedule_id, sink, brands, domains):
+    """保存本次运行的提及状态，并与同一计划的上一次运行比较，只记录发生变化的prompt"""
+    state_file = get_task_file(user_id, task_id, '.mentions.json')
+    write_mention_state(state_file, sink.iter_results(), brands, domains)
+    
+    previous = db.get_previous_schedule_task(schedule_id, task_id)
+    previous_state = get_task_file(user_id, previous['task_id'], '.mentions.json') if previous else None
+    if previous_state and os.path.exists(previous_state):
+        delta = compute_mention_delta(previous_state, state_file)
+    else:
+        # 首次运行没有可比较的基线
+        delta = {'changed': [], 'changed_count': 0, 'gained_count': 0, 'lost_count': 0,
+                 'new_prompts': sink.count, 'removed_prompts': 0, 'summary': {}}
+    
+    delta['task_id'] = task_id
+    delta['previous_task_id'] = previous['task_id'] if previous else None
+    delta['timestamp'] = datetime.now().isoformat()
+    
+    delta_filename = f'{task_id}.delta.json'
+    with open(get_task_file(user_id, task_id, '.delta.json'), 'w', encoding='utf-8') as f:
+        json.dump(delta, f, ensure_ascii=False)
+    
+    db.save_schedule_run(schedule_id, task_id, delta['previous_task_id'], delta['changed_count'],
+                         delta['gained_count'], delta['lost_count'], delta_filename)
+
+def run_analysis_background(task_id, api_config, brands, domains, user_id, task_name, concurrency=3, request_delay=0.5, shards=None):
+    """在后台运行分析任务
+    
+    prompt从任务的prompt文件流式读取，结果逐条写入结果JSONL；
+    恢复暂停的任务时，已写入的结果会被跳过。
+    shards > 1 时任务拆分到多个子进程执行，默认使用部署配置的分片数（不超过任务并发数和prompt数）；
+    恢复任务时沿用检查点中的分片数，与已写入的分片结果文件对应
+    """
+    sink = None
+    try:
+        prompts_file = get_task_file(user_id, task_id, '.prompts.jsonl')
+        with open(prompts_file, 'rb') as f:
+            total_prompts = sum(1 for _ in f)
+        shards = shards or plan_shard_count(app.config['ANALYSIS_SHARDS'], concurrency, total_prompts)
         
-        # 保存结果到用户目录
-        user_upload_dir, user_results_dir = create_user_directories(user_id)
-        result_filename = f'{task_id}.json'
-        result_file = os.path.join(user_results_dir, result_filename)
-        
-        # 计算统计信息
-        successful_results = [r for r in results if r['status'] == 'success']
-        total_responses = len(successful_results)
-        
-        # 计算品牌提及统计
-        brand_mention_count = sum(1 for r in successful_results if r['analysis']['has_brand_mention'])
-        domain_mention_count = sum(1 for r in successful_results if r['analysis']['has_domain_mention'])
-        
-        # 计算每个品牌的提及率
-        brand_stats = {}
-        for brand in brands:
-            mention_count = sum(1 for r in successful_results if r['analysis']['brands'].get(brand, 0) == 1)
-            brand_stats[brand] = {
-                'mention_count': mention_count,
-                'mention_rate': round(mention_count / total_responses * 100, 2) if total_responses > 0 else 0
-            }
+        sink = open_task_results(user_id, task_id, brands, domains, shards)
         
-        # 计算每个域名的提及率
-        domain_stats = {}
-        for domain in domains:
-            mention_count = sum(1 for r in successful_results if r['analysis']['domains'].get(domain, 0) == 1)
-            domain_stats[domain] = {
-                'mention_count': mention_count,
-                'mention_rate': round(mention_count / total_responses * 100, 2) if total_responses > 0 else 0
-            }
-
-        analysis_summary = {
-            'task_id': task_id,
+        # 初始化任务状态
+        progress = TaskProgress(total_prompts, endpoint_key(api_config), concurrency, request_delay)
+        progress.preload(sink.successful, sink.failed)
+        progress.on_progress = lambda processed: db.report_progress(task_id, processed)
+        task_status[task_id] = progress
+        
+        if shards > 1:
+            # 分片执行：子进程各自写入分片结果文件，结束后合并
+            sink.close()
+            sink = run_sharded(
+                progress, shards, prompts_file, get_task_file(user_id, task_id, '.results.jsonl'),
+                api_config, brands, domains, concurrency, request_delay,
+                app.config['GLOBAL_RATE_LIMIT'] or None
+            )
+        else:
+            # 异步执行批量查询
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(
+                batch_query_llms(iter_prompts(prompts_file), api_config, brands, domains,
+                                 progress, sink, concurrency, request_delay)
+            )
+            loop.close()
+        
+        context = {
             'task_name': task_name,
-            'user_id': user_id,
-            'total_prompts': len(prompts),
-            'successful_queries': total_responses,
-            'brand_mention_count': brand_mention_count,  # 有品牌提及的回答数量
-            'domain_mention_count': domain_mention_count,  # 有域名提及的回答数量
-            'total_brand_mentions': brand_mention_count,  # 为了模板兼容性
-            'total_domain_mentions': domain_mention_count,  # 为了模板兼容性
-            'brand_mention_rate': round(brand_mention_count / total_responses * 100, 2) if total_responses > 0 else 0,
-            'domain_mention_rate': round(domain_mention_count / total_responses * 100, 2) if total_responses > 0 else 0,
+            'total_prompts': total_prompts,
             'brands': brands,
             'domains': domains,
-            'brand_stats': brand_stats,
-            'domain_stats': domain_stats,
-            'timestamp': datetime.now().isoformat(),
+            'concurrency': concurrency,
+            'request_delay': request_delay,
+            'shards': shards,
             'settings': {
                 'concurrency': concurrency,
                 'request_delay': request_delay,
+                'shards': shards,
                 'api_endpoint': api_config['endpoint'],
                 'model': api_config.get('model', 'default')
-            },
-            'results': results
+            }
         }
         
-        with open(result_file, 'w', encoding='utf-8') as f:
-            json.dump(analysis_summary, f, ensure_ascii=False, indent=2)
+        unfinished = sink.count < total_prompts
+        if progress.stop_reason == 'paused' and unfinished:
+            # 暂停：保存检查点，恢复时跳过已完成的prompt
+            sink.close()
+            with open(get_task_file(user_id, task_id, '.checkpoint.json'), 'w', encoding='utf-8') as f:
+                json.dump(context, f, ensure_ascii=False)
+            db.update_query_task(task_id, completed_prompts=sink.count, status='paused')
+            progress.finish('paused')
+            return
         
-        # 更新任务状态
-        db.update_query_task(
-            task_id, 
-            completed_prompts=len(results),
-            status='completed',
-            results_file=result_filename,
-            completed_at=datetime.now().isoformat()
-        )
-        
-        # 更新内存中的任务状态
-        if task_id in task_status:
-            task_status[task_id]['status'] = 'completed'
+        status = 'cancelled' if progress.stop_reason == 'cancelled' and unfinished else 'completed'
+        finalize_analysis(task_id, user_id, context, sink, status)
         
     except Exception as e:
         print(f"后台任务执行失败: {e}")
+        if sink:
+            sink.close()
         # 更新任务状态为失败
         if task_id in task_status:
-            task_status[task_id]['status'] = 'failed'
+            task_status[task_id].finish('failed')
         
         db.update_query_task(
             task_id, 
@@ -1053,8 +1409,17 @@ def processing_page(task_id):
                 brands = []
                 domains = []
         
-        # 预估完成时间（粗略估算：每个prompt 2秒 + 并发优化）
-        estimated_time = max(1, round(total_prompts * 2 / 3 / 60, 1))  # 假设3个并发
+        # 预估完成时间：运行中的任务用实时EWMA，否则按该API端点的历史吞吐估算
+        if task_id in task_status:
+            estimated_seconds = task_status[task_id].eta_seconds()
+        else:
+            api_config = db.get_api_config(task.get('api_config_id'), g.current_user['id'])
+            request_delay = task.get('request_delay')
+            estimated_seconds = estimate_task_seconds(
+                endpoint_key(api_config), total_prompts, task.get('concurrency') or 3,
+                0.5 if request_delay is None else request_delay
+            )
+        estimated_time = max(0.1, round(estimated_seconds / 60, 1))
         
         return render_template('processing.html',
                              task_id=task_id,
@@ -1071,6 +1436,209 @@ def processing_page(task_id):
         flash(f'加载等待页面失败: {str(e)}')
         return redirect(url_for('dashboard'))
 
+# 定时监测
+@app.route('/schedules', methods=['GET', 'POST'])
+@login_required
+def schedules():
+    """定时监测计划：对保存的prompt集合、API配置和品牌配置周期性运行"""
+    user_id = g.current_user['id']
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        api_config_id = request.form.get('api_config')
+        brands = [b.strip() for b in request.form.get('brands', '').split(',') if b.strip()]
+        domains = [d.strip() for d in request.form.get('domains', '').split(',') if d.strip()]
+        try:
+            interval_hours = float(request.form.get('interval_hours', 24))
+            concurrency = int(request.form.get('max_concurrent', 3))
+        except ValueError:
+            flash('运行间隔或并发数格式不正确')
+            return redirect(url_for('schedules'))
+        
+        if not name or not api_config_id:
+            flash('请填写计划名称并选择API配置')
+            return redirect(url_for('schedules'))
+        if not math.isfinite(interval_hours) or not MIN_INTERVAL_HOURS <= interval_hours <= MAX_INTERVAL_HOURS:
+            flash(f'运行间隔需在{MIN_INTERVAL_HOURS}到{MAX_INTERVAL_HOURS}小时之间')
+            return redirect(url_for('schedules'))
+        concurrency = min(max(concurrency, 1), MAX_CONCURRENCY)
+        if not brands and not domains:
+            flash('请至少输入一个品牌名称或域名进行监测')
+            return redirect(url_for('schedules'))
+        if not db.get_api_config(api_config_id, user_id):
+            flash('API配置不存在')
+            return redirect(url_for('schedules'))
+        
+        # prompt集合：文本输入或最近上传的文件
+        prompts_text = request.form.get('prompts_text', '').strip()
+        if prompts_text:
+            prompts = [line.strip() for line in prompts_text.split('\n') if line.strip()]
+        elif request.form.get('reuse_upload_id'):
+            try:
+                upload_id = int(request.form.get('reuse_upload_id'))
+            except ValueError:
+                flash('文件记录格式不正确')
+                return redirect(url_for('schedules'))
+            upload_record = next((u for u in db.get_recent_uploads(user_id, limit=10) if u['id'] == upload_id), None)
+            if not upload_record:
+                flash('文件记录不存在或已过期')
+                return redirect(url_for('schedules'))
+            user_upload_dir, _ = create_user_directories(user_id)
+            prompts = iter_prompt_file(os.path.join(user_upload_dir, upload_record['stored_filename']))
+        else:
+            prompts = []
+        
+        # prompt集合单独保存一份，原上传文件被清理后计划仍可运行
+        max_prompts = db.get_user_prompt_quota(user_id) or app.config['DEFAULT_PROMPT_QUOTA']
+        prompts_file = f'schedule_{uuid.uuid4()}.prompts.jsonl'
+        user_upload_dir, _ = create_user_directories(user_id)
+        prompts_path = os.path.join(user_upload_dir, prompts_file)
+        try:
+            total_prompts = spool_prompts(prompts_path, prompts, limit=max_prompts)
+        except Exception as e:
+            print(f"文件解析错误: {e}")
+            total_prompts = 0
+        if not total_prompts:
+            if os.path.exists(prompts_path):
+                os.remove(prompts_path)
+            flash('请输入提示词或选择已上传的文件')
+            return redirect(url_for('schedules'))
+        
+        brand_config_id = db.save_brand_config(user_id, brands, domains)
+        db.create_schedule(
+            user_id, name, prompts_file, total_prompts, api_config_id, brand_config_id,
+            interval_hours, first_run_time(app.config['SCHEDULER_POLL_INTERVAL']).isoformat(), concurrency
+        )
+        flash(f'定时监测计划已创建，每{interval_hours:g}小时运行一次')
+        return redirect(url_for('schedules'))
+    
+    return render_template('schedules.html',
+                         schedules=db.get_user_schedules(user_id),
+                         api_configs=db.get_user_api_configs(user_id),
+                         recent_uploads=db.get_recent_uploads(user_id, limit=10))
+
+@app.route('/schedules/<int:schedule_id>/toggle', methods=['POST'])
+@login_required
+def toggle_schedule(schedule_id):
+    """启用或停用计划"""
+    schedule = db.get_schedule(schedule_id, g.current_user['id'])
+    if not schedule:
+        return jsonify({'success': False, 'message': '计划不存在'}), 404
+    
+    is_active = not schedule['is_active']
+    # 重新启用时从现在开始计算下一次运行
+    next_run_at = next_run_time(schedule['interval_hours']).isoformat() if is_active else None
+    db.set_schedule_active(schedule_id, g.current_user['id'], is_active, next_run_at)
+    return jsonify({'success': True, 'message': '计划已启用' if is_active else '计划已停用'})
+
+@app.route('/schedules/<int:schedule_id>/delete', methods=['POST'])
+@login_required
+def delete_schedule(schedule_id):
+    """删除计划，已运行的任务和结果保留"""
+    schedule = db.get_schedule(schedule_id, g.current_user['id'])
+    if not schedule or not db.delete_schedule(schedule_id, g.current_user['id']):
+        return jsonify({'success': False, 'message': '计划不存在'}), 404
+    
+    prompts_path = get_user_file_path(g.current_user['id'], schedule['prompts_file'], file_type='upload')
+    if os.path.exists(prompts_path):
+        os.remove(prompts_path)
+    return jsonify({'success': True, 'message': '计划已删除'})
+
+@app.route('/api/schedules/<int:schedule_id>/delta')
+@login_required
+def get_schedule_delta(schedule_id):
+    """获取计划某次运行（默认最近一次）相对上一次运行的提及变化"""
+    schedule = db.get_schedule(schedule_id, g.current_user['id'])
+    if not schedule:
+        return jsonify({'error': '计划不存在'}), 404
+    
+    run = db.get_schedule_run(schedule_id, request.args.get('task_id'))
+    if not run:
+        return jsonify({'error': '该计划还没有完成的运行'}), 404
+    
+    try:
+        with open(get_task_file(g.current_user['id'], run['task_id'], '.delta.json'), 'r', encoding='utf-8') as f:
+            return jsonify(json.load(f))
+    except FileNotFoundError:
+        return jsonify({'error': '增量数据已被清理'}), 404
+
+def launch_scheduled_run(schedule):
+    """调度器回调：为到期的计划创建任务并在后台运行"""
+    user_id = schedule['user_id']
+    api_config = db.get_api_config(schedule['api_config_id'], user_id)
+    brand_config = db.get_brand_config(schedule['brand_config_id'], user_id)
+    if not api_config or not brand_config:
+        print(f"计划 {schedule['id']} 的API或品牌配置已不存在，跳过本次运行")
+        return
+    
+    source = get_user_file_path(user_id, schedule['prompts_file'], file_type='upload')
+    task_name = f"{schedule['name']}_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    task_id = db.create_query_task(
+        user_id, task_name, schedule['prompts_file'], schedule['total_prompts'],
+        schedule['api_config_id'], schedule['brand_config_id'], schedule_id=schedule['id'],
+        concurrency=schedule['concurrency'] or 3, request_delay=0.5
+    )
+    shutil.copyfile(source, get_task_file(user_id, task_id, '.prompts.jsonl'))
+    db.set_schedule_last_task(schedule['id'], task_id)
+    
+    thread = threading.Thread(
+        target=run_analysis_background,
+        args=(task_id, api_config, brand_config['brand_names'], brand_config['website_domains'],
+              user_id, task_name, schedule['concurrency'] or 3)
+    )
+    thread.daemon = True
+    thread.start()
+
+def backfill_trends():
+    """把趋势表上线前完成的任务写入趋势表，只需运行一次"""
+    for task in db.get_untrended_tasks():
+        try:
+            summary = load_result_summary(ensure_result_db(task['user_id'], task['task_id']))
+            db.save_task_trends(task['user_id'], task['task_id'],
+                                summary.get('timestamp') or task['completed_at'], summary)
+        except Exception as e:
+            print(f"回填趋势数据失败 ({task['task_id']}): {e}")
+
+def backfill_task_stats():
+    """把汇总表上线前完成的任务的提及统计写入任务表（同时更新用户汇总），只需运行一次"""
+    for task in db.get_tasks_without_stats():
+        try:
+            summary = load_result_summary(ensure_result_db(task['user_id'], task['task_id']))
+            db.update_query_task(task['task_id'], successful_queries=summary.get('successful_queries', 0),
+                                 brand_mention_count=summary.get('brand_mention_count', 0))
+        except Exception as e:
+            print(f"回填任务统计失败 ({task['task_id']}): {e}")
+
+monitor_scheduler = MonitorScheduler(db, launch_scheduled_run, app.config['SCHEDULER_POLL_INTERVAL'])
+
+maintenance_runner = MaintenanceRunner(
+    db, RetentionPolicy.from_env(), results_root='results', uploads_root=app.config['UPLOAD_FOLDER'],
+    interval=app.config['MAINTENANCE_INTERVAL']
+)
+
+_background_services_started = False
+_background_services_lock = threading.Lock()
+
+def start_background_services():
+    """启动回填、定时监测调度器和后台维护线程，每个进程只启动一次
+
+    只在服务进程中调用（python app.py 或 wsgi.py），导入app模块时不会启动：
+    分片子进程（spawn方式）会以 __mp_main__ 重新导入本模块，不能在子进程中调度任务或执行清理
+    """
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        _background_services_started = True
+    threading.Thread(target=backfill_trends, name='trend-backfill', daemon=True).start()
+    threading.Thread(target=backfill_task_stats, name='stats-backfill', daemon=True).start()
+    if app.config['SCHEDULER_ENABLED']:
+        monitor_scheduler.start()
+    if app.config['MAINTENANCE_ENABLED']:
+        maintenance_runner.start()
+
 if __name__ == '__main__':
+    # debug模式下重载器的父进程只负责监视文件，后台服务只在实际处理请求的子进程中启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     # 在生产环境中，这里会被注释掉，使用 gunicorn 启动
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,65 @@
+"""
+导出产物缓存
+已完成任务的结果不再变化，按结果文件的内容哈希缓存导出文件和摘要，配合ETag/Last-Modified做条件请求
+"""
+import os
+import shutil
+import hashlib
+from functools import lru_cache
+
+from result_store import load_result_summary
+
+# 导出格式或页面结构变化时递增，使客户端缓存的旧ETag失效
+ARTIFACT_VERSION = 2
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """逐块计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_etag(content_hash, variant):
+    """同一结果的不同表示（页面、CSV、gzip后的CSV……）使用不同的强ETag"""
+    return f'{content_hash[:32]}-v{ARTIFACT_VERSION}-{variant}'
+
+
+def get_artifact_dir(results_dir, content_hash):
+    return os.path.join(results_dir, 'artifacts', content_hash)
+
+
+def get_artifact_path(results_dir, content_hash, name):
+    """产物路径，例如 results/<user_id>/artifacts/<hash>/results.csv"""
+    artifact_dir = get_artifact_dir(results_dir, content_hash)
+    os.makedirs(artifact_dir, exist_ok=True)
+    return os.path.join(artifact_dir, name)
+
+
+def remove_artifacts(results_dir, content_hash):
+    """结果文件被重新生成后删除旧哈希下的产物"""
+    shutil.rmtree(get_artifact_dir(results_dir, content_hash), ignore_errors=True)
+
+
+def tee_artifact(path, chunks):
+    """边输出字节块边写入产物文件；完整输出后才落盘，中途断开时丢弃"""
+    tmp_path = f'{path}.{os.getpid()}.{id(chunks)}.tmp'
+    completed = False
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@lru_cache(maxsize=256)
+def load_cached_summary(content_hash, db_path):
+    """按内容哈希缓存结果摘要，同一结果重复查看时不再读取结果库"""
+    return load_result_summary(db_path)
@@ -12,8 +12,8 @@ def login_required(f):
         if 'user_id' not in session:
             return redirect(url_for('login'))
         
-        # 验证session是否有效
-        user = db.get_user_by_id(session['user_id'])
+        # 验证session是否有效（before_request中已加载过的用户直接复用）
+        user = get_current_user()
         if not user:
             session.clear()
             return redirect(url_for('login'))
@@ -23,10 +23,13 @@ def login_required(f):
     return decorated_function
 
 def get_current_user():
-    """获取当前登录用户"""
-    if 'user_id' in session:
-        return db.get_user_by_id(session['user_id'])
-    return None
+    """获取当前登录用户，同一请求内只查询一次"""
+    if 'user_id' not in session:
+        return None
+    if g.get('_user_id') != session['user_id']:
+        g._user = db.get_user_by_id(session['user_id'])
+        g._user_id = session['user_id']
+    return g._user
 
 def create_user_directories(user_id):
     """为用户创建专属目录"""
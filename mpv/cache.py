@@ -0,0 +1,45 @@
+"""
+进程内缓存
+带过期时间的LRU缓存，用于缓存频繁读取、很少变化的数据库记录；多进程部署时各进程各自缓存，过期时间决定最长的不一致时间
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """线程安全的TTL+LRU缓存，超过maxsize时淘汰最久未使用的条目；ttl为None时条目不过期"""
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,110 @@
+"""
+结果文件压缩
+优先使用zstd（可选依赖zstandard，支持用历史回复训练的字典），未安装时退回gzip
+读取时按扩展名选择解压方式，zstd帧头中记录了字典ID，解压时自动加载对应字典
+"""
+import io
+import os
+import gzip
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+COMPRESSION_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+ZSTD_LEVEL = 10
+ZSTD_FRAME_HEADER_MAX = 18  # zstd帧头最大长度，读取字典ID用
+GZIP_LEVEL = 6
+
+# 字典训练参数：样本太少时训练出的字典没有意义
+DICT_SIZE = 112640
+MIN_DICT_SAMPLES = 200
+
+
+def resolve_compression(name):
+    """配置值转换为实际使用的压缩方式：auto优先zstd，zstandard未安装时退回gzip"""
+    name = (name or 'auto').lower()
+    if name in ('auto', 'zstd'):
+        return 'zstd' if zstd is not None else 'gzip'
+    if name not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'不支持的压缩方式: {name}')
+    return name
+
+
+def find_compressed(path):
+    """查找路径对应的已存在文件（原文件或任一压缩版本），不存在时返回None"""
+    for suffix in ('', '.zst', '.gz'):
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return None
+
+
+def get_dict_dir(results_dir):
+    return os.path.join(results_dir, 'dicts')
+
+
+def get_current_dictionary(results_dir):
+    """返回目录下最新训练的zstd字典，没有时返回None"""
+    if zstd is None:
+        return None
+    dict_dir = get_dict_dir(results_dir)
+    if not os.path.isdir(dict_dir):
+        return None
+    paths = [os.path.join(dict_dir, name) for name in os.listdir(dict_dir) if name.endswith('.zdict')]
+    if not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime), 'rb') as f:
+        return zstd.ZstdCompressionDict(f.read())
+
+
+def _load_dictionary(results_dir, dict_id):
+    path = os.path.join(get_dict_dir(results_dir), f'{dict_id}.zdict')
+    with open(path, 'rb') as f:
+        return zstd.ZstdCompressionDict(f.read())
+
+
+def train_dictionary(results_dir, samples):
+    """用典型结果样本（字节串列表）训练zstd字典并保存，样本不足或未安装zstandard时返回None
+
+    字典按ID保存为 dicts/<dict_id>.zdict，旧字典保留，用它压缩的文件仍然可以读取
+    """
+    if zstd is None or len(samples) < MIN_DICT_SAMPLES:
+        return None
+    try:
+        dictionary = zstd.train_dictionary(DICT_SIZE, samples)
+    except zstd.ZstdError as e:
+        print(f"训练压缩字典失败: {e}")
+        return None
+    dict_dir = get_dict_dir(results_dir)
+    os.makedirs(dict_dir, exist_ok=True)
+    with open(os.path.join(dict_dir, f'{dictionary.dict_id()}.zdict'), 'wb') as f:
+        f.write(dictionary.as_bytes())
+    return dictionary
+
+
+def open_compressed_write(path, compression, dictionary=None):
+    """以文本方式写入（可选压缩的）文件"""
+    if compression == 'zstd':
+        compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary)
+        writer = compressor.stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    return open(path, 'w', encoding='utf-8')
+
+
+def open_compressed_read(path):
+    """以文本方式读取文件，按扩展名透明解压"""
+    if path.endswith('.zst'):
+        if zstd is None:
+            raise RuntimeError('结果文件使用zstd压缩，但未安装zstandard')
+        with open(path, 'rb') as f:
+            dict_id = zstd.get_frame_parameters(f.read(ZSTD_FRAME_HEADER_MAX)).dict_id
+        dictionary = _load_dictionary(os.path.dirname(path), dict_id) if dict_id else None
+        reader = zstd.ZstdDecompressor(dict_data=dictionary).stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
@@ -1,148 +1,444 @@
 """
 数据库模型和用户管理
+SQL按SQLite写法编写，连接和方言差异由db_backends中的后端处理
 """
-import sqlite3
+import os
 import hashlib
 import uuid
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+from db_backends import create_backend
+from migrations import apply_migrations
+from cache import TTLCache
+from write_behind import ProgressBuffer
+
+
+def _load_json_list(value):
+    """解析存储的JSON列表字段，空值或无法解析时返回空列表"""
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+
+def brand_config_hash(brand_names, website_domains, competitors):
+    """品牌配置的内容哈希，按解析后的列表计算（保留顺序），与JSON的空格和转义写法无关"""
+    content = [_load_json_list(brand_names), _load_json_list(website_domains), _load_json_list(competitors)]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _parse_brand_config(row):
+    config = dict(row)
+    config['brand_names'] = _load_json_list(config['brand_names'])
+    config['website_domains'] = _load_json_list(config['website_domains'])
+    config['competitors'] = _load_json_list(config['competitors'])
+    return config
+
+
+# 用户汇总表中按任务状态计数的列，暂停的任务也算进行中
+SUMMARY_STATUS_COLUMNS = {
+    'pending': 'active_tasks',
+    'paused': 'active_tasks',
+    'completed': 'completed_tasks',
+    'failed': 'failed_tasks',
+    'cancelled': 'cancelled_tasks',
+}
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+SUMMARY_TASK_FIELDS = 'user_id, status, total_prompts, completed_prompts, successful_queries, brand_mention_count'
+
+
+def _task_contribution(task):
+    """一个任务对用户汇总各列的贡献；任务变化时按新旧贡献之差更新汇总，不需要重新统计"""
+    contribution = {
+        'total_tasks': 1,
+        'total_prompts': task['total_prompts'] or 0,
+        'successful_queries': task['successful_queries'] or 0,
+        'brand_mentions': task['brand_mention_count'] or 0,
+    }
+    column = SUMMARY_STATUS_COLUMNS.get(task['status'])
+    if column:
+        contribution[column] = 1
+    if task['status'] in FINISHED_STATUSES:
+        contribution['processed_prompts'] = task['completed_prompts'] or 0
+    return contribution
+
+
+def _copy_brand_config(config):
+    """返回缓存配置的副本，调用方修改列表不会影响缓存"""
+    copied = dict(config)
+    for key in ('brand_names', 'website_domains', 'competitors'):
+        copied[key] = list(copied[key])
+    return copied
+
+
+# 热点查询的SQL，migrations.py用同样的语句检查执行计划，修改这里即同时修改检查
+API_CONFIGS_SQL = 'SELECT * FROM api_configs WHERE user_id = ? ORDER BY is_default DESC, created_at DESC'
+API_CONFIG_IN_USE_SQL = 'SELECT COUNT(*) FROM query_history WHERE api_config_id = ?'
+FIND_BRAND_CONFIG_SQL = 'SELECT id FROM brand_configs WHERE user_id = ? AND content_hash = ? ORDER BY created_at, id LIMIT 1'
+USER_BRAND_CONFIGS_SQL = '''
+    SELECT MIN(id) AS id, MAX(created_at) AS last_created FROM brand_configs
+    WHERE user_id = ? GROUP BY content_hash ORDER BY last_created DESC
+'''
+TASK_COUNTS_SQL = 'SELECT status, COUNT(*) AS count FROM query_history WHERE user_id = ? GROUP BY status'
+USER_SUMMARY_SQL = 'SELECT * FROM user_summaries WHERE user_id = ?'
+# 参数: (user_id, user_id, updated_at, user_id)
+REBUILD_USER_SUMMARY_SQL = '''
+    INSERT INTO user_summaries (user_id, total_tasks, active_tasks, completed_tasks, failed_tasks,
+                                cancelled_tasks, total_prompts, processed_prompts, successful_queries,
+                                brand_mentions, api_configs, updated_at)
+    SELECT ?, COUNT(*),
+           COALESCE(SUM(CASE WHEN status IN ('pending', 'paused') THEN 1 ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN status = 'cancelled' THEN 1 ELSE 0 END), 0),
+           COALESCE(SUM(total_prompts), 0),
+           COALESCE(SUM(CASE WHEN status IN ('completed', 'failed', 'cancelled')
+                             THEN completed_prompts ELSE 0 END), 0),
+           COALESCE(SUM(successful_queries), 0),
+           COALESCE(SUM(brand_mention_count), 0),
+           (SELECT COUNT(*) FROM api_configs WHERE user_id = ?), ?
+    FROM query_history WHERE user_id = ?
+    ON CONFLICT (user_id) DO NOTHING
+'''
+USER_SCHEDULES_SQL = '''
+    SELECT ms.*, ac.name as api_name,
+           sr.changed_count, sr.gained_count, sr.lost_count
+    FROM monitor_schedules ms
+    LEFT JOIN api_configs ac ON ms.api_config_id = ac.id
+    LEFT JOIN schedule_runs sr ON sr.task_id = ms.last_task_id
+    WHERE ms.user_id = ?
+    ORDER BY ms.created_at DESC
+'''
+DUE_SCHEDULES_SQL = 'SELECT * FROM monitor_schedules WHERE is_active = 1 AND next_run_at <= ? ORDER BY next_run_at'
+# 参数: (schedule_id, task_id, task_id)
+PREVIOUS_SCHEDULE_TASK_SQL = '''
+    SELECT * FROM query_history
+    WHERE schedule_id = ? AND status = 'completed' AND task_id != ?
+      AND created_at < (SELECT created_at FROM query_history WHERE task_id = ?)
+    ORDER BY created_at DESC
+    LIMIT 1
+'''
+RECENT_UPLOADS_SQL = '''
+    SELECT * FROM upload_history
+    WHERE user_id = ?
+    ORDER BY upload_time DESC
+    LIMIT ?
+'''
+# 参数: (user_id, user_id, keep_count)
+CLEANUP_OLD_UPLOADS_SQL = '''
+    DELETE FROM upload_history
+    WHERE user_id = ? AND id NOT IN (
+        SELECT id FROM upload_history
+        WHERE user_id = ?
+        ORDER BY upload_time DESC
+        LIMIT ?
+    )
+'''
+DELETE_EXPIRED_SESSIONS_SQL = '''
+    DELETE FROM user_sessions WHERE id IN (
+        SELECT id FROM user_sessions WHERE expires_at <= ? LIMIT ?
+    )
+'''
+EXPIRED_TASKS_SQL = f'''
+    SELECT task_id, user_id, result_hash FROM query_history
+    WHERE created_at < ? AND status IN ({', '.join(f"'{status}'" for status in FINISHED_STATUSES)})
+    ORDER BY created_at LIMIT ?
+'''
+
+
+def build_history_query(user_id, limit=50, before=None, status=None, name_prefix=None, api_config_id=None):
+    """get_user_query_history的SQL和参数
+
+    before: 上一页最后一条的 (created_at, id)，只返回排在它之后的记录（键集分页，不使用OFFSET）
+    status / name_prefix / api_config_id: 按状态、任务名前缀、API配置筛选，各自有(user_id, 筛选列, ...)索引；
+    前缀筛选只对名称匹配的记录排序
+    """
+    conditions = ['qh.user_id = ?']
+    params = [user_id]
+    if status:
+        conditions.append('qh.status = ?')
+        params.append(status)
+    if api_config_id:
+        conditions.append('qh.api_config_id = ?')
+        params.append(api_config_id)
+    if name_prefix:
+        # 前缀匹配写成范围条件才能使用索引（LIKE默认不区分大小写，用不上普通索引）
+        conditions.append('qh.task_name >= ? AND qh.task_name < ?')
+        params.extend([name_prefix, name_prefix[:-1] + chr(ord(name_prefix[-1]) + 1)])
+    if before:
+        conditions.append('(qh.created_at, qh.id) < (?, ?)')
+        params.extend(before)
+    sql = f'''
+        SELECT qh.*, ac.name as api_name, ac.endpoint
+        FROM query_history qh
+        LEFT JOIN api_configs ac ON qh.api_config_id = ac.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY qh.created_at DESC, qh.id DESC
+        LIMIT ?
+    '''
+    return sql, (*params, limit)
+
+
+def build_upload_history_query(user_id, limit=50, before=None):
+    """get_user_upload_history的SQL和参数，before为上一页最后一条的 (upload_time, id)"""
+    conditions = 'user_id = ?'
+    params = [user_id]
+    if before:
+        conditions += ' AND (upload_time, id) < (?, ?)'
+        params.extend(before)
+    sql = f'''
+        SELECT * FROM upload_history
+        WHERE {conditions}
+        ORDER BY upload_time DESC, id DESC
+        LIMIT ?
+    '''
+    return sql, (*params, limit)
+
 
 class Database:
-    def __init__(self, db_path='geo_insight.db'):
-        self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """初始化数据库表"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 用户表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                last_login TEXT,
-                is_active INTEGER DEFAULT 1
-            )
-        ''')
-        
-        # API配置表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_configs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                endpoint TEXT NOT NULL,
-                api_key TEXT NOT NULL,
-                model TEXT,
-                is_default INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # 品牌配置表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS brand_configs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                brand_names TEXT NOT NULL,
-                website_domains TEXT,
-                competitors TEXT,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # 查询历史表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS query_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                task_id TEXT UNIQUE NOT NULL,
-                task_name TEXT,
-                prompts_file TEXT,
-                total_prompts INTEGER,
-                completed_prompts INTEGER DEFAULT 0,
-                status TEXT DEFAULT 'pending',
-                api_config_id INTEGER,
-                brand_config_id INTEGER,
-                results_file TEXT,
-                created_at TEXT NOT NULL,
-                completed_at TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (api_config_id) REFERENCES api_configs (id),
-                FOREIGN KEY (brand_config_id) REFERENCES brand_configs (id)
-            )
-        ''')
-        
-        # 会话表（简单的session管理）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                session_token TEXT UNIQUE NOT NULL,
-                expires_at TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # 文件上传历史表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS upload_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                original_filename TEXT NOT NULL,
-                stored_filename TEXT NOT NULL,
-                file_size INTEGER,
-                prompts_count INTEGER,
-                upload_time TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+    def __init__(self, db_path=None, migrate=True, backend=None):
+        """db_path: 指定SQLite文件；都未指定时按 GEO_DATABASE_URL 创建后端（默认当前目录下的geo_insight.db）"""
+        if backend is None:
+            backend = create_backend(f'sqlite:///{db_path}' if db_path else os.environ.get('GEO_DATABASE_URL'))
+        self.backend = backend
+        # 按用户ID缓存用户记录，修改密码、配额或停用用户时失效
+        self.user_cache = TTLCache(maxsize=1024, ttl=float(os.environ.get('GEO_USER_CACHE_TTL', 30)))
+        # 逐条上报的任务进度合并后批量写入
+        self.progress_buffer = ProgressBuffer(
+            self._write_progress,
+            flush_interval=float(os.environ.get('GEO_PROGRESS_FLUSH_INTERVAL', 2)),
+            flush_count=int(os.environ.get('GEO_PROGRESS_FLUSH_COUNT', 200))
+        )
+        # 按ID缓存解析后的品牌配置，配置保存后不再修改，只按LRU淘汰
+        self.brand_config_cache = TTLCache(maxsize=4096, ttl=None)
+        self.init_database(migrate)
     
-    def get_connection(self):
-        """获取数据库连接，带重试机制"""
-        import time
-        max_retries = 3
+    def init_database(self, migrate=True):
+        """初始化数据库表，然后执行migrations.py中尚未执行的结构迁移"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        for attempt in range(max_retries):
-            try:
-                conn = sqlite3.connect(self.db_path, timeout=30.0)
-                conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
-                # 启用WAL模式以提高并发性能
-                conn.execute('PRAGMA journal_mode=WAL')
-                conn.execute('PRAGMA busy_timeout=30000')  # 30秒超时
-                return conn
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    time.sleep(0.1 * (attempt + 1))  # 递增延迟
-                    continue
-                raise e
-    
-    # 上下文管理器方法
-    def __enter__(self):
-        """上下文管理器入口"""
-        self.conn = self.get_connection()
-        return self.conn
-    
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """上下文管理器出口"""
-        if hasattr(self, 'conn') and self.conn:
-            if exc_type is None:
-                self.conn.commit()
-            else:
-                self.conn.rollback()
-            self.conn.close()
+            # 用户表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    last_login TEXT,
+                    is_active INTEGER DEFAULT 1,
+                    prompt_quota INTEGER
+                )
+            ''')
+        
+            # 旧数据库补充新增的列
+            self.backend.ensure_column(cursor, 'users', 'prompt_quota', 'INTEGER')
+        
+            # API配置表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS api_configs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    api_key TEXT NOT NULL,
+                    model TEXT,
+                    is_default INTEGER DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+        
+            # 品牌配置表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS brand_configs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    brand_names TEXT NOT NULL,
+                    website_domains TEXT,
+                    competitors TEXT,
+                    created_at TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            self.backend.ensure_column(cursor, 'brand_configs', 'content_hash', 'TEXT')
+            self._backfill_brand_config_hashes(cursor)
+        
+            # 查询历史表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS query_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    task_id TEXT UNIQUE NOT NULL,
+                    task_name TEXT,
+                    prompts_file TEXT,
+                    total_prompts INTEGER,
+                    completed_prompts INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    api_config_id INTEGER,
+                    brand_config_id INTEGER,
+                    results_file TEXT,
+                    created_at TEXT NOT NULL,
+                    completed_at TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (api_config_id) REFERENCES api_configs (id),
+                    FOREIGN KEY (brand_config_id) REFERENCES brand_configs (id)
+                )
+            ''')
+            self.backend.ensure_column(cursor, 'query_history', 'schedule_id', 'INTEGER')
+            self.backend.ensure_column(cursor, 'query_history', 'result_hash', 'TEXT')
+            self.backend.ensure_column(cursor, 'query_history', 'search_indexed', 'INTEGER DEFAULT 0')
+            self.backend.ensure_column(cursor, 'query_history', 'trend_recorded', 'INTEGER DEFAULT 0')
+            self.backend.ensure_column(cursor, 'query_history', 'successful_queries', 'INTEGER')
+            self.backend.ensure_column(cursor, 'query_history', 'brand_mention_count', 'INTEGER')
+            # 任务的并发和请求间隔，任务开始运行前也能按这些设置预估耗时
+            self.backend.ensure_column(cursor, 'query_history', 'concurrency', 'INTEGER')
+            self.backend.ensure_column(cursor, 'query_history', 'request_delay', 'REAL')
+            
+            # 每个API端点（端点+模型）的历史延迟和单并发吞吐（EWMA），用于预估新任务耗时，多个进程共享
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS endpoint_stats (
+                    endpoint TEXT PRIMARY KEY,
+                    latency REAL,
+                    throughput REAL,
+                    samples INTEGER DEFAULT 0,
+                    updated_at TEXT
+                )
+            ''')
+            
+            # 每个用户一行的汇总，任务和API配置变化时增量更新，仪表板只读这一行
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_summaries (
+                    user_id INTEGER PRIMARY KEY,
+                    total_tasks INTEGER DEFAULT 0,
+                    active_tasks INTEGER DEFAULT 0,
+                    completed_tasks INTEGER DEFAULT 0,
+                    failed_tasks INTEGER DEFAULT 0,
+                    cancelled_tasks INTEGER DEFAULT 0,
+                    total_prompts INTEGER DEFAULT 0,
+                    processed_prompts INTEGER DEFAULT 0,
+                    successful_queries INTEGER DEFAULT 0,
+                    brand_mentions INTEGER DEFAULT 0,
+                    api_configs INTEGER DEFAULT 0,
+                    updated_at TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+        
+            # 定时监测计划表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS monitor_schedules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    prompts_file TEXT NOT NULL,
+                    total_prompts INTEGER,
+                    api_config_id INTEGER NOT NULL,
+                    brand_config_id INTEGER NOT NULL,
+                    interval_hours REAL NOT NULL,
+                    concurrency INTEGER DEFAULT 3,
+                    is_active INTEGER DEFAULT 1,
+                    next_run_at TEXT NOT NULL,
+                    last_run_at TEXT,
+                    last_task_id TEXT,
+                    created_at TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (api_config_id) REFERENCES api_configs (id),
+                    FOREIGN KEY (brand_config_id) REFERENCES brand_configs (id)
+                )
+            ''')
+        
+            # 定时监测每次运行相对上一次运行的变化
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schedule_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    schedule_id INTEGER NOT NULL,
+                    task_id TEXT UNIQUE NOT NULL,
+                    previous_task_id TEXT,
+                    changed_count INTEGER DEFAULT 0,
+                    gained_count INTEGER DEFAULT 0,
+                    lost_count INTEGER DEFAULT 0,
+                    delta_file TEXT,
+                    created_at TEXT NOT NULL,
+                    FOREIGN KEY (schedule_id) REFERENCES monitor_schedules (id)
+                )
+            ''')
+        
+            # 提及趋势：每个已完成任务的每个品牌/域名一行，趋势图只读这张表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS mention_trends (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    target_kind TEXT NOT NULL,
+                    target_name TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    task_timestamp TEXT NOT NULL,
+                    mention_count INTEGER NOT NULL,
+                    mention_rate REAL NOT NULL,
+                    successful_queries INTEGER NOT NULL,
+                    UNIQUE (task_id, target_kind, target_name),
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_mention_trends_target
+                ON mention_trends (user_id, target_kind, target_name, task_timestamp)
+            ''')
+        
+            # 全文检索：search_docs记录每条结果的归属，result_search的rowid与其id一致
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS search_docs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    task_id TEXT NOT NULL,
+                    result_index INTEGER NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_docs_task ON search_docs (task_id)')
+            self.backend.create_fulltext_table(cursor)
+        
+            # 会话表（简单的session管理）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    session_token TEXT UNIQUE NOT NULL,
+                    expires_at TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+        
+            # 文件上传历史表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upload_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    original_filename TEXT NOT NULL,
+                    stored_filename TEXT NOT NULL,
+                    file_size INTEGER,
+                    prompts_count INTEGER,
+                    upload_time TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            if migrate:
+                apply_migrations(self.backend, conn)
+    
+    def connection(self):
+        """从后端的连接池取得连接的上下文管理器，正常退出时提交，异常时回滚，结束后归还连接"""
+        return self.backend.connection()
+    
+    def check_health(self):
+        """检查后端连接池，返回连接池状态"""
+        return self.backend.check_health()
     
     # 用户管理方法
     def create_user(self, username, email, password):
@@ -150,60 +446,94 @@ class Database:
         password_hash = generate_password_hash(password)
         created_at = datetime.now().isoformat()
         
-        conn = self.get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)',
-                (username, email, password_hash, created_at)
-            )
-            user_id = cursor.lastrowid
-            conn.commit()
-            return user_id
-        except sqlite3.IntegrityError as e:
-            print(f"用户创建失败: {e}")
-            return None
-        except Exception as e:
-            print(f"数据库错误: {e}")
-            return None
-        finally:
-            conn.close()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                return self.backend.insert(
+                    cursor,
+                    'INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)',
+                    (username, email, password_hash, created_at)
+                )
+            except self.backend.IntegrityError as e:
+                print(f"用户创建失败: {e}")
+                return None
+            except Exception as e:
+                print(f"数据库错误: {e}")
+                return None
     
     def authenticate_user(self, username, password):
         """验证用户登录"""
-        conn = self.get_connection()
-        try:
-            cursor = conn.cursor()
-            user = cursor.execute(
-                'SELECT * FROM users WHERE username = ? AND is_active = 1',
-                (username,)
-            ).fetchone()
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                user = cursor.execute(
+                    'SELECT * FROM users WHERE username = ? AND is_active = 1',
+                    (username,)
+                ).fetchone()
             
-            if user and check_password_hash(user['password_hash'], password):
+                if not user or not check_password_hash(user['password_hash'], password):
+                    return None
                 # 在同一个连接中更新最后登录时间
                 cursor.execute(
                     'UPDATE users SET last_login = ? WHERE id = ?',
                     (datetime.now().isoformat(), user['id'])
                 )
-                conn.commit()
-                return dict(user)
-            return None
-        except Exception as e:
-            print(f"数据库认证错误: {e}")
-            return None
-        finally:
-            conn.close()
+            except Exception as e:
+                print(f"数据库认证错误: {e}")
+                return None
+        # 提交后再清除缓存，避免其他线程在提交前重新缓存旧的用户信息
+        self.user_cache.invalidate(user['id'])
+        return dict(user)
     
     def get_user_by_id(self, user_id):
-        """根据ID获取用户信息"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        user = cursor.execute(
-            'SELECT * FROM users WHERE id = ? AND is_active = 1',
-            (user_id,)
-        ).fetchone()
-        conn.close()
-        return dict(user) if user else None
+        """根据ID获取用户信息，优先读取进程内缓存；返回副本，调用方修改不会影响缓存"""
+        user = self.user_cache.get(user_id)
+        if user is None:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                user = cursor.execute(
+                    'SELECT * FROM users WHERE id = ? AND is_active = 1',
+                    (user_id,)
+                ).fetchone()
+            if not user:
+                return None
+            user = dict(user)
+            self.user_cache.set(user_id, user)
+        return dict(user)
+    
+    def set_user_active(self, user_id, is_active):
+        """启用或停用用户，停用时同时删除该用户的所有会话"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET is_active = ? WHERE id = ?',
+                (int(is_active), user_id)
+            )
+            updated = cursor.rowcount > 0
+            if not is_active:
+                cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
+        self.user_cache.invalidate(user_id)
+        return updated
+    
+    def get_user_prompt_quota(self, user_id):
+        """获取用户单个任务的prompt配额，未设置时返回None"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute(
+                'SELECT prompt_quota FROM users WHERE id = ?',
+                (user_id,)
+            ).fetchone()
+        return row['prompt_quota'] if row else None
+    
+    def set_user_prompt_quota(self, user_id, prompt_quota):
+        """设置用户单个任务的prompt配额，None表示使用系统默认值"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET prompt_quota = ? WHERE id = ?',
+                (prompt_quota, user_id)
+            )
+        self.user_cache.invalidate(user_id)
     
     # Session管理
     def create_session(self, user_id):
@@ -213,421 +543,895 @@ class Database:
         # Session 7天过期
         expires_at = datetime.now().replace(hour=23, minute=59, second=59).isoformat()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO user_sessions (user_id, session_token, expires_at, created_at) VALUES (?, ?, ?, ?)',
-            (user_id, session_token, expires_at, created_at)
-        )
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO user_sessions (user_id, session_token, expires_at, created_at) VALUES (?, ?, ?, ?)',
+                (user_id, session_token, expires_at, created_at)
+            )
         return session_token
     
     def get_user_by_session(self, session_token):
         """根据session token获取用户"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        result = cursor.execute('''
-            SELECT u.* FROM users u
-            JOIN user_sessions s ON u.id = s.user_id
-            WHERE s.session_token = ? AND s.expires_at > ? AND u.is_active = 1
-        ''', (session_token, datetime.now().isoformat())).fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            result = cursor.execute('''
+                SELECT u.* FROM users u
+                JOIN user_sessions s ON u.id = s.user_id
+                WHERE s.session_token = ? AND s.expires_at > ? AND u.is_active = 1
+            ''', (session_token, datetime.now().isoformat())).fetchone()
         return dict(result) if result else None
     
     def delete_session(self, session_token):
         """删除会话（登出）"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
     
     def change_password(self, user_id, old_password, new_password):
         """修改用户密码"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # 首先验证旧密码
-            user = cursor.execute(
-                'SELECT password_hash FROM users WHERE id = ?',
-                (user_id,)
-            ).fetchone()
-            
-            if not user:
-                return False, "用户不存在"
+            try:
+                # 首先验证旧密码
+                user = cursor.execute(
+                    'SELECT password_hash FROM users WHERE id = ?',
+                    (user_id,)
+                ).fetchone()
             
-            if not check_password_hash(user[0], old_password):
-                return False, "当前密码错误"
+                if not user:
+                    return False, "用户不存在"
             
-            # 更新密码
-            new_password_hash = generate_password_hash(new_password)
-            cursor.execute(
-                'UPDATE users SET password_hash = ? WHERE id = ?',
-                (new_password_hash, user_id)
-            )
+                if not check_password_hash(user[0], old_password):
+                    return False, "当前密码错误"
             
-            conn.commit()
-            return True, "密码修改成功"
-        except Exception as e:
-            conn.rollback()
-            return False, f"密码修改失败: {str(e)}"
-        finally:
-            conn.close()
+                # 更新密码
+                new_password_hash = generate_password_hash(new_password)
+                cursor.execute(
+                    'UPDATE users SET password_hash = ? WHERE id = ?',
+                    (new_password_hash, user_id)
+                )
+            except Exception as e:
+                conn.rollback()
+                return False, f"密码修改失败: {str(e)}"
+        
+        # 提交后再清除缓存，避免其他线程在提交前重新缓存旧记录
+        self.user_cache.invalidate(user_id)
+        return True, "密码修改成功"
     
     # API配置管理
     def save_api_config(self, user_id, name, endpoint, api_key, model=None, is_default=False):
         """保存API配置"""
         created_at = datetime.now().isoformat()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # 如果设置为默认，先取消其他默认配置
-        if is_default:
-            cursor.execute(
-                'UPDATE api_configs SET is_default = 0 WHERE user_id = ?',
-                (user_id,)
-            )
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO api_configs (user_id, name, endpoint, api_key, model, is_default, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, name, endpoint, api_key, model, int(is_default), created_at))
+            # 如果设置为默认，先取消其他默认配置
+            if is_default:
+                cursor.execute(
+                    'UPDATE api_configs SET is_default = 0 WHERE user_id = ?',
+                    (user_id,)
+                )
         
-        config_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            config_id = self.backend.insert(cursor, '''
+                INSERT INTO api_configs (user_id, name, endpoint, api_key, model, is_default, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, name, endpoint, api_key, model, int(is_default), created_at))
+            self._apply_summary_delta(cursor, user_id, new={'api_configs': 1})
         return config_id
     
     def get_user_api_configs(self, user_id):
         """获取用户的API配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        configs = cursor.execute(
-            'SELECT * FROM api_configs WHERE user_id = ? ORDER BY is_default DESC, created_at DESC',
-            (user_id,)
-        ).fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            configs = cursor.execute(API_CONFIGS_SQL, (user_id,)).fetchall()
         return [dict(config) for config in configs]
     
     def get_api_config(self, config_id, user_id):
         """获取特定的API配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        config = cursor.execute(
-            'SELECT * FROM api_configs WHERE id = ? AND user_id = ?',
-            (config_id, user_id)
-        ).fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            config = cursor.execute(
+                'SELECT * FROM api_configs WHERE id = ? AND user_id = ?',
+                (config_id, user_id)
+            ).fetchone()
         return dict(config) if config else None
     
     def set_default_api_config(self, config_id, user_id):
         """设置默认API配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # 验证配置是否属于用户
-            config = cursor.execute(
-                'SELECT id FROM api_configs WHERE id = ? AND user_id = ?',
-                (config_id, user_id)
-            ).fetchone()
+            try:
+                # 验证配置是否属于用户
+                config = cursor.execute(
+                    'SELECT id FROM api_configs WHERE id = ? AND user_id = ?',
+                    (config_id, user_id)
+                ).fetchone()
             
-            if not config:
-                return False
+                if not config:
+                    return False
             
-            # 取消其他默认配置
-            cursor.execute(
-                'UPDATE api_configs SET is_default = 0 WHERE user_id = ?',
-                (user_id,)
-            )
+                # 取消其他默认配置
+                cursor.execute(
+                    'UPDATE api_configs SET is_default = 0 WHERE user_id = ?',
+                    (user_id,)
+                )
             
-            # 设置新的默认配置
-            cursor.execute(
-                'UPDATE api_configs SET is_default = 1 WHERE id = ? AND user_id = ?',
-                (config_id, user_id)
-            )
+                # 设置新的默认配置
+                cursor.execute(
+                    'UPDATE api_configs SET is_default = 1 WHERE id = ? AND user_id = ?',
+                    (config_id, user_id)
+                )
             
-            conn.commit()
-            return True
-        except Exception as e:
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+                return True
+            except Exception as e:
+                conn.rollback()
+                return False
     
     def delete_api_config(self, config_id, user_id):
         """删除API配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # 检查是否有正在使用此配置的任务
-            in_use = cursor.execute(
-                'SELECT COUNT(*) FROM query_history WHERE api_config_id = ?',
-                (config_id,)
-            ).fetchone()[0]
-            
-            if in_use > 0:
-                return False  # 配置正在被使用，不能删除
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                # 检查是否有正在使用此配置的任务
+                in_use = cursor.execute(API_CONFIG_IN_USE_SQL, (config_id,)).fetchone()[0]
             
-            # 删除配置
-            cursor.execute(
-                'DELETE FROM api_configs WHERE id = ? AND user_id = ?',
-                (config_id, user_id)
-            )
+                if in_use > 0:
+                    return False  # 配置正在被使用，不能删除
             
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+                # 删除配置
+                cursor.execute(
+                    'DELETE FROM api_configs WHERE id = ? AND user_id = ?',
+                    (config_id, user_id)
+                )
+                deleted = cursor.rowcount > 0
+                if deleted:
+                    self._apply_summary_delta(cursor, user_id, old={'api_configs': 1})
+                return deleted
+            except Exception as e:
+                conn.rollback()
+                return False
     
     # 品牌配置管理
     def save_brand_config(self, user_id, brand_names, website_domains=None, competitors=None):
-        """保存品牌配置"""
+        """保存品牌配置，用户已有内容相同的配置时直接返回其ID"""
         created_at = datetime.now().isoformat()
         
         # 转换为JSON字符串存储
         brand_names_str = json.dumps(brand_names) if isinstance(brand_names, list) else brand_names
         website_domains_str = json.dumps(website_domains) if isinstance(website_domains, list) else website_domains
         competitors_str = json.dumps(competitors) if isinstance(competitors, list) else competitors
+        content_hash = brand_config_hash(brand_names_str, website_domains_str, competitors_str)
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO brand_configs (user_id, brand_names, website_domains, competitors, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, brand_names_str, website_domains_str, competitors_str, created_at))
-        
-        config_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            existing = cursor.execute(FIND_BRAND_CONFIG_SQL, (user_id, content_hash)).fetchone()
+            if existing:
+                return existing['id']
+            config_id = self.backend.insert(cursor, '''
+                INSERT INTO brand_configs (user_id, brand_names, website_domains, competitors, created_at, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, brand_names_str, website_domains_str, competitors_str, created_at, content_hash))
         return config_id
     
     def get_user_brand_configs(self, user_id):
-        """获取用户的品牌配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        configs = cursor.execute(
-            'SELECT * FROM brand_configs WHERE user_id = ? ORDER BY created_at DESC',
-            (user_id,)
-        ).fetchall()
-        conn.close()
-        
-        # 解析JSON字段
-        result = []
-        for config in configs:
-            config_dict = dict(config)
-            try:
-                config_dict['brand_names'] = json.loads(config_dict['brand_names']) if config_dict['brand_names'] else []
-                config_dict['website_domains'] = json.loads(config_dict['website_domains']) if config_dict['website_domains'] else []
-                config_dict['competitors'] = json.loads(config_dict['competitors']) if config_dict['competitors'] else []
-            except:
-                pass
-            result.append(config_dict)
+        """获取用户的品牌配置，内容相同的配置只列出最早的一条，按最近保存时间排序"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(USER_BRAND_CONFIGS_SQL, (user_id,)).fetchall()
         
-        return result
+        config_ids = [row['id'] for row in rows]
+        configs = self._load_brand_configs(config_ids)
+        return [_copy_brand_config(configs[config_id]) for config_id in config_ids if config_id in configs]
     
     def get_brand_config(self, config_id, user_id):
         """获取品牌配置"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        config = cursor.execute(
-            'SELECT * FROM brand_configs WHERE id = ? AND user_id = ?',
-            (config_id, user_id)
-        ).fetchone()
-        conn.close()
-        if config:
-            config_dict = dict(config)
-            # 解析JSON字段
-            try:
-                config_dict['brand_names'] = json.loads(config_dict['brand_names']) if config_dict['brand_names'] else []
-                config_dict['website_domains'] = json.loads(config_dict['website_domains']) if config_dict['website_domains'] else []
-                config_dict['competitors'] = json.loads(config_dict['competitors']) if config_dict['competitors'] else []
-            except (json.JSONDecodeError, TypeError):
-                config_dict['brand_names'] = []
-                config_dict['website_domains'] = []
-                config_dict['competitors'] = []
-            return config_dict
-        return None
+        config = self._load_brand_configs([config_id]).get(config_id)
+        if config is None or config['user_id'] != user_id:
+            return None
+        return _copy_brand_config(config)
+    
+    def _load_brand_configs(self, config_ids):
+        """按ID取得解析后的品牌配置 {id: config}，未缓存的在一次查询中读取"""
+        configs = {}
+        missing = []
+        for config_id in config_ids:
+            config = self.brand_config_cache.get(config_id)
+            if config is None:
+                missing.append(config_id)
+            else:
+                configs[config_id] = config
+        
+        if missing:
+            placeholders = ','.join('?' * len(missing))
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                rows = cursor.execute(
+                    f'SELECT * FROM brand_configs WHERE id IN ({placeholders})', missing
+                ).fetchall()
+            for row in rows:
+                config = _parse_brand_config(row)
+                # 品牌配置保存后不再修改，缓存不需要失效
+                self.brand_config_cache.set(config['id'], config)
+                configs[config['id']] = config
+        return configs
+    
+    def _backfill_brand_config_hashes(self, cursor):
+        """为旧数据库中没有内容哈希的品牌配置补充哈希"""
+        rows = cursor.execute(
+            'SELECT id, brand_names, website_domains, competitors FROM brand_configs WHERE content_hash IS NULL'
+        ).fetchall()
+        if rows:
+            cursor.executemany(
+                'UPDATE brand_configs SET content_hash = ? WHERE id = ?',
+                [(brand_config_hash(row['brand_names'], row['website_domains'], row['competitors']), row['id'])
+                 for row in rows]
+            )
 
     # 查询历史管理
-    def create_query_task(self, user_id, task_name, prompts_file, total_prompts, api_config_id, brand_config_id):
+    def create_query_task(self, user_id, task_name, prompts_file, total_prompts, api_config_id, brand_config_id, schedule_id=None,
+                          concurrency=None, request_delay=None):
         """创建查询任务"""
         task_id = str(uuid.uuid4())
         created_at = datetime.now().isoformat()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO query_history (user_id, task_id, task_name, prompts_file, total_prompts, 
-                                     api_config_id, brand_config_id, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, task_id, task_name, prompts_file, total_prompts, api_config_id, brand_config_id, created_at))
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO query_history (user_id, task_id, task_name, prompts_file, total_prompts, 
+                                         api_config_id, brand_config_id, created_at, schedule_id,
+                                         concurrency, request_delay)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, task_id, task_name, prompts_file, total_prompts, api_config_id, brand_config_id, created_at, schedule_id,
+                  concurrency, request_delay))
+            self._apply_summary_delta(cursor, user_id, new=_task_contribution({
+                'status': 'pending', 'total_prompts': total_prompts, 'completed_prompts': 0,
+                'successful_queries': None, 'brand_mention_count': None
+            }))
         
-        conn.commit()
-        conn.close()
         return task_id
     
-    def update_query_task(self, task_id, completed_prompts=None, status=None, results_file=None, completed_at=None):
-        """更新查询任务状态"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def update_query_task(self, task_id, completed_prompts=None, status=None, results_file=None, completed_at=None,
+                          result_hash=None, successful_queries=None, brand_mention_count=None):
+        """更新查询任务状态
         
-        updates = []
-        values = []
+        状态变化同步写入：先取出该任务缓冲中尚未写入的进度，避免之后被旧进度覆盖；
+        影响用户汇总的字段变化时，在同一事务中按新旧贡献之差更新汇总
+        """
+        if status is not None:
+            pending = self.progress_buffer.take(task_id)
+            if completed_prompts is None:
+                completed_prompts = pending
         
-        if completed_prompts is not None:
-            updates.append('completed_prompts = ?')
-            values.append(completed_prompts)
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        if status is not None:
-            updates.append('status = ?')
-            values.append(status)
-        
-        if results_file is not None:
-            updates.append('results_file = ?')
-            values.append(results_file)
-        
-        if completed_at is not None:
-            updates.append('completed_at = ?')
-            values.append(completed_at)
-        
-        if updates:
-            values.append(task_id)
-            query = f'UPDATE query_history SET {", ".join(updates)} WHERE task_id = ?'
-            cursor.execute(query, values)
-            conn.commit()
-        
-        conn.close()
-    
-    def get_user_query_history(self, user_id, limit=50):
-        """获取用户查询历史"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        history = cursor.execute('''
-            SELECT qh.*, ac.name as api_name, ac.endpoint
-            FROM query_history qh
-            LEFT JOIN api_configs ac ON qh.api_config_id = ac.id
-            WHERE qh.user_id = ?
-            ORDER BY qh.created_at DESC
-            LIMIT ?
-        ''', (user_id, limit)).fetchall()
-        conn.close()
+            updates = []
+            values = []
+        
+            if completed_prompts is not None:
+                updates.append('completed_prompts = ?')
+                values.append(completed_prompts)
+        
+            if status is not None:
+                updates.append('status = ?')
+                values.append(status)
+        
+            if results_file is not None:
+                updates.append('results_file = ?')
+                values.append(results_file)
+        
+            if completed_at is not None:
+                updates.append('completed_at = ?')
+                values.append(completed_at)
+        
+            if result_hash is not None:
+                updates.append('result_hash = ?')
+                values.append(result_hash)
+            
+            if successful_queries is not None:
+                updates.append('successful_queries = ?')
+                values.append(successful_queries)
+            
+            if brand_mention_count is not None:
+                updates.append('brand_mention_count = ?')
+                values.append(brand_mention_count)
+            
+            if updates:
+                affects_summary = any(value is not None for value in (
+                    completed_prompts, status, successful_queries, brand_mention_count))
+                old = self._get_summary_task(cursor, task_id) if affects_summary else None
+                values.append(task_id)
+                query = f'UPDATE query_history SET {", ".join(updates)} WHERE task_id = ?'
+                cursor.execute(query, values)
+                if old:
+                    self._apply_summary_delta(cursor, old['user_id'], old=_task_contribution(old),
+                                              new=_task_contribution(self._get_summary_task(cursor, task_id)))
+    
+    def claim_query_task(self, task_id, expected_status, status):
+        """把任务从expected_status改为status，成功返回True
+    
+        只有状态仍为读取时的值才会更新成功，同时恢复或取消同一个已暂停的任务时只有一个请求能认领
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            old = self._get_summary_task(cursor, task_id)
+            cursor.execute(
+                'UPDATE query_history SET status = ? WHERE task_id = ? AND status = ?',
+                (status, task_id, expected_status)
+            )
+            claimed = cursor.rowcount == 1
+            if claimed:
+                self._apply_summary_delta(cursor, old['user_id'], old=_task_contribution(old),
+                                          new=_task_contribution(self._get_summary_task(cursor, task_id)))
+        return claimed
+    
+    def report_progress(self, task_id, completed_prompts):
+        """上报运行中任务的进度，写入缓冲后立即返回"""
+        self.progress_buffer.report(task_id, completed_prompts)
+    
+    def _write_progress(self, batch):
+        """在一个事务中写入一批进度，只更新仍在运行的任务"""
+        with self.connection() as conn:
+            conn.executemany(
+                "UPDATE query_history SET completed_prompts = ? WHERE task_id = ? AND status = 'pending'",
+                [(completed_prompts, task_id) for task_id, completed_prompts in batch]
+            )
+    
+    def get_user_query_history(self, user_id, limit=50, before=None, status=None, name_prefix=None,
+                               api_config_id=None):
+        """获取用户查询历史，按创建时间从新到旧，筛选和分页参数见build_history_query"""
+        sql, params = build_history_query(user_id, limit, before, status, name_prefix, api_config_id)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            history = cursor.execute(sql, params).fetchall()
         return [dict(record) for record in history]
     
+    def get_user_task_counts(self, user_id):
+        """按状态统计用户的任务数量 {status: count}"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(TASK_COUNTS_SQL, (user_id,)).fetchall()
+        return {row['status']: row['count'] for row in rows}
+    
+    # API端点历史
+    def get_endpoint_stats(self, endpoint):
+        """获取端点的历史延迟、单并发吞吐和样本数，没有记录时返回None"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute(
+                'SELECT latency, throughput, samples FROM endpoint_stats WHERE endpoint = ?', (endpoint,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    def record_endpoint_stats(self, endpoint, latency, throughput, samples, latency_alpha, throughput_alpha):
+        """把一个任务的延迟和吞吐按EWMA合并到端点历史，为None的值不更新
+    
+        在一条语句中完成读取和合并，多个进程同时写入同一端点时不会互相覆盖
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO endpoint_stats (endpoint, latency, throughput, samples, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (endpoint) DO UPDATE SET
+                    latency = CASE WHEN excluded.latency IS NULL THEN endpoint_stats.latency
+                                   WHEN endpoint_stats.latency IS NULL THEN excluded.latency
+                                   ELSE ? * excluded.latency + (1 - ?) * endpoint_stats.latency END,
+                    throughput = CASE WHEN excluded.throughput IS NULL THEN endpoint_stats.throughput
+                                      WHEN endpoint_stats.throughput IS NULL THEN excluded.throughput
+                                      ELSE ? * excluded.throughput + (1 - ?) * endpoint_stats.throughput END,
+                    samples = endpoint_stats.samples + excluded.samples,
+                    updated_at = excluded.updated_at
+            ''', (endpoint, latency, throughput, samples, datetime.now().isoformat(),
+                  latency_alpha, latency_alpha, throughput_alpha, throughput_alpha))
+    
+    # 用户汇总
+    def get_user_summary(self, user_id):
+        """读取用户汇总；还没有汇总行时（新用户或汇总表上线前的数据）从任务表统计一次后写入"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            summary = cursor.execute(USER_SUMMARY_SQL, (user_id,)).fetchone()
+            if summary is None:
+                self._rebuild_user_summary(cursor, user_id)
+                summary = cursor.execute(USER_SUMMARY_SQL, (user_id,)).fetchone()
+        summary = dict(summary)
+        successful = summary['successful_queries']
+        summary['brand_mention_rate'] = round(summary['brand_mentions'] / successful * 100, 2) if successful else 0
+        return summary
+    
+    def _rebuild_user_summary(self, cursor, user_id):
+        """在一条语句中统计并插入汇总行，已存在时不覆盖（说明其他请求已经统计过）"""
+        cursor.execute(REBUILD_USER_SUMMARY_SQL, (user_id, user_id, datetime.now().isoformat(), user_id))
+    
+    def _get_summary_task(self, cursor, task_id):
+        return cursor.execute(
+            f'SELECT {SUMMARY_TASK_FIELDS} FROM query_history WHERE task_id = ?', (task_id,)
+        ).fetchone()
+    
+    def _apply_summary_delta(self, cursor, user_id, old=None, new=None):
+        """把新旧贡献之差加到用户汇总上；汇总行还不存在时跳过，首次读取时会从任务表完整统计"""
+        delta = {}
+        for contribution, sign in ((old, -1), (new, 1)):
+            for column, value in (contribution or {}).items():
+                delta[column] = delta.get(column, 0) + sign * value
+        delta = {column: value for column, value in delta.items() if value}
+        if not delta:
+            return
+        assignments = ', '.join(f'{column} = {column} + ?' for column in delta)
+        cursor.execute(
+            f'UPDATE user_summaries SET {assignments}, updated_at = ? WHERE user_id = ?',
+            (*delta.values(), datetime.now().isoformat(), user_id)
+        )
+    
+    def get_tasks_without_stats(self):
+        """获取还没有记录提及统计的已完成/已取消任务（用于回填用户汇总）"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute('''
+                SELECT task_id, user_id FROM query_history
+                WHERE status IN ('completed', 'cancelled') AND results_file IS NOT NULL
+                      AND successful_queries IS NULL
+            ''').fetchall()
+        return [dict(task) for task in tasks]
+    
     def get_query_task(self, task_id, user_id):
         """获取查询任务详情"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        task = cursor.execute('''
-            SELECT * FROM query_history 
-            WHERE task_id = ? AND user_id = ?
-        ''', (task_id, user_id)).fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            task = cursor.execute('''
+                SELECT * FROM query_history 
+                WHERE task_id = ? AND user_id = ?
+            ''', (task_id, user_id)).fetchone()
         return dict(task) if task else None
 
+    def get_result_tasks(self):
+        """获取所有已生成结果文件的任务"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute('''
+                SELECT task_id, user_id, results_file, result_hash FROM query_history
+                WHERE results_file IS NOT NULL
+                ORDER BY user_id, created_at
+            ''').fetchall()
+        return [dict(task) for task in tasks]
+
+    # 提及趋势
+    def save_task_trends(self, user_id, task_id, timestamp, summary):
+        """根据结果摘要中的brand_stats/domain_stats写入该任务的趋势数据"""
+        rows = []
+        for kind, stats in (('brand', summary.get('brand_stats') or {}), ('domain', summary.get('domain_stats') or {})):
+            for name, stat in stats.items():
+                rows.append((user_id, kind, name, task_id, timestamp, stat['mention_count'],
+                             stat['mention_rate'], summary.get('successful_queries', 0)))
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM mention_trends WHERE task_id = ?', (task_id,))
+            cursor.executemany('''
+                INSERT INTO mention_trends (user_id, target_kind, target_name, task_id, task_timestamp,
+                                            mention_count, mention_rate, successful_queries)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            cursor.execute('UPDATE query_history SET trend_recorded = 1 WHERE task_id = ?', (task_id,))
+    
+    def get_untrended_tasks(self):
+        """获取尚未写入趋势表的已完成任务（用于回填）"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute('''
+                SELECT task_id, user_id, completed_at FROM query_history
+                WHERE status = 'completed' AND results_file IS NOT NULL AND COALESCE(trend_recorded, 0) = 0
+                ORDER BY completed_at
+            ''').fetchall()
+        return [dict(task) for task in tasks]
+    
+    def get_trend_targets(self, user_id):
+        """用户有趋势数据的品牌/域名，按最近一次出现时间排序"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            targets = cursor.execute('''
+                SELECT target_kind, target_name, COUNT(*) AS task_count, MAX(task_timestamp) AS last_seen
+                FROM mention_trends
+                WHERE user_id = ?
+                GROUP BY target_kind, target_name
+                ORDER BY last_seen DESC
+            ''', (user_id,)).fetchall()
+        return [dict(target) for target in targets]
+    
+    def get_trend_series(self, user_id, target_kind, target_name, since=None):
+        """某个品牌/域名按时间排列的提及数据"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            query = '''
+                SELECT task_id, task_timestamp, mention_count, mention_rate, successful_queries
+                FROM mention_trends
+                WHERE user_id = ? AND target_kind = ? AND target_name = ?
+            '''
+            params = [user_id, target_kind, target_name]
+            if since:
+                query += ' AND task_timestamp >= ?'
+                params.append(since)
+            query += ' ORDER BY task_timestamp'
+            series = cursor.execute(query, params).fetchall()
+        return [dict(point) for point in series]
+    
+    # 全文检索
+    def index_task_results(self, user_id, task_id, results, batch_size=1000):
+        """把任务结果写入全文索引，已有的该任务索引会先删除
+        
+        results: 可迭代的 (result_index, prompt, response)
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM result_search WHERE rowid IN (SELECT id FROM search_docs WHERE task_id = ?)
+            ''', (task_id,))
+            cursor.execute('DELETE FROM search_docs WHERE task_id = ?', (task_id,))
+            
+            batch = []
+            for result_index, prompt, response in results:
+                batch.append((result_index, prompt, response or ''))
+                if len(batch) >= batch_size:
+                    self._insert_search_batch(cursor, user_id, task_id, batch)
+                    batch = []
+            self._insert_search_batch(cursor, user_id, task_id, batch)
+            
+            cursor.execute('UPDATE query_history SET search_indexed = 1 WHERE task_id = ?', (task_id,))
+    
+    def _insert_search_batch(self, cursor, user_id, task_id, batch):
+        for result_index, prompt, response in batch:
+            doc_id = self.backend.insert(cursor, '''
+                INSERT INTO search_docs (user_id, task_id, result_index) VALUES (?, ?, ?)
+            ''', (user_id, task_id, result_index))
+            cursor.execute('''
+                INSERT INTO result_search (rowid, prompt, response) VALUES (?, ?, ?)
+            ''', (doc_id, prompt, response))
+    
+    def get_unindexed_tasks(self, user_id):
+        """获取尚未写入全文索引的已完成任务（索引功能上线前的旧任务）"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute('''
+                SELECT task_id FROM query_history
+                WHERE user_id = ? AND results_file IS NOT NULL AND COALESCE(search_indexed, 0) = 0
+            ''', (user_id,)).fetchall()
+        return [task['task_id'] for task in tasks]
+    
+    def search_results(self, user_id, query, limit=20, offset=0):
+        """在用户所有任务的prompt和回复中检索，返回带高亮片段的结果
+        
+        片段中的命中部分用 \\x02 和 \\x03 包围，由页面转义后替换为高亮标签；
+        少于3个字符的词无法使用trigram索引，退回LIKE扫描；后端不支持FTS5时始终使用LIKE
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.backend.supports_fts5 and all(len(term) >= 3 for term in terms):
+                match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+                rows = cursor.execute('''
+                    SELECT d.task_id, d.result_index, qh.task_name, qh.created_at,
+                           snippet(result_search, 0, char(2), char(3), '…', 12) AS prompt_snippet,
+                           snippet(result_search, 1, char(2), char(3), '…', 24) AS response_snippet
+                    FROM result_search
+                    JOIN search_docs d ON d.id = result_search.rowid
+                    JOIN query_history qh ON qh.task_id = d.task_id
+                    WHERE result_search MATCH ? AND d.user_id = ?
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                ''', (match, user_id, limit, offset)).fetchall()
+                results = [dict(row) for row in rows]
+            else:
+                like = self.backend.like_operator
+                conditions = ' AND '.join([f'(result_search.prompt {like} ? OR result_search.response {like} ?)'] * len(terms))
+                params = []
+                for term in terms:
+                    params.extend([f'%{term}%', f'%{term}%'])
+                rows = cursor.execute(f'''
+                    SELECT d.task_id, d.result_index, qh.task_name, qh.created_at,
+                           result_search.prompt, result_search.response
+                    FROM result_search
+                    JOIN search_docs d ON d.id = result_search.rowid
+                    JOIN query_history qh ON qh.task_id = d.task_id
+                    WHERE d.user_id = ? AND {conditions}
+                    ORDER BY qh.created_at DESC, d.result_index
+                    LIMIT ? OFFSET ?
+                ''', [user_id] + params + [limit, offset]).fetchall()
+                results = []
+                for row in rows:
+                    record = dict(row)
+                    record['prompt_snippet'] = self._make_snippet(record.pop('prompt'), terms, 30)
+                    record['response_snippet'] = self._make_snippet(record.pop('response'), terms, 60)
+                    results.append(record)
+        return results
+    
+    def _make_snippet(self, text, terms, width):
+        """在Python中截取包含第一个命中词的片段，格式与snippet()一致"""
+        lower = text.lower()
+        positions = [(lower.find(term.lower()), term) for term in terms if term.lower() in lower]
+        if not positions:
+            return text[:width * 2] + ('…' if len(text) > width * 2 else '')
+        start, term = min(positions)
+        left = max(0, start - width)
+        end = start + len(term)
+        right = min(len(text), end + width)
+        return (('…' if left > 0 else '') + text[left:start] + '\x02' + text[start:end] + '\x03'
+                + text[end:right] + ('…' if right < len(text) else ''))
+    
+    # 定时监测计划管理
+    def create_schedule(self, user_id, name, prompts_file, total_prompts, api_config_id, brand_config_id,
+                        interval_hours, next_run_at, concurrency=3):
+        """创建定时监测计划"""
+        created_at = datetime.now().isoformat()
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            schedule_id = self.backend.insert(cursor, '''
+                INSERT INTO monitor_schedules (user_id, name, prompts_file, total_prompts, api_config_id,
+                                               brand_config_id, interval_hours, concurrency, next_run_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, name, prompts_file, total_prompts, api_config_id, brand_config_id,
+                  interval_hours, concurrency, next_run_at, created_at))
+        return schedule_id
+    
+    def get_user_schedules(self, user_id):
+        """获取用户的定时监测计划，附带最近一次运行的变化统计"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            schedules = cursor.execute(USER_SCHEDULES_SQL, (user_id,)).fetchall()
+        return [dict(schedule) for schedule in schedules]
+    
+    def get_schedule(self, schedule_id, user_id):
+        """获取定时监测计划"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            schedule = cursor.execute(
+                'SELECT * FROM monitor_schedules WHERE id = ? AND user_id = ?',
+                (schedule_id, user_id)
+            ).fetchone()
+        return dict(schedule) if schedule else None
+    
+    def get_due_schedules(self, now):
+        """获取已到期的启用计划"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            schedules = cursor.execute(DUE_SCHEDULES_SQL, (now,)).fetchall()
+        return [dict(schedule) for schedule in schedules]
+    
+    def claim_schedule(self, schedule_id, expected_next_run_at, next_run_at):
+        """认领一次到期运行并写入下一次运行时间
+        
+        只有next_run_at仍为读取时的值才会更新成功，多个进程同时调度时只有一个能认领
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE monitor_schedules SET next_run_at = ?, last_run_at = ?
+                WHERE id = ? AND next_run_at = ? AND is_active = 1
+            ''', (next_run_at, datetime.now().isoformat(), schedule_id, expected_next_run_at))
+            claimed = cursor.rowcount == 1
+        return claimed
+    
+    def set_schedule_last_task(self, schedule_id, task_id):
+        """记录计划最近一次运行的任务"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE monitor_schedules SET last_task_id = ? WHERE id = ?',
+                (task_id, schedule_id)
+            )
+    
+    def set_schedule_active(self, schedule_id, user_id, is_active, next_run_at=None):
+        """启用或停用计划"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if next_run_at:
+                cursor.execute(
+                    'UPDATE monitor_schedules SET is_active = ?, next_run_at = ? WHERE id = ? AND user_id = ?',
+                    (int(is_active), next_run_at, schedule_id, user_id)
+                )
+            else:
+                cursor.execute(
+                    'UPDATE monitor_schedules SET is_active = ? WHERE id = ? AND user_id = ?',
+                    (int(is_active), schedule_id, user_id)
+                )
+            updated = cursor.rowcount > 0
+        return updated
+    
+    def delete_schedule(self, schedule_id, user_id):
+        """删除计划，已运行的任务和结果保留"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'DELETE FROM monitor_schedules WHERE id = ? AND user_id = ?',
+                (schedule_id, user_id)
+            )
+            deleted = cursor.rowcount > 0
+        return deleted
+    
+    def get_previous_schedule_task(self, schedule_id, task_id):
+        """获取同一计划中当前任务之前最近一次完成的任务"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            task = cursor.execute(PREVIOUS_SCHEDULE_TASK_SQL, (schedule_id, task_id, task_id)).fetchone()
+        return dict(task) if task else None
+    
+    def save_schedule_run(self, schedule_id, task_id, previous_task_id, changed_count, gained_count, lost_count, delta_file):
+        """记录一次定时运行的增量变化，同一任务重复记录时覆盖"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM schedule_runs WHERE task_id = ?', (task_id,))
+            cursor.execute('''
+                INSERT INTO schedule_runs (schedule_id, task_id, previous_task_id, changed_count,
+                                           gained_count, lost_count, delta_file, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (schedule_id, task_id, previous_task_id, changed_count, gained_count, lost_count,
+                  delta_file, datetime.now().isoformat()))
+    
+    def get_schedule_run(self, schedule_id, task_id=None):
+        """获取计划的某次运行记录，未指定任务时返回最近一次"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if task_id:
+                run = cursor.execute(
+                    'SELECT * FROM schedule_runs WHERE schedule_id = ? AND task_id = ?',
+                    (schedule_id, task_id)
+                ).fetchone()
+            else:
+                run = cursor.execute(
+                    'SELECT * FROM schedule_runs WHERE schedule_id = ? ORDER BY created_at DESC LIMIT 1',
+                    (schedule_id,)
+                ).fetchone()
+        return dict(run) if run else None
+
     # 文件上传历史管理
     def save_upload_history(self, user_id, original_filename, stored_filename, file_size, prompts_count):
         """保存文件上传历史记录"""
         upload_time = datetime.now().isoformat()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO upload_history (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_user_upload_history(self, user_id, limit=50):
-        """获取用户的文件上传历史记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        history = cursor.execute('''
-            SELECT * FROM upload_history
-            WHERE user_id = ?
-            ORDER BY upload_time DESC
-            LIMIT ?
-        ''', (user_id, limit)).fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO upload_history (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time))
+        
+    
+    def get_user_upload_history(self, user_id, limit=50, before=None):
+        """获取用户的文件上传历史记录，before为上一页最后一条的 (upload_time, id)"""
+        sql, params = build_upload_history_query(user_id, limit, before)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            history = cursor.execute(sql, params).fetchall()
         return [dict(record) for record in history]
     
     def delete_upload_record(self, record_id, user_id):
         """删除文件上传记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM upload_history
-            WHERE id = ? AND user_id = ?
-        ''', (record_id, user_id))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM upload_history
+                WHERE id = ? AND user_id = ?
+            ''', (record_id, user_id))
     
     def clear_upload_history(self, user_id):
         """清空用户的文件上传历史记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM upload_history
-            WHERE user_id = ?
-        ''', (user_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM upload_history
+                WHERE user_id = ?
+            ''', (user_id,))
     
     def add_upload_history(self, user_id, original_filename, stored_filename, file_size, prompts_count):
         """添加文件上传历史记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO upload_history 
-            (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, original_filename, stored_filename, file_size, prompts_count, datetime.now().isoformat()))
+            cursor.execute('''
+                INSERT INTO upload_history 
+                (user_id, original_filename, stored_filename, file_size, prompts_count, upload_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, original_filename, stored_filename, file_size, prompts_count, datetime.now().isoformat()))
         
-        conn.commit()
-        conn.close()
     
     def get_recent_uploads(self, user_id, limit=3):
         """获取用户最近上传的文件记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        uploads = cursor.execute('''
-            SELECT * FROM upload_history 
-            WHERE user_id = ?
-            ORDER BY upload_time DESC
-            LIMIT ?
-        ''', (user_id, limit)).fetchall()
+            uploads = cursor.execute(RECENT_UPLOADS_SQL, (user_id, limit)).fetchall()
         
-        conn.close()
         return [dict(record) for record in uploads]
     
     def cleanup_old_uploads(self, user_id, keep_count=10):
         """清理用户旧的上传记录，只保留最近的记录"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM upload_history 
-            WHERE user_id = ? AND id NOT IN (
-                SELECT id FROM upload_history 
-                WHERE user_id = ?
-                ORDER BY upload_time DESC
-                LIMIT ?
-            )
-        ''', (user_id, user_id, keep_count))
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
+            cursor.execute(CLEANUP_OLD_UPLOADS_SQL, (user_id, user_id, keep_count))
+
+    # 后台维护（maintenance.py），每个方法只处理一批，由调用方循环
+    def delete_expired_sessions(self, now, limit=500):
+        """删除一批已过期的会话，返回删除的数量"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(DELETE_EXPIRED_SESSIONS_SQL, (now, limit))
+            return cursor.rowcount
+    
+    def get_expired_tasks(self, cutoff, limit=100):
+        """获取一批创建时间早于cutoff且已结束（完成、失败或取消）的任务"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute(EXPIRED_TASKS_SQL, (cutoff, limit)).fetchall()
+        return [dict(task) for task in tasks]
+    
+    def delete_query_tasks(self, task_ids):
+        """删除任务记录及其全文索引和计划运行记录，返回删除的任务数；趋势表是汇总数据，保留"""
+        if not task_ids:
+            return 0
+        placeholders = ','.join('?' * len(task_ids))
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            tasks = cursor.execute(
+                f'SELECT {SUMMARY_TASK_FIELDS} FROM query_history WHERE task_id IN ({placeholders})', task_ids
+            ).fetchall()
+            for task in tasks:
+                self._apply_summary_delta(cursor, task['user_id'], old=_task_contribution(task))
+            cursor.execute(f'''
+                DELETE FROM result_search
+                WHERE rowid IN (SELECT id FROM search_docs WHERE task_id IN ({placeholders}))
+            ''', task_ids)
+            cursor.execute(f'DELETE FROM search_docs WHERE task_id IN ({placeholders})', task_ids)
+            cursor.execute(f'DELETE FROM schedule_runs WHERE task_id IN ({placeholders})', task_ids)
+            cursor.execute(f'DELETE FROM query_history WHERE task_id IN ({placeholders})', task_ids)
+            return cursor.rowcount
+    
+    def get_existing_task_ids(self, task_ids):
+        """返回task_ids中在任务表里存在的部分"""
+        if not task_ids:
+            return set()
+        task_ids = list(task_ids)
+        placeholders = ','.join('?' * len(task_ids))
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                f'SELECT task_id FROM query_history WHERE task_id IN ({placeholders})', task_ids
+            ).fetchall()
+        return {row['task_id'] for row in rows}
+    
+    def get_live_result_hashes(self, user_id):
+        """用户所有任务当前结果文件的内容哈希，不在其中的导出产物已过时"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                'SELECT result_hash FROM query_history WHERE user_id = ? AND result_hash IS NOT NULL',
+                (user_id,)
+            ).fetchall()
+        return {row['result_hash'] for row in rows}
+    
+    def get_referenced_uploads(self, user_id):
+        """上传历史和定时计划仍在引用的上传文件名"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute('''
+                SELECT stored_filename AS filename FROM upload_history WHERE user_id = ?
+                UNION SELECT prompts_file FROM monitor_schedules WHERE user_id = ?
+            ''', (user_id, user_id)).fetchall()
+        return {row['filename'] for row in rows}
+    
+    def optimize(self, analyze=False):
+        """更新查询规划器的统计信息并做WAL检查点，返回后端的执行结果"""
+        with self.connection() as conn:
+            return self.backend.optimize(conn, analyze)
+
 
 # 创建全局数据库实例
 db = Database()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+数据库后端
+Database只通过后端接口取得连接和处理方言差异：默认使用带连接池的SQLite，
+写入竞争成为瓶颈时可以通过 GEO_DATABASE_URL=postgresql://... 切换到PostgreSQL（需要安装psycopg2）
+
+后端一致性检查（在项目目录下运行）:
+  python db_backends.py [数据库URL ...]
+不带参数时检查临时SQLite数据库和PostgreSQL：设置了GEO_TEST_POSTGRES_URL（空的本地测试库）时使用该库，
+否则安装了pgserver（pip install pgserver psycopg2-binary）时启动一个临时的PostgreSQL实例，用完删除；
+SQL方言转换的检查不需要数据库服务，每次都会执行
+"""
+import os
+import re
+import sys
+import sqlite3
+import tempfile
+import threading
+from functools import lru_cache
+from contextlib import contextmanager, ExitStack
+
+from db_pool import ConnectionPool
+
+try:
+    import psycopg2
+    import psycopg2.pool
+    import psycopg2.extras
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+try:
+    import pgserver
+except ImportError:
+    pgserver = None
+
+
+class DatabaseBackend:
+    """后端接口：连接管理和Database用到的方言差异"""
+
+    name = None
+    # 检索时是否可以使用FTS5的MATCH/snippet()，不支持时退回LIKE扫描
+    supports_fts5 = False
+    # 不区分大小写的LIKE运算符
+    like_operator = 'LIKE'
+    IntegrityError = Exception
+
+    def connection(self):
+        """取得连接的上下文管理器，正常退出时提交，异常时回滚；同一线程内嵌套使用时复用外层连接"""
+        raise NotImplementedError
+
+    def insert(self, cursor, sql, params):
+        """执行INSERT并返回新行的id"""
+        raise NotImplementedError
+
+    def ensure_column(self, cursor, table, column, column_type):
+        """表中缺少某列时补上"""
+        raise NotImplementedError
+
+    def create_fulltext_table(self, cursor):
+        """创建全文检索表result_search(rowid, prompt, response)"""
+        raise NotImplementedError
+
+    def begin_migration(self, conn):
+        """开始一个排他的迁移事务，多个进程同时启动时串行执行"""
+        raise NotImplementedError
+
+    def get_schema_version(self, conn):
+        raise NotImplementedError
+
+    def set_schema_version(self, conn, version):
+        raise NotImplementedError
+
+    def optimize(self, conn, analyze=False):
+        """更新查询规划器的统计信息（analyze为True时完整重新统计），返回执行结果"""
+        raise NotImplementedError
+
+    def check_health(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class SQLiteBackend(DatabaseBackend):
+    """单文件SQLite，连接由ConnectionPool管理"""
+
+    name = 'sqlite'
+    supports_fts5 = True
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, db_path, pool_size=8):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, max_size=pool_size)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def insert(self, cursor, sql, params):
+        cursor.execute(sql, params)
+        return cursor.lastrowid
+
+    def ensure_column(self, cursor, table, column, column_type):
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def create_fulltext_table(self, cursor):
+        # trigram分词支持中文子串匹配
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS result_search USING fts5(
+                prompt, response, tokenize='trigram'
+            )
+        ''')
+
+    def begin_migration(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+    def get_schema_version(self, conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def set_schema_version(self, conn, version):
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+
+    def optimize(self, conn, analyze=False):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('ANALYZE' if analyze else 'PRAGMA optimize')
+        # PASSIVE检查点不等待读写者，把WAL中已提交的页写回数据库文件，WAL文件可以从头复用
+        busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        return {'analyzed': analyze, 'wal_pages': wal_pages, 'checkpointed': checkpointed, 'busy': bool(busy)}
+
+    def check_health(self):
+        return self.pool.check_health()
+
+    def close(self):
+        self.pool.close_all()
+
+
+# 单引号字符串字面量（''表示转义的单引号）
+_SQL_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+
+@lru_cache(maxsize=512)
+def _translate_sql(sql):
+    """把SQLite写法的SQL转换为PostgreSQL：?占位符改为%s，自增主键改为SERIAL
+
+    psycopg2带参数执行时会解析所有的%，因此字面量内外的%都要写成%%；字面量中的?保持不变
+    """
+    parts = _SQL_LITERAL.split(sql)
+    for i, part in enumerate(parts):
+        part = part.replace('%', '%%')
+        if i % 2 == 0:
+            part = re.sub(r'INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY', part.replace('?', '%s'))
+        parts[i] = part
+    return ''.join(parts)
+
+
+class _PostgresCursor:
+    """让psycopg2游标的用法与sqlite3一致：execute返回游标本身，行可以按列名或下标访问"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_translate_sql(sql), tuple(params))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(_translate_sql(sql), [tuple(params) for params in seq_of_params])
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class _PostgresConnection:
+    """psycopg2连接的sqlite3风格包装"""
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def cursor(self):
+        return _PostgresCursor(self.raw.cursor(cursor_factory=psycopg2.extras.DictCursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    @property
+    def in_transaction(self):
+        return self.raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+class PostgresBackend(DatabaseBackend):
+    """PostgreSQL，多个写入者可以并发提交；连接由psycopg2的ThreadedConnectionPool管理
+
+    全文检索表是普通表，检索走ILIKE（安装了pg_trgm扩展时建立trigram索引）
+    """
+
+    name = 'postgresql'
+    like_operator = 'ILIKE'
+
+    def __init__(self, dsn, pool_size=8):
+        if psycopg2 is None:
+            raise RuntimeError('使用PostgreSQL需要安装psycopg2')
+        self.IntegrityError = psycopg2.IntegrityError
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn)
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        raw = self.pool.getconn()
+        conn = _PostgresConnection(raw)
+        self._local.conn = conn
+        try:
+            yield conn
+            raw.commit()
+        except BaseException:
+            raw.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self.pool.putconn(raw, close=bool(raw.closed))
+
+    def insert(self, cursor, sql, params):
+        return cursor.execute(f'{sql.rstrip()} RETURNING id', params).fetchone()[0]
+
+    def ensure_column(self, cursor, table, column, column_type):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}')
+
+    def create_fulltext_table(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS result_search (
+                rowid INTEGER PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                response TEXT NOT NULL
+            )
+        ''')
+        if cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").fetchone():
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_result_search_prompt ON result_search '
+                           'USING gin (prompt gin_trgm_ops)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_result_search_response ON result_search '
+                           'USING gin (response gin_trgm_ops)')
+
+    def begin_migration(self, conn):
+        # psycopg2在第一条语句前自动开启事务，表锁持有到提交
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        conn.execute('LOCK TABLE schema_version IN ACCESS EXCLUSIVE MODE')
+
+    def get_schema_version(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+        return row[0] or 0
+
+    def set_schema_version(self, conn, version):
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+
+    def optimize(self, conn, analyze=False):
+        # 日常清理由autovacuum负责，这里只在需要时刷新统计信息
+        if analyze:
+            conn.execute('ANALYZE')
+        return {'analyzed': analyze}
+
+    def check_health(self):
+        with self.connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+        return {'backend': self.name, 'max_size': self.pool.maxconn}
+
+    def close(self):
+        self.pool.closeall()
+
+
+def create_backend(url=None, pool_size=None):
+    """按URL创建后端：sqlite:///路径 或 postgresql://...，未指定时使用当前目录下的geo_insight.db"""
+    pool_size = pool_size or int(os.environ.get('GEO_DB_POOL_SIZE', 8))
+    url = url or 'sqlite:///geo_insight.db'
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], pool_size)
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(url, pool_size)
+    raise ValueError(f'不支持的数据库URL: {url}')
+
+
+def check_sql_translation():
+    """检查SQLite到PostgreSQL的SQL转换，不需要数据库服务，返回失败项列表"""
+    cases = [
+        ('SELECT * FROM users WHERE id = ? AND name = ?', 'SELECT * FROM users WHERE id = %s AND name = %s'),
+        ('SELECT * FROM t WHERE a LIKE ?', 'SELECT * FROM t WHERE a LIKE %s'),
+        ("SELECT * FROM t WHERE a LIKE '%x%' AND b = ?", "SELECT * FROM t WHERE a LIKE '%%x%%' AND b = %s"),
+        ("SELECT '?' AS q, 'it''s ?' AS r, ? AS s", "SELECT '?' AS q, 'it''s ?' AS r, %s AS s"),
+        ('SELECT 10 % 3', 'SELECT 10 %% 3'),
+        ('CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT)',
+         'CREATE TABLE t (id SERIAL PRIMARY KEY, name TEXT)'),
+        ("INSERT INTO t (name) VALUES ('INTEGER PRIMARY KEY AUTOINCREMENT')",
+         "INSERT INTO t (name) VALUES ('INTEGER PRIMARY KEY AUTOINCREMENT')"),
+    ]
+    return [f'_translate_sql({sql!r}): 期望 {expected!r}，实际 {_translate_sql(sql)!r}'
+            for sql, expected in cases if _translate_sql(sql) != expected]
+
+
+def check_backend(db):
+    """对Database执行一组读写检查，两种后端必须得到相同的结果，返回失败项列表"""
+    failures = []
+
+    def expect(name, actual, expected):
+        if actual != expected:
+            failures.append(f'{name}: 期望 {expected!r}，实际 {actual!r}')
+
+    user_id = db.create_user('check_user', 'check@example.com', 'secret1')
+    if not isinstance(user_id, int):
+        return ['create_user: 创建检查用户失败，检查需要一个空的数据库']
+    expect('duplicate_user', db.create_user('check_user', 'check@example.com', 'secret1'), None)
+    expect('authenticate_user', (db.authenticate_user('check_user', 'secret1') or {}).get('id'), user_id)
+    expect('change_password', db.change_password(user_id, 'secret1', 'secret2'), (True, '密码修改成功'))
+    expect('authenticate_new_password', (db.authenticate_user('check_user', 'secret2') or {}).get('id'), user_id)
+
+    config_id = db.save_api_config(user_id, 'check', 'http://localhost/v1', 'key', is_default=True)
+    expect('get_user_api_configs', [config['id'] for config in db.get_user_api_configs(user_id)], [config_id])
+    brand_config_id = db.save_brand_config(user_id, ['Acme'], ['acme.com'])
+    expect('get_brand_config', db.get_brand_config(brand_config_id, user_id)['brand_names'], ['Acme'])
+
+    task_id = db.create_query_task(user_id, 'check', 'prompts.csv', 3, config_id, brand_config_id,
+                                   concurrency=5, request_delay=0.2)
+    task = db.get_query_task(task_id, user_id)
+    expect('task_settings', (task['concurrency'], task['request_delay']), (5, 0.2))
+    db.report_progress(task_id, 2)
+    db.progress_buffer.flush()
+    expect('report_progress', db.get_query_task(task_id, user_id)['completed_prompts'], 2)
+    db.update_query_task(task_id, completed_prompts=3, status='completed', results_file=f'{task_id}.json')
+    expect('update_query_task', db.get_query_task(task_id, user_id)['status'], 'completed')
+    summary = db.get_user_summary(user_id)
+    expect('user_summary', (summary['total_tasks'], summary['completed_tasks'], summary['processed_prompts'],
+                            summary['api_configs']), (1, 1, 3, 1))
+    expect('delete_api_config_in_use', db.delete_api_config(config_id, user_id), False)
+
+    db.index_task_results(user_id, task_id, [(0, '北京哪家咖啡好', 'Acme咖啡'), (1, 'best coffee', 'try Acme')])
+    expect('search_fulltext', [row['result_index'] for row in db.search_results(user_id, '咖啡好')], [0])
+    expect('search_short_term', sorted(row['result_index'] for row in db.search_results(user_id, 'acme')), [0, 1])
+
+    db.save_task_trends(user_id, task_id, '2026-01-01T00:00:00', {
+        'successful_queries': 3, 'brand_stats': {'Acme': {'mention_count': 2, 'mention_rate': 66.67}}})
+    expect('trend_series', [point['mention_count'] for point in db.get_trend_series(user_id, 'brand', 'Acme')], [2])
+
+    schedule_id = db.create_schedule(user_id, 'check', 'prompts.csv', 3, config_id, brand_config_id,
+                                     24, '2026-01-01T00:00:00')
+    db.save_schedule_run(schedule_id, task_id, None, 1, 1, 0, 'delta.json')
+    db.save_schedule_run(schedule_id, task_id, None, 2, 1, 1, 'delta.json')
+    expect('save_schedule_run_replace', db.get_schedule_run(schedule_id)['changed_count'], 2)
+
+    db.record_endpoint_stats('check|default', 2.0, None, 3, 0.5, 0.5)
+    db.record_endpoint_stats('check|default', 4.0, 1.0, 3, 0.5, 0.5)
+    expect('endpoint_stats', db.get_endpoint_stats('check|default'),
+           {'latency': 3.0, 'throughput': 1.0, 'samples': 6})
+
+    db.create_session(user_id)
+    expect('delete_expired_sessions', db.delete_expired_sessions('9999-12-31T00:00:00') >= 1, True)
+    expect('get_expired_tasks', [task['task_id'] for task in db.get_expired_tasks('9999-12-31T00:00:00')], [task_id])
+    expect('delete_query_tasks', db.delete_query_tasks([task_id]), 1)
+    expect('user_summary_after_delete', db.get_user_summary(user_id)['total_tasks'], 0)
+    expect('deleted_task_search', db.search_results(user_id, 'acme'), [])
+    expect('optimize', db.optimize(analyze=True)['analyzed'], True)
+    expect('set_user_active', db.set_user_active(user_id, False), True)
+    expect('inactive_user', db.get_user_by_id(user_id), None)
+    return failures
+
+
+def main():
+    from database import Database
+
+    ok = True
+    failures = check_sql_translation()
+    if failures:
+        ok = False
+        print(f"✗ SQL转换: {len(failures)}项检查失败")
+        for failure in failures:
+            print(f"  - {failure}")
+    else:
+        print("✓ SQL转换: 全部检查通过")
+
+    urls = sys.argv[1:]
+    with tempfile.TemporaryDirectory() as tmp_dir, ExitStack() as stack:
+        if not urls:
+            urls = [f"sqlite:///{os.path.join(tmp_dir, 'backend_check.db')}"]
+            if os.environ.get('GEO_TEST_POSTGRES_URL'):
+                urls.append(os.environ['GEO_TEST_POSTGRES_URL'])
+            elif pgserver is not None:
+                server = stack.enter_context(pgserver.get_server(os.path.join(tmp_dir, 'pgdata'),
+                                                                 cleanup_mode='delete'))
+                urls.append(server.get_uri())
+            else:
+                ok = False
+                print("✗ postgresql: 未设置GEO_TEST_POSTGRES_URL，也未安装pgserver，无法检查PostgresBackend")
+        for url in urls:
+            try:
+                backend = create_backend(url)
+            except RuntimeError as e:
+                ok = False
+                print(f"✗ {url.split(':', 1)[0]}: {e}")
+                continue
+            try:
+                failures = check_backend(Database(backend=backend))
+            finally:
+                backend.close()
+            if failures:
+                ok = False
+                print(f"✗ {backend.name}: {len(failures)}项检查失败")
+                for failure in failures:
+                    print(f"  - {failure}")
+            else:
+                print(f"✓ {backend.name}: 全部检查通过")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,150 @@
+"""
+SQLite连接池
+连接创建时一次性设置PRAGMA，用完放回池中复用；同一线程内嵌套使用时复用同一个连接，空闲过久的连接取出前先做健康检查
+"""
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 每个连接创建时执行一次；journal_mode=WAL写入数据库文件，其余只对当前连接有效
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=30000',
+    'PRAGMA cache_size=-16000',  # 16MB页缓存
+    'PRAGMA mmap_size=268435456',  # 256MB内存映射
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+class ConnectionPool:
+    """有上限的SQLite连接池
+
+    Flask开发服务器每个请求一个线程，线程结束后线程局部连接无法复用，因此连接放在共享队列中，
+    线程局部变量只用来让同一线程内嵌套的connection()复用外层连接
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=30.0, health_check_interval=60.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+
+    def _create(self, max_retries=3):
+        """新建连接并设置PRAGMA，数据库被锁时重试"""
+        for attempt in range(max_retries):
+            try:
+                conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+                conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+                for pragma in CONNECTION_PRAGMAS:
+                    conn.execute(pragma)
+                return conn
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e) and attempt < max_retries - 1:
+                    time.sleep(0.1 * (attempt + 1))  # 递增延迟
+                    continue
+                raise
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self):
+        """取出一个可用连接，池中没有空闲连接且已达上限时等待归还"""
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.max_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._create()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn, released_at = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('等待数据库连接超时')
+
+            if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        """归还连接，未结束的事务先回滚；连接已损坏时直接丢弃"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """取得连接，正常退出时提交，异常时回滚；同一线程内嵌套使用时复用外层连接，由最外层负责提交"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self.release(conn)
+
+    def check_health(self):
+        """检查所有空闲连接，丢弃不可用的连接，返回连接池状态"""
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        healthy = 0
+        for conn, released_at in checked:
+            if self._is_healthy(conn):
+                healthy += 1
+                self._idle.put((conn, released_at))
+            else:
+                self._discard(conn)
+        return {'max_size': self.max_size, 'open': self._created, 'idle': healthy,
+                'discarded': len(checked) - healthy}
+
+    def close_all(self):
+        """关闭所有空闲连接（进程退出或测试时使用）"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
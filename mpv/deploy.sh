@@ -463,8 +463,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
 try:
-    from app import app
+    from app import app, start_background_services
     application = app
+    start_background_services()
     
     if __name__ == "__main__":
         port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,133 @@
+"""
+结果导出：把任务结果库导出为Parquet、Arrow IPC和Excel文件
+列式格式中品牌/域名命中保存为布尔列，回复文本单独做字典编码并压缩；pyarrow为可选依赖
+Excel使用openpyxl的只写模式逐行写出，内存占用不随结果数量增长
+"""
+import os
+import sqlite3
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from result_store import load_result_summary, iter_export_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_FORMATS = {
+    'parquet': {'suffix': '.parquet', 'mimetype': 'application/vnd.apache.parquet'},
+    'arrow': {'suffix': '.arrow', 'mimetype': 'application/vnd.apache.arrow.file'},
+    'xlsx': {'suffix': '.xlsx',
+             'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+}
+
+# Excel单元格最多保存32767个字符
+EXCEL_CELL_LIMIT = 32767
+
+
+def export_available(fmt):
+    """导出格式所需的依赖是否已安装（Parquet/Arrow需要pyarrow）"""
+    return fmt == 'xlsx' or pa is not None
+
+
+def _build_schema(targets, dictionary=True):
+    """dictionary: 回复和状态列使用字典编码；Arrow文件格式不支持跨批次替换字典，只在Parquet中使用"""
+    fields = [
+        pa.field('index', pa.int32()),
+        pa.field('prompt', pa.string()),
+        pa.field('response', pa.dictionary(pa.int32(), pa.string()) if dictionary else pa.string()),
+        pa.field('status', pa.dictionary(pa.int8(), pa.string()) if dictionary else pa.string()),
+        pa.field('has_brand_mention', pa.bool_()),
+        pa.field('has_domain_mention', pa.bool_()),
+        pa.field('brand_mention_count', pa.int16()),
+        pa.field('domain_mention_count', pa.int16()),
+    ]
+    fields += [pa.field(f"{'Brand' if kind == 'brand' else 'Domain'}_{name}", pa.bool_())
+               for kind, name in targets]
+    return pa.schema(fields)
+
+
+def _iter_batches(conn, schema, targets, batch_rows):
+    cursor = conn.execute(
+        'SELECT idx, prompt, response, status, has_brand_mention, has_domain_mention, '
+        'brand_mentions, domain_mentions, hits FROM results ORDER BY idx'
+    )
+    while True:
+        records = cursor.fetchmany(batch_rows)
+        if not records:
+            break
+        columns = [list(column) for column in zip(*(record[:8] for record in records))]
+        columns[4] = [bool(value) for value in columns[4]]
+        columns[5] = [bool(value) for value in columns[5]]
+        hits = [record[8] for record in records]
+        columns += [[row_hits[i] == '1' for row_hits in hits] for i in range(len(targets))]
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        )
+
+
+def _excel_value(value):
+    if not isinstance(value, str):
+        return value
+    return ILLEGAL_CHARACTERS_RE.sub('', value)[:EXCEL_CELL_LIMIT]
+
+
+def write_excel_export(db_path, export_path):
+    """导出Excel：汇总表来自brand_stats/domain_stats，明细表的列与CSV一致"""
+    summary = load_result_summary(db_path)
+    tmp_path = export_path + '.tmp'
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('汇总')
+    sheet.append(['任务名称', _excel_value(summary.get('task_name', ''))])
+    sheet.append(['完成时间', summary.get('timestamp', '')])
+    sheet.append(['总查询数', summary.get('total_prompts', 0)])
+    sheet.append(['成功查询', summary.get('successful_queries', 0)])
+    sheet.append(['品牌提及率(%)', summary.get('brand_mention_rate', 0)])
+    sheet.append(['域名提及率(%)', summary.get('domain_mention_rate', 0)])
+    for title, stats in (('品牌', summary.get('brand_stats', {})), ('域名', summary.get('domain_stats', {}))):
+        if not stats:
+            continue
+        sheet.append([])
+        sheet.append([title, '提及次数', '提及率(%)'])
+        for name, stat in stats.items():
+            sheet.append([_excel_value(name), stat['mention_count'], stat['mention_rate']])
+
+    sheet = workbook.create_sheet('明细')
+    for row in iter_export_rows(db_path):
+        sheet.append([_excel_value(value) for value in row])
+
+    workbook.save(tmp_path)
+    os.replace(tmp_path, export_path)
+
+
+def write_export(db_path, fmt, export_path, batch_rows=5000):
+    """把结果库导出到export_path"""
+    if fmt == 'xlsx':
+        write_excel_export(db_path, export_path)
+        return
+    if pa is None:
+        raise RuntimeError('未安装pyarrow，无法导出Parquet/Arrow格式')
+
+    tmp_path = export_path + '.tmp'
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        targets = conn.execute('SELECT kind, name FROM targets ORDER BY id').fetchall()
+        schema = _build_schema(targets, dictionary=(fmt == 'parquet'))
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(tmp_path, schema, compression='zstd',
+                                      use_dictionary=['response', 'status'])
+        else:
+            writer = ipc.new_file(tmp_path, schema,
+                                  options=ipc.IpcWriteOptions(compression='zstd'))
+        with writer:
+            for batch in _iter_batches(conn, schema, targets, batch_rows):
+                writer.write_batch(batch)
+    finally:
+        conn.close()
+    os.replace(tmp_path, export_path)
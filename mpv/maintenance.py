@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+后台维护
+按保留策略分批清理过期会话、超过保留期的任务、过时的导出产物、不再被引用的上传文件和没有任务记录的任务文件，
+并定期刷新数据库的查询统计信息、做WAL检查点。每批之间短暂停顿，单次只占用数据库写锁很短的时间
+
+手动执行一轮（在项目目录下运行，保留策略读取与应用相同的环境变量）:
+  python maintenance.py
+"""
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import random
+import threading
+from datetime import datetime, timedelta
+
+from artifacts import get_artifact_dir
+
+# 任务文件以任务ID开头，例如 <task_id>.db、<task_id>.json.zst、<task_id>.shard0.results.jsonl
+TASK_FILE_PATTERN = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.')
+
+
+class RetentionPolicy:
+    """保留策略
+
+    result_days: 已结束的任务保留多少天，之后删除任务记录和结果文件；0表示永久保留
+    artifact_days: 导出产物（CSV/Excel等，可按需重新生成）保留多少天；0表示永久保留
+    orphan_grace_hours: 没有被引用的上传文件和任务文件至少存在多久才删除，避免删掉刚创建、还没写入数据库的文件
+    """
+
+    def __init__(self, result_days=0, artifact_days=7, orphan_grace_hours=24):
+        self.result_days = result_days
+        self.artifact_days = artifact_days
+        self.orphan_grace_hours = orphan_grace_hours
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            result_days=float(os.environ.get('GEO_RESULT_RETENTION_DAYS', 0)),
+            artifact_days=float(os.environ.get('GEO_ARTIFACT_RETENTION_DAYS', 7)),
+            orphan_grace_hours=float(os.environ.get('GEO_ORPHAN_GRACE_HOURS', 24))
+        )
+
+
+def _remove(path):
+    """删除文件或目录，返回释放的字节数；已被其他进程删除时返回0"""
+    try:
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+            shutil.rmtree(path)
+            return size
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _user_dirs(root):
+    """遍历 root/<user_id> 目录，产生 (user_id, 目录路径)"""
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.isdigit():
+                yield int(entry.name), entry.path
+
+
+class MaintenanceRunner:
+    """定期执行维护任务的后台线程
+
+    每一项清理每批最多处理batch_size条，一轮最多max_batches批，剩余的留到下一轮；
+    多个进程同时运行时各自清理，所有删除操作都可以重复执行
+    """
+
+    def __init__(self, db, policy=None, results_root='results', uploads_root='uploads',
+                 interval=600, batch_size=200, max_batches=20, batch_pause=0.05, analyze_interval_hours=24):
+        self.db = db
+        self.policy = policy or RetentionPolicy()
+        self.results_root = results_root
+        self.uploads_root = uploads_root
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause = batch_pause
+        self.analyze_interval = analyze_interval_hours * 3600
+        self.last_stats = None
+        self._last_analyze = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self, now=None):
+        """执行一轮所有维护任务，返回并打印每项的统计"""
+        now = now or datetime.now()
+        jobs = (
+            ('sessions', self.expire_sessions),
+            ('tasks', self.expire_tasks),
+            ('artifacts', self.clean_artifacts),
+            ('uploads', self.clean_uploads),
+            ('orphans', self.clean_orphan_task_files),
+            ('database', self.optimize_database),
+        )
+        stats = {}
+        for name, job in jobs:
+            started = time.monotonic()
+            try:
+                stats[name] = job(now)
+            except Exception as e:
+                print(f"维护任务 {name} 失败: {e}")
+                stats[name] = {'error': str(e)}
+            stats[name]['seconds'] = round(time.monotonic() - started, 3)
+        self.last_stats = stats
+        print(f"后台维护完成: {format_stats(stats)}")
+        return stats
+
+    def _in_batches(self, run_batch):
+        """重复执行run_batch（返回本批处理的数量），直到不足一批或达到本轮上限，返回合计数量"""
+        total = 0
+        for _ in range(self.max_batches):
+            count = run_batch()
+            total += count
+            if count < self.batch_size or self._stop.is_set():
+                break
+            time.sleep(self.batch_pause)  # 让出数据库写锁
+        return total
+
+    def expire_sessions(self, now):
+        deleted = self._in_batches(lambda: self.db.delete_expired_sessions(now.isoformat(), self.batch_size))
+        return {'deleted': deleted}
+
+    def expire_tasks(self, now):
+        """删除超过保留期的任务：先删数据库记录再删文件，文件删除失败时由孤立文件清理兜底"""
+        stats = {'deleted': 0, 'files': 0, 'bytes': 0}
+        if not self.policy.result_days:
+            return stats
+        cutoff = (now - timedelta(days=self.policy.result_days)).isoformat()
+
+        def run_batch():
+            tasks = self.db.get_expired_tasks(cutoff, self.batch_size)
+            stats['deleted'] += self.db.delete_query_tasks([task['task_id'] for task in tasks])
+            for task in tasks:
+                results_dir = os.path.join(self.results_root, str(task['user_id']))
+                paths = glob.glob(os.path.join(results_dir, glob.escape(task['task_id']) + '.*'))
+                if task['result_hash']:
+                    paths.append(get_artifact_dir(results_dir, task['result_hash']))
+                for path in paths:
+                    if os.path.exists(path):
+                        stats['bytes'] += _remove(path)
+                        stats['files'] += 1
+            return len(tasks)
+
+        self._in_batches(run_batch)
+        return stats
+
+    def clean_artifacts(self, now):
+        """删除过时（结果已重新生成或任务已删除）或超过保留期的导出产物目录"""
+        stats = {'removed': 0, 'bytes': 0}
+        grace_cutoff = (now - timedelta(hours=self.policy.orphan_grace_hours)).timestamp()
+        expire_cutoff = ((now - timedelta(days=self.policy.artifact_days)).timestamp()
+                         if self.policy.artifact_days else None)
+        limit = self.batch_size * self.max_batches
+        for user_id, results_dir in _user_dirs(self.results_root):
+            artifacts_root = os.path.join(results_dir, 'artifacts')
+            if not os.path.isdir(artifacts_root):
+                continue
+            live_hashes = self.db.get_live_result_hashes(user_id)
+            with os.scandir(artifacts_root) as entries:
+                for entry in entries:
+                    if stats['removed'] >= limit:
+                        return stats
+                    mtime = entry.stat().st_mtime
+                    stale = entry.name not in live_hashes and mtime < grace_cutoff
+                    expired = expire_cutoff is not None and mtime < expire_cutoff
+                    if entry.is_dir() and (stale or expired):
+                        stats['bytes'] += _remove(entry.path)
+                        stats['removed'] += 1
+        return stats
+
+    def clean_uploads(self, now):
+        """删除上传历史和定时计划都不再引用的上传文件（cleanup_old_uploads只删除记录）"""
+        stats = {'removed': 0, 'bytes': 0}
+        cutoff = (now - timedelta(hours=self.policy.orphan_grace_hours)).timestamp()
+        limit = self.batch_size * self.max_batches
+        for user_id, upload_dir in _user_dirs(self.uploads_root):
+            referenced = self.db.get_referenced_uploads(user_id)
+            with os.scandir(upload_dir) as entries:
+                for entry in entries:
+                    if stats['removed'] >= limit:
+                        return stats
+                    if (entry.is_file() and entry.name not in referenced
+                            and entry.stat().st_mtime < cutoff):
+                        stats['bytes'] += _remove(entry.path)
+                        stats['removed'] += 1
+        return stats
+
+    def clean_orphan_task_files(self, now):
+        """删除任务记录已不存在的任务文件（任务被删除或删除文件时中断留下的）"""
+        stats = {'removed': 0, 'bytes': 0}
+        cutoff = (now - timedelta(hours=self.policy.orphan_grace_hours)).timestamp()
+        limit = self.batch_size * self.max_batches
+        for user_id, results_dir in _user_dirs(self.results_root):
+            candidates = {}
+            with os.scandir(results_dir) as entries:
+                for entry in entries:
+                    match = TASK_FILE_PATTERN.match(entry.name)
+                    if match and entry.is_file() and entry.stat().st_mtime < cutoff:
+                        candidates.setdefault(match.group(1), []).append(entry.path)
+            task_ids = list(candidates)
+            for start in range(0, len(task_ids), self.batch_size):
+                batch = task_ids[start:start + self.batch_size]
+                existing = self.db.get_existing_task_ids(batch)
+                for task_id in batch:
+                    if task_id in existing:
+                        continue
+                    for path in candidates[task_id]:
+                        stats['bytes'] += _remove(path)
+                        stats['removed'] += 1
+                if stats['removed'] >= limit:
+                    return stats
+        return stats
+
+    def optimize_database(self, now):
+        """每轮执行轻量的统计更新和WAL检查点，每隔analyze_interval完整ANALYZE一次"""
+        analyze = time.monotonic() - self._last_analyze >= self.analyze_interval
+        result = self.db.optimize(analyze=analyze)
+        if analyze:
+            self._last_analyze = time.monotonic()
+        return result
+
+    def _loop(self):
+        # 与调度器一样加入抖动，多个进程不会同时清理
+        while not self._stop.wait(self.interval * random.uniform(0.9, 1.1)):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"后台维护失败: {e}")
+
+
+def format_stats(stats):
+    """把一轮维护的统计整理成一行日志"""
+    freed = sum(item.get('bytes', 0) for item in stats.values())
+    parts = [
+        f"过期会话 {stats['sessions'].get('deleted', 0)}",
+        f"过期任务 {stats['tasks'].get('deleted', 0)}",
+        f"导出产物 {stats['artifacts'].get('removed', 0)}",
+        f"上传文件 {stats['uploads'].get('removed', 0)}",
+        f"孤立任务文件 {stats['orphans'].get('removed', 0)}",
+        f"释放 {freed / 1024 / 1024:.1f}MB",
+    ]
+    database = stats['database']
+    if 'wal_pages' in database:
+        parts.append(f"WAL检查点 {database['checkpointed']}/{database['wal_pages']}页")
+    if database.get('analyzed'):
+        parts.append('已ANALYZE')
+    errors = [name for name, item in stats.items() if 'error' in item]
+    if errors:
+        parts.append(f"失败: {', '.join(errors)}")
+    parts.append(f"耗时 {sum(item['seconds'] for item in stats.values()):.2f}s")
+    return '，'.join(parts)
+
+
+def main():
+    from database import db
+
+    runner = MaintenanceRunner(db, RetentionPolicy.from_env(), analyze_interval_hours=0)
+    stats = runner.run_once()
+    return not any('error' in item for item in stats.values())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
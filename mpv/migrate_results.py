@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+结果文件压缩迁移脚本
+把已有的未压缩结果JSON原地压缩（zstd或gzip），并报告磁盘占用和读取耗时的变化
+
+用法（在项目目录下运行）:
+  python migrate_results.py [--compression auto|zstd|gzip]
+"""
+import os
+import sys
+import time
+import argparse
+from itertools import groupby
+
+from database import db
+from auth import get_user_file_path, create_user_directories
+from artifacts import file_sha256, get_artifact_dir
+from compression import (COMPRESSION_SUFFIXES, resolve_compression, find_compressed, get_current_dictionary,
+                         train_dictionary, MIN_DICT_SAMPLES)
+from result_store import load_result_file, sample_results, write_result_file
+
+
+def timed_load(path):
+    """读取结果文件，返回 (数据, 耗时秒)"""
+    start = time.perf_counter()
+    data = load_result_file(path)
+    return data, time.perf_counter() - start
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.1f}{unit}'
+        size /= 1024
+
+
+def prepare_dictionary(results_dir, sources):
+    """该用户还没有字典时，从未压缩的结果文件中取样训练"""
+    dictionary = get_current_dictionary(results_dir)
+    if dictionary:
+        return dictionary
+    samples = []
+    for source in sources:
+        samples.extend(sample_results(load_result_file(source)['results'], limit=2000 - len(samples)))
+        if len(samples) >= 2000:
+            break
+    if len(samples) < MIN_DICT_SAMPLES:
+        print(f"  样本不足（{len(samples)}条），不使用字典")
+        return None
+    dictionary = train_dictionary(results_dir, samples)
+    if dictionary:
+        print(f"✓ 训练压缩字典 {dictionary.dict_id()}（{len(samples)}条样本）")
+    return dictionary
+
+
+def compress_task(task, compression, dictionary, report):
+    """压缩单个任务的结果文件，校验内容一致后替换原文件"""
+    source = find_compressed(get_user_file_path(task['user_id'], f"{task['task_id']}.json", 'result'))
+    if not source or not source.endswith('.json'):
+        return False
+
+    data, read_before = timed_load(source)
+    target = source + COMPRESSION_SUFFIXES[compression]
+    summary = {key: value for key, value in data.items() if key != 'results'}
+    write_result_file(target, summary, data['results'], compression, dictionary)
+    check, read_after = timed_load(target)
+    if check != data:
+        os.remove(target)
+        print(f"✗ {task['task_id']}: 压缩后内容不一致，保留原文件")
+        return False
+
+    size_before, size_after = os.path.getsize(source), os.path.getsize(target)
+    os.remove(source)
+
+    # 结果文件内容哈希变化，已缓存的导出产物改挂到新哈希下
+    result_hash = file_sha256(target)
+    results_dir = os.path.dirname(target)
+    if task.get('result_hash') and os.path.isdir(get_artifact_dir(results_dir, task['result_hash'])):
+        os.replace(get_artifact_dir(results_dir, task['result_hash']), get_artifact_dir(results_dir, result_hash))
+    db.update_query_task(task['task_id'], results_file=os.path.basename(target), result_hash=result_hash)
+
+    report['files'] += 1
+    report['size_before'] += size_before
+    report['size_after'] += size_after
+    report['read_before'] += read_before
+    report['read_after'] += read_after
+    print(f"✓ {task['task_id']}: {format_size(size_before)} -> {format_size(size_after)}，"
+          f"读取 {read_before * 1000:.1f}ms -> {read_after * 1000:.1f}ms")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='压缩已有的结果文件')
+    parser.add_argument('--compression', default=os.environ.get('GEO_RESULT_COMPRESSION', 'auto'),
+                        help='auto / zstd / gzip')
+    args = parser.parse_args()
+
+    compression = resolve_compression(args.compression)
+    if compression == 'none':
+        print("压缩方式为none，无需迁移")
+        return True
+
+    print("=" * 50)
+    print(f"结果文件压缩迁移（{compression}）")
+    print("=" * 50)
+
+    report = {'files': 0, 'size_before': 0, 'size_after': 0, 'read_before': 0.0, 'read_after': 0.0}
+    for user_id, tasks in groupby(db.get_result_tasks(), key=lambda task: task['user_id']):
+        tasks = list(tasks)
+        _, results_dir = create_user_directories(user_id)
+        dictionary = None
+        if compression == 'zstd':
+            sources = [path for path in (find_compressed(get_user_file_path(user_id, f"{task['task_id']}.json", 'result'))
+                                         for task in tasks) if path and path.endswith('.json')]
+            if sources:
+                dictionary = prepare_dictionary(results_dir, sources)
+        for task in tasks:
+            try:
+                compress_task(task, compression, dictionary, report)
+            except Exception as e:
+                print(f"✗ {task['task_id']}: {e}")
+
+    print("=" * 50)
+    if not report['files']:
+        print("没有需要压缩的结果文件")
+        return True
+    ratio = report['size_after'] / report['size_before'] if report['size_before'] else 0
+    print(f"压缩文件数: {report['files']}")
+    print(f"磁盘占用: {format_size(report['size_before'])} -> {format_size(report['size_after'])}"
+          f"（{ratio * 100:.1f}%）")
+    print(f"平均读取耗时: {report['read_before'] / report['files'] * 1000:.1f}ms -> "
+          f"{report['read_after'] / report['files'] * 1000:.1f}ms")
+    print("=" * 50)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
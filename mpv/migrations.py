@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+数据库结构迁移
+init_database负责建表（版本0），之后的结构变化按版本号依次执行，SQLite中当前版本记录在 PRAGMA user_version 中
+
+检查索引效果（在项目目录下运行）:
+  python migrations.py
+在临时SQLite数据库上对比迁移前后热点查询的执行计划，迁移后仍有全表扫描时返回非零退出码
+"""
+import os
+import sys
+import tempfile
+
+# (版本号, 说明, SQL语句列表)，只能追加，已发布的版本不要修改
+MIGRATIONS = [
+    (1, '热点查询路径的复合索引', [
+        'CREATE INDEX IF NOT EXISTS idx_query_history_user_created ON query_history (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_query_history_api_config ON query_history (api_config_id)',
+        'CREATE INDEX IF NOT EXISTS idx_query_history_schedule ON query_history (schedule_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_upload_history_user_time ON upload_history (user_id, upload_time)',
+        'CREATE INDEX IF NOT EXISTS idx_api_configs_user ON api_configs (user_id, is_default, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_brand_configs_user_created ON brand_configs (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_monitor_schedules_user_created ON monitor_schedules (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_monitor_schedules_due ON monitor_schedules (is_active, next_run_at)',
+    ]),
+    (2, '品牌配置按内容哈希去重', [
+        'CREATE INDEX IF NOT EXISTS idx_brand_configs_user_hash ON brand_configs (user_id, content_hash, created_at)',
+    ]),
+    (3, '后台维护按时间清理会话和任务', [
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_query_history_created ON query_history (created_at)',
+    ]),
+    (4, '历史记录键集分页的筛选索引', [
+        'CREATE INDEX IF NOT EXISTS idx_query_history_user_status ON query_history (user_id, status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_query_history_user_api ON query_history (user_id, api_config_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_query_history_user_name ON query_history (user_id, task_name)',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# 按范围条件用索引筛选后，只对命中的记录排序的查询，检查时允许临时B树排序
+# （品牌配置按内容分组后再按聚合值排序，排序无法由索引提供）
+SORT_AFTER_INDEX_FILTER = {'get_user_query_history_name_prefix', 'get_user_brand_configs'}
+
+
+def query_plan_checks():
+    """热点查询及其参数，SQL取自database.py中Database实际执行的常量和构造函数
+
+    在函数中导入database，避免与database导入本模块形成循环
+    """
+    import database as d
+
+    return [
+        ('get_user_query_history', *d.build_history_query(1, before=('', 1))),
+        ('get_user_query_history_status', *d.build_history_query(1, before=('', 1), status='completed')),
+        ('get_user_query_history_api_config', *d.build_history_query(1, api_config_id=1)),
+        ('get_user_query_history_name_prefix', *d.build_history_query(1, name_prefix='任务')),
+        ('get_user_task_counts', d.TASK_COUNTS_SQL, (1,)),
+        ('get_user_summary', d.USER_SUMMARY_SQL, (1,)),
+        ('rebuild_user_summary', d.REBUILD_USER_SUMMARY_SQL, (1, 1, '', 1)),
+        ('get_user_upload_history', *d.build_upload_history_query(1, before=('', 1))),
+        ('delete_api_config', d.API_CONFIG_IN_USE_SQL, (1,)),
+        ('get_previous_schedule_task', d.PREVIOUS_SCHEDULE_TASK_SQL, (1, 'x', 'x')),
+        ('get_recent_uploads', d.RECENT_UPLOADS_SQL, (1, 3)),
+        ('cleanup_old_uploads', d.CLEANUP_OLD_UPLOADS_SQL, (1, 1, 10)),
+        ('get_user_api_configs', d.API_CONFIGS_SQL, (1,)),
+        ('find_brand_config', d.FIND_BRAND_CONFIG_SQL, (1, '')),
+        ('get_user_brand_configs', d.USER_BRAND_CONFIGS_SQL, (1,)),
+        ('get_user_schedules', d.USER_SCHEDULES_SQL, (1,)),
+        ('delete_expired_sessions', d.DELETE_EXPIRED_SESSIONS_SQL, ('', 500)),
+        ('get_expired_tasks', d.EXPIRED_TASKS_SQL, ('', 100)),
+        ('get_due_schedules', d.DUE_SCHEDULES_SQL, ('',)),
+    ]
+
+
+def apply_migrations(backend, conn, target_version=LATEST_VERSION):
+    """把数据库迁移到目标版本，每个版本在一个事务中执行，返回本次执行的版本号列表
+
+    版本号的读写和事务加锁由后端实现（SQLite使用user_version和BEGIN IMMEDIATE），
+    在锁内重新读取版本号，多个进程同时启动时每个版本只执行一次
+    """
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version > target_version:
+            break
+        backend.begin_migration(conn)
+        try:
+            if backend.get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            backend.set_schema_version(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"✓ 数据库迁移到版本 {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def explain(conn, sql, params):
+    """返回查询计划每一步的描述"""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def is_full_scan(plan, allow_sort=False):
+    """计划中有全表扫描或为排序建临时B树时视为未命中索引（FTS等虚拟表除外）
+
+    allow_sort: 索引已经把范围缩小到匹配的记录时，允许对这些记录排序
+    """
+    return any((step.startswith('SCAN ') and 'VIRTUAL TABLE' not in step)
+               or ('TEMP B-TREE' in step and not allow_sort)
+               for step in plan)
+
+
+def check_query_plans(conn):
+    """检查所有热点查询的执行计划，返回 [{name, plan, full_scan}]"""
+    checks = []
+    for name, sql, params in query_plan_checks():
+        plan = explain(conn, sql, params)
+        checks.append({'name': name, 'plan': plan,
+                       'full_scan': is_full_scan(plan, allow_sort=name in SORT_AFTER_INDEX_FILTER)})
+    return checks
+
+
+def print_plans(title, checks):
+    print(f"\n{title}")
+    for check in checks:
+        mark = '✗' if check['full_scan'] else '✓'
+        print(f"  {mark} {check['name']}: {' | '.join(check['plan'])}")
+
+
+def main():
+    from database import Database
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_db = Database(os.path.join(tmp_dir, 'plan_check.db'), migrate=False)
+        with check_db.connection() as conn:
+            before = check_query_plans(conn)
+            apply_migrations(check_db.backend, conn)
+            after = check_query_plans(conn)
+        check_db.backend.close()
+
+    print_plans("迁移前（版本0）", before)
+    print_plans(f"迁移后（版本{LATEST_VERSION}）", after)
+    failed = [check['name'] for check in after if check['full_scan']]
+    if failed:
+        print(f"\n✗ 迁移后仍有全表扫描: {', '.join(failed)}")
+        return False
+    print(f"\n✓ 全部{len(after)}个热点查询均使用索引")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
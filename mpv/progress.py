@@ -0,0 +1,239 @@
+"""
+任务进度统计
+原子计数器 + EWMA吞吐/延迟估计，按任务和按API端点分别维护，端点历史可以持久化到数据库
+"""
+import threading
+import time
+from datetime import datetime
+
+from cache import TTLCache
+
+# 没有任何历史数据时假设的单次请求耗时（秒）
+DEFAULT_LATENCY = 2.0
+
+
+class EWMA:
+    """指数加权移动平均"""
+
+    def __init__(self, alpha=0.2, initial=None):
+        self.alpha = alpha
+        self.value = initial
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value = self.alpha * sample + (1 - self.alpha) * self.value
+        return self.value
+
+
+# 端点历史的EWMA平滑系数
+LATENCY_ALPHA = 0.1      # 单次请求耗时（秒）
+THROUGHPUT_ALPHA = 0.3   # 整个任务的平均吞吐（请求/秒/并发）
+
+
+def _smooth(value, sample, alpha):
+    if sample is None:
+        return value
+    return sample if value is None else alpha * sample + (1 - alpha) * value
+
+
+class EndpointHistory:
+    """每个API端点（端点+模型）的历史延迟与单并发吞吐，任务结束时合并一次，用于预估新任务耗时
+
+    默认只保存在进程内存中；configure传入数据库的读写函数后改为持久化，
+    多个worker进程共享同一份历史，重启后也不会丢失，读取结果在进程内缓存ttl秒
+    """
+
+    def __init__(self, ttl=60):
+        self._load = None
+        self._record = None
+        self._cache = TTLCache(maxsize=256, ttl=ttl)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def configure(self, load, record):
+        """load(key) -> {'latency', 'throughput', 'samples'} 或 None；
+        record(key, latency, throughput, samples, latency_alpha, throughput_alpha) 负责按EWMA合并
+        """
+        self._load = load
+        self._record = record
+        self._cache.clear()
+
+    def get(self, key):
+        """端点的历史统计，没有记录时返回None"""
+        if key is None:
+            return None
+        if self._load is None:
+            with self._lock:
+                stats = self._memory.get(key)
+                return dict(stats) if stats else None
+        stats = self._cache.get(key)
+        if stats is None:
+            try:
+                stats = self._load(key) or {}
+            except Exception as e:
+                print(f"读取端点历史失败: {e}")
+                return None
+            self._cache.set(key, stats)
+        return dict(stats) if stats else None
+
+    def record(self, key, latency=None, throughput=None, samples=0):
+        """合并一个任务的平均延迟和单并发吞吐，为None的值不更新"""
+        if key is None or (latency is None and throughput is None):
+            return
+        if self._record is None:
+            with self._lock:
+                stats = self._memory.setdefault(key, {'latency': None, 'throughput': None, 'samples': 0})
+                stats['latency'] = _smooth(stats['latency'], latency, LATENCY_ALPHA)
+                stats['throughput'] = _smooth(stats['throughput'], throughput, THROUGHPUT_ALPHA)
+                stats['samples'] += samples
+            return
+        try:
+            self._record(key, latency, throughput, samples, LATENCY_ALPHA, THROUGHPUT_ALPHA)
+        except Exception as e:
+            print(f"保存端点历史失败: {e}")
+        self._cache.invalidate(key)
+
+
+endpoint_history = EndpointHistory()
+
+
+def endpoint_key(api_config):
+    """API配置对应的统计键"""
+    if not api_config:
+        return None
+    return f"{api_config.get('endpoint', '')}|{api_config.get('model') or 'default'}"
+
+
+def estimate_task_seconds(key, total_prompts, concurrency=3, request_delay=0.5):
+    """根据端点历史预估任务总耗时（秒），concurrency和request_delay应传入任务自己的设置"""
+    concurrency = max(1, concurrency)
+    stats = endpoint_history.get(key) or {}
+    throughput = stats.get('throughput')
+    latency = stats.get('latency')
+
+    if throughput:
+        return total_prompts / (throughput * concurrency)
+    per_request = (latency or DEFAULT_LATENCY) + request_delay
+    return total_prompts * per_request / concurrency
+
+
+class TaskProgress:
+    """单个任务的实时进度，计数器的所有修改都在锁内完成"""
+
+    def __init__(self, total_count, endpoint=None, concurrency=3, request_delay=0.5):
+        self._lock = threading.Lock()
+        self.status = 'running'
+        self.total_count = total_count
+        self.completed_count = 0   # 成功完成
+        self.failed_count = 0      # 失败或异常
+        self.in_flight = 0         # 正在请求中
+        self.start_time = datetime.now()
+        self.endpoint = endpoint
+        self.concurrency = max(1, concurrency)
+        self._stop_reason = None   # 'paused' | 'cancelled'
+        self._preloaded = 0
+        self.on_progress = None    # 每条请求结束后以已处理数量调用，用于上报持久化进度
+
+        self._started_at = time.monotonic()
+        self._last_finish = None
+        self._interval = EWMA(alpha=0.2)   # 相邻两次完成之间的间隔
+        self._latency = EWMA(alpha=0.2)
+        # 尚无样本时按端点历史估算的单条耗时
+        self._seed_per_prompt = (
+            estimate_task_seconds(endpoint, total_count, concurrency, request_delay) / total_count
+            if total_count else 0
+        )
+
+    @property
+    def processed_count(self):
+        return self.completed_count + self.failed_count
+
+    def preload(self, completed_count, failed_count):
+        """恢复任务时计入之前已完成的结果"""
+        with self._lock:
+            self.completed_count += completed_count
+            self.failed_count += failed_count
+            self._preloaded += completed_count + failed_count
+
+    @property
+    def stop_reason(self):
+        return self._stop_reason
+
+    def request_stop(self, reason):
+        """请求暂停或取消，取消优先于暂停"""
+        with self._lock:
+            if self._stop_reason != 'cancelled':
+                self._stop_reason = reason
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, latency, success):
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if success:
+                self.completed_count += 1
+            else:
+                self.failed_count += 1
+            self._latency.update(latency)
+            self._interval.update(now - (self._last_finish or self._started_at))
+            self._last_finish = now
+            processed = self.processed_count
+        if self.on_progress:
+            self.on_progress(processed)
+
+    def request_aborted(self):
+        """请求在完成前被取消，不计入成功或失败"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def requests_per_second(self):
+        with self._lock:
+            interval = self._interval.value
+        return 1.0 / interval if interval else 0.0
+
+    def eta_seconds(self):
+        with self._lock:
+            remaining = max(0, self.total_count - self.processed_count)
+            interval = self._interval.value
+        if remaining == 0:
+            return 0.0
+        if interval:
+            return remaining * interval
+        return remaining * self._seed_per_prompt
+
+    def finish(self, status):
+        """结束任务，并把本次运行的平均延迟和实际吞吐（只有完成的任务）合并到端点历史"""
+        with self._lock:
+            self.status = status
+            elapsed = time.monotonic() - self._started_at
+            processed = self.processed_count - self._preloaded
+            latency = self._latency.value
+        if not processed:
+            return
+        throughput = processed / elapsed / self.concurrency if status == 'completed' and elapsed > 0 else None
+        endpoint_history.record(self.endpoint, latency, throughput, processed)
+
+    def snapshot(self):
+        """供状态API返回的字典"""
+        rps = self.requests_per_second()
+        eta = self.eta_seconds()
+        with self._lock:
+            return {
+                'status': self.status,
+                'stop_requested': self._stop_reason,
+                'processed_count': self.processed_count,
+                'completed_count': self.completed_count,
+                'failed_count': self.failed_count,
+                'in_flight': self.in_flight,
+                'total_count': self.total_count,
+                'start_time': self.start_time.isoformat(),
+                'elapsed_time': round(time.monotonic() - self._started_at, 1),
+                'requests_per_second': round(rps, 2),
+                'avg_latency': round(self._latency.value, 2) if self._latency.value else None,
+                'eta_seconds': round(eta, 1),
+            }
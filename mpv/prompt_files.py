@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+上传的prompt文件流式解析
+只读取第一列（第一行为表头），逐条产生prompt，内存占用不随文件大小增长：
+CSV按块读取并自动识别编码（BOM、UTF-8，否则按GB18030），xlsx使用openpyxl只读模式逐行读取
+
+检查文件解析结果（在项目目录下运行）:
+  python prompt_files.py <文件路径>
+"""
+import os
+import sys
+import codecs
+from itertools import islice
+
+import pandas as pd
+from openpyxl import load_workbook
+
+CSV_CHUNK_ROWS = 10000
+SNIFF_BYTES = 64 * 1024
+
+# 带BOM的编码，UTF-32需要排在UTF-16之前（UTF-32 LE的BOM以UTF-16 LE的BOM开头）
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def sniff_encoding(file_path):
+    """根据文件开头识别CSV编码：有BOM时按BOM，能按UTF-8解码时用UTF-8，否则按GB18030（兼容GBK，中文Excel导出的CSV常用）
+
+    只检查开头SNIFF_BYTES字节，之后才出现的GBK内容由iter_csv_prompts在读取时回退处理
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    try:
+        # 增量解码，末尾被截断的多字节字符不算错误
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=len(head) < SNIFF_BYTES)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'gb18030'
+
+
+def _clean(value):
+    """单元格转为prompt文本，空值返回None"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def _read_csv_column(file_path, encoding, chunk_rows):
+    reader = pd.read_csv(file_path, usecols=[0], dtype=str, encoding=encoding, chunksize=chunk_rows)
+    with reader:
+        for chunk in reader:
+            for value in chunk.iloc[:, 0]:
+                prompt = _clean(value)
+                if prompt:
+                    yield prompt
+
+
+def iter_csv_prompts(file_path, chunk_rows=CSV_CHUNK_ROWS):
+    encoding = sniff_encoding(file_path)
+    count = 0
+    try:
+        for prompt in _read_csv_column(file_path, encoding, chunk_rows):
+            yield prompt
+            count += 1
+    except UnicodeDecodeError:
+        if encoding != 'utf-8':
+            raise
+        # 开头只有ASCII的GBK文件会被识别为UTF-8，读到中文时出错：按GB18030重新读取，
+        # 跳过已经产生的prompt（ASCII部分两种编码的解码结果相同）
+        yield from islice(_read_csv_column(file_path, 'gb18030', chunk_rows), count, None)
+
+
+def iter_xlsx_prompts(file_path):
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # 部分工具生成的文件记录的表格范围不准确，按实际内容读取
+        sheet.reset_dimensions()
+        for row in sheet.iter_rows(min_row=2, max_col=1, values_only=True):
+            prompt = _clean(row[0]) if row else None
+            if prompt:
+                yield prompt
+    finally:
+        workbook.close()
+
+
+def iter_xls_prompts(file_path):
+    # 旧版.xls格式openpyxl不支持，仍由pandas（xlrd）读取，只解析第一列
+    df = pd.read_excel(file_path, usecols=[0], dtype=str)
+    for value in df.iloc[:, 0]:
+        prompt = _clean(value)
+        if prompt:
+            yield prompt
+
+
+def iter_prompt_file(file_path):
+    """按文件类型惰性产生第一列中的prompt，解析出错时在迭代过程中抛出异常"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.csv':
+        return iter_csv_prompts(file_path)
+    if ext == '.xls':
+        return iter_xls_prompts(file_path)
+    return iter_xlsx_prompts(file_path)
+
+
+def scan_prompt_file(file_path, preview_size=10):
+    """读取一遍文件，返回 (前preview_size个prompt, prompt总数)，解析失败时返回 ([], 0)"""
+    try:
+        prompts = iter_prompt_file(file_path)
+        preview = list(islice(prompts, preview_size))
+        return preview, len(preview) + sum(1 for _ in prompts)
+    except Exception as e:
+        print(f"文件解析错误: {e}")
+        return [], 0
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return False
+    file_path = sys.argv[1]
+    if file_path.lower().endswith('.csv'):
+        print(f"编码: {sniff_encoding(file_path)}")
+    preview, count = scan_prompt_file(file_path)
+    for prompt in preview:
+        print(f"  {prompt[:80]}")
+    print(f"共 {count} 个提示词")
+    return count > 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
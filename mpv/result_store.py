@@ -0,0 +1,538 @@
+"""
+任务结果存储
+prompt和结果都以JSONL逐条落盘，统计信息增量计算，内存占用不随prompt数量增长
+"""
+import os
+import io
+import csv
+import json
+import heapq
+import sqlite3
+import hashlib
+from array import array
+from itertools import islice
+
+from compression import open_compressed_write, open_compressed_read
+
+
+def spool_prompts(path, prompts, limit=None):
+    """把prompt逐条写入JSONL文件，返回写入数量
+
+    达到limit后停止，不会多取迭代器中的下一条，调用方可以继续读取剩余部分（例如统计总数）
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for prompt in islice(prompts, limit):
+            f.write(json.dumps(prompt, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def iter_prompts(path):
+    """按行惰性读取prompt文件，生成 (index, prompt)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            yield index, json.loads(line)
+
+
+def get_hits(result, brands, domains):
+    """结果命中的品牌/域名位置列表（升序）
+
+    位置按任务的 brands + domains 顺序编号，品牌和域名名单每个任务只保存一次；
+    同时兼容旧格式中以analysis字典保存的结果
+    """
+    if 'hits' in result:
+        return result['hits']
+    analysis = result.get('analysis') or {}
+    hits = [i for i, brand in enumerate(brands) if analysis.get('brands', {}).get(brand, 0)]
+    hits += [len(brands) + i for i, domain in enumerate(domains) if analysis.get('domains', {}).get(domain, 0)]
+    return hits
+
+
+def hits_to_bits(hits, target_count):
+    """命中位置列表转换为 '0101' 形式的位串"""
+    bits = ['0'] * target_count
+    for position in hits:
+        bits[position] = '1'
+    return ''.join(bits)
+
+
+class ResultSink:
+    """结果写入器：每条结果追加到JSONL文件，同时累计统计信息
+
+    只在内存中保存每条结果在文件中的偏移量，已有文件会被重新加载，
+    因此暂停后恢复的任务可以直接跳过已经完成的prompt。
+    """
+
+    def __init__(self, path, brands, domains):
+        self.path = path
+        self.brands = brands
+        self.domains = domains
+        self.count = 0
+        self.successful = 0
+        self.brand_mention_count = 0
+        self.domain_mention_count = 0
+        self._hit_counts = array('q', [0] * (len(brands) + len(domains)))  # 按命中位置计数
+        self._offsets = array('q')  # 下标为prompt序号，-1表示尚未完成
+
+        if os.path.exists(path):
+            self._load_existing()
+        self._file = open(path, 'ab')
+
+    def _load_existing(self):
+        """重新加载已有结果；中断时写了一半的最后一行会被截掉"""
+        valid_end = 0
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._account(record['index'], offset, record['result'])
+                offset += len(line)
+                valid_end = offset
+        if valid_end != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def _account(self, index, offset, result):
+        if index >= len(self._offsets):
+            self._offsets.extend([-1] * (index + 1 - len(self._offsets)))
+        self._offsets[index] = offset
+        self.count += 1
+
+        if result['status'] != 'success':
+            return
+        hits = get_hits(result, self.brands, self.domains)
+        self.successful += 1
+        brand_count = len(self.brands)
+        if hits and hits[0] < brand_count:
+            self.brand_mention_count += 1
+        if hits and hits[-1] >= brand_count:
+            self.domain_mention_count += 1
+        for position in hits:
+            self._hit_counts[position] += 1
+
+    def is_done(self, index):
+        return index < len(self._offsets) and self._offsets[index] >= 0
+
+    @property
+    def failed(self):
+        return self.count - self.successful
+
+    @property
+    def brand_counts(self):
+        return dict(zip(self.brands, self._hit_counts[:len(self.brands)]))
+
+    @property
+    def domain_counts(self):
+        return dict(zip(self.domains, self._hit_counts[len(self.brands):]))
+
+    def write(self, index, result):
+        """追加一条结果"""
+        line = json.dumps({'index': index, 'result': result}, ensure_ascii=False).encode('utf-8') + b'\n'
+        offset = self._file.tell()
+        self._file.write(line)
+        self._file.flush()
+        self._account(index, offset, result)
+
+    def iter_indexed(self):
+        """按prompt顺序逐条读取 (index, result)"""
+        self._file.flush()
+        with open(self.path, 'rb') as f:
+            for index, offset in enumerate(self._offsets):
+                if offset < 0:
+                    continue
+                f.seek(offset)
+                yield index, json.loads(f.readline())['result']
+
+    def iter_results(self):
+        """按prompt顺序逐条读取结果"""
+        for _, result in self.iter_indexed():
+            yield result
+
+    def stats(self):
+        """与结果文件摘要字段一致的统计信息"""
+        return build_stats(self.successful, self.brand_mention_count, self.domain_mention_count,
+                           self.brand_counts, self.domain_counts)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class MergedResults:
+    """把多个分片的ResultSink合并成一个结果集，接口与ResultSink一致"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    @property
+    def count(self):
+        return sum(sink.count for sink in self.sinks)
+
+    @property
+    def successful(self):
+        return sum(sink.successful for sink in self.sinks)
+
+    @property
+    def failed(self):
+        return self.count - self.successful
+
+    def iter_indexed(self):
+        """各分片内已按序号排列，归并即可得到全局顺序"""
+        return heapq.merge(*(sink.iter_indexed() for sink in self.sinks), key=lambda item: item[0])
+
+    def iter_results(self):
+        for _, result in self.iter_indexed():
+            yield result
+
+    def stats(self):
+        brand_counts = {}
+        domain_counts = {}
+        for sink in self.sinks:
+            for brand, count in sink.brand_counts.items():
+                brand_counts[brand] = brand_counts.get(brand, 0) + count
+            for domain, count in sink.domain_counts.items():
+                domain_counts[domain] = domain_counts.get(domain, 0) + count
+        return build_stats(
+            self.successful,
+            sum(sink.brand_mention_count for sink in self.sinks),
+            sum(sink.domain_mention_count for sink in self.sinks),
+            brand_counts,
+            domain_counts,
+        )
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def build_stats(successful, brand_mention_count, domain_mention_count, brand_counts, domain_counts):
+    """根据计数生成与结果文件摘要字段一致的统计信息"""
+    def rate(count):
+        return round(count / successful * 100, 2) if successful > 0 else 0
+
+    return {
+        'successful_queries': successful,
+        'brand_mention_count': brand_mention_count,  # 有品牌提及的回答数量
+        'domain_mention_count': domain_mention_count,  # 有域名提及的回答数量
+        'total_brand_mentions': brand_mention_count,  # 为了模板兼容性
+        'total_domain_mentions': domain_mention_count,  # 为了模板兼容性
+        'brand_mention_rate': rate(brand_mention_count),
+        'domain_mention_rate': rate(domain_mention_count),
+        'brand_stats': {
+            brand: {'mention_count': count, 'mention_rate': rate(count)}
+            for brand, count in brand_counts.items()
+        },
+        'domain_stats': {
+            domain: {'mention_count': count, 'mention_rate': rate(count)}
+            for domain, count in domain_counts.items()
+        },
+    }
+
+
+def write_result_file(result_file, summary, results, compression='none', dictionary=None):
+    """流式写出结果JSON：先写摘要字段，再逐条写入results，不在内存中拼装整个列表
+
+    compression: 'zstd' / 'gzip' / 'none'，result_file应带有对应的扩展名
+    """
+    tmp_file = result_file + '.tmp'
+    head = json.dumps(summary, ensure_ascii=False, indent=2)
+    with open_compressed_write(tmp_file, compression, dictionary) as f:
+        f.write(head[:-2])  # 去掉结尾的 "\n}"
+        f.write(',\n  "results": [')
+        for i, result in enumerate(results):
+            f.write(',\n    ' if i else '\n    ')
+            f.write(json.dumps(result, ensure_ascii=False))
+        f.write('\n  ]\n}\n')
+    os.replace(tmp_file, result_file)
+
+
+def load_result_file(result_file):
+    """读取结果JSON，压缩文件透明解压"""
+    with open_compressed_read(result_file) as f:
+        return json.load(f)
+
+
+def sample_results(results, limit=2000):
+    """取前limit条结果的JSON作为压缩字典的训练样本"""
+    samples = []
+    for result in results:
+        samples.append(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        if len(samples) >= limit:
+            break
+    return samples
+
+
+def prompt_key(prompt):
+    """prompt的稳定哈希，用于跨任务按prompt对齐结果"""
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+
+def write_mention_state(path, results, brands, domains):
+    """保存每个prompt的提及状态（品牌/域名命中位串），供下一次运行做增量比较
+
+    失败的请求记为None，比较时跳过，避免把请求失败误判为提及变化
+    """
+    prompts = {}
+    for result in results:
+        if result['status'] == 'success':
+            bits = hits_to_bits(get_hits(result, brands, domains), len(brands) + len(domains))
+        else:
+            bits = None
+        prompts[prompt_key(result['prompt'])] = [result['prompt'], bits]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'brands': brands, 'domains': domains, 'prompts': prompts}, f, ensure_ascii=False)
+
+
+def _mentioned_names(state, bits):
+    names = state['brands'] + state['domains']
+    return {name for name, bit in zip(names, bits) if bit == '1'}
+
+
+def compute_mention_delta(previous_path, current_path):
+    """比较两次运行的提及状态，只返回提及情况发生变化的prompt"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    tracked = current['brands'] + current['domains']
+    summary = {name: {'gained': 0, 'lost': 0} for name in tracked}
+    changed = []
+    for key, (prompt, bits) in current['prompts'].items():
+        before = previous['prompts'].get(key)
+        if before is None or before[1] is None or bits is None:
+            continue
+        old_names = _mentioned_names(previous, before[1])
+        new_names = _mentioned_names(current, bits)
+        gained = sorted(name for name in new_names - old_names if name in summary)
+        lost = sorted(name for name in old_names - new_names if name in summary)
+        if not gained and not lost:
+            continue
+        for name in gained:
+            summary[name]['gained'] += 1
+        for name in lost:
+            summary[name]['lost'] += 1
+        changed.append({'prompt': prompt, 'gained': gained, 'lost': lost})
+
+    return {
+        'changed': changed,
+        'changed_count': len(changed),
+        'gained_count': sum(item['gained'] for item in summary.values()),
+        'lost_count': sum(item['lost'] for item in summary.values()),
+        'new_prompts': len(current['prompts'].keys() - previous['prompts'].keys()),
+        'removed_prompts': len(previous['prompts'].keys() - current['prompts'].keys()),
+        'summary': summary,
+    }
+
+
+# 按任务划分的结果库：每个任务一个SQLite文件，逐行保存结果以支持分页和筛选
+RESULT_DB_SCHEMA = '''
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE targets (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL
+    );
+    CREATE TABLE results (
+        idx INTEGER PRIMARY KEY,
+        prompt TEXT NOT NULL,
+        response TEXT,
+        status TEXT NOT NULL,
+        has_brand_mention INTEGER NOT NULL,
+        has_domain_mention INTEGER NOT NULL,
+        brand_mentions INTEGER NOT NULL,
+        domain_mentions INTEGER NOT NULL,
+        hits TEXT NOT NULL
+    );
+    CREATE TABLE result_hits (
+        target_id INTEGER NOT NULL,
+        idx INTEGER NOT NULL,
+        PRIMARY KEY (target_id, idx)
+    ) WITHOUT ROWID;
+'''
+
+RESULT_DB_INDEXES = '''
+    CREATE INDEX idx_results_status ON results (status, idx);
+    CREATE INDEX idx_results_brand_mention ON results (has_brand_mention, idx);
+    CREATE INDEX idx_results_domain_mention ON results (has_domain_mention, idx);
+'''
+
+
+def build_result_db(db_path, summary, results, batch_size=1000):
+    """把任务结果逐行写入结果库
+
+    summary: 结果文件的摘要字段（不含results）
+    hits列按targets顺序（先品牌后域名）保存命中位串，result_hits用于按品牌/域名筛选
+    """
+    brands = summary.get('brands', [])
+    domains = summary.get('domains', [])
+    targets = [('brand', name) for name in brands] + [('domain', name) for name in domains]
+
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(RESULT_DB_SCHEMA)
+        conn.executemany('INSERT INTO targets (id, kind, name) VALUES (?, ?, ?)',
+                         [(i, kind, name) for i, (kind, name) in enumerate(targets)])
+
+        rows, hits, count = [], [], 0
+        for idx, result in enumerate(results):
+            positions = get_hits(result, brands, domains)
+            brand_mentions = sum(1 for position in positions if position < len(brands))
+            domain_mentions = len(positions) - brand_mentions
+            rows.append((idx, result['prompt'], result['response'], result['status'],
+                         int(brand_mentions > 0), int(domain_mentions > 0), brand_mentions, domain_mentions,
+                         hits_to_bits(positions, len(targets))))
+            hits.extend((position, idx) for position in positions)
+            count += 1
+            if len(rows) >= batch_size:
+                conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                conn.executemany('INSERT INTO result_hits VALUES (?, ?)', hits)
+                rows, hits = [], []
+        conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany('INSERT INTO result_hits VALUES (?, ?)', hits)
+
+        # 数据写完后再建索引，比逐行维护索引快
+        conn.executescript(RESULT_DB_INDEXES)
+        summary = {key: value for key, value in summary.items() if key != 'results'}
+        summary['result_count'] = count
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('summary', json.dumps(summary, ensure_ascii=False)))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def _connect_readonly(db_path):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def load_result_summary(db_path):
+    """读取结果摘要（不含逐条结果）"""
+    conn = _connect_readonly(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()
+        return json.loads(row['value'])
+    finally:
+        conn.close()
+
+
+def query_result_rows(db_path, page=1, per_page=50, status=None, brand=None, domain=None,
+                      mention=None, search=None):
+    """分页查询结果行，返回 (符合条件的总数, 当前页的行)
+
+    mention: 'brand' / 'domain' 只看有提及的行，'none' 只看两者都没有提及的行
+    search: 在prompt和回复中做子串匹配
+    """
+    where, params = [], []
+    if status:
+        where.append('r.status = ?')
+        params.append(status)
+    for kind, name in (('brand', brand), ('domain', domain)):
+        if name:
+            where.append('r.idx IN (SELECT h.idx FROM result_hits h JOIN targets t ON t.id = h.target_id '
+                         'WHERE t.kind = ? AND t.name = ?)')
+            params.extend([kind, name])
+    if mention == 'brand':
+        where.append('r.has_brand_mention = 1')
+    elif mention == 'domain':
+        where.append('r.has_domain_mention = 1')
+    elif mention == 'none':
+        where.append('r.has_brand_mention = 0 AND r.has_domain_mention = 0')
+    if search:
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(r.prompt LIKE ? ESCAPE '\\' OR r.response LIKE ? ESCAPE '\\')")
+        params.extend([pattern, pattern])
+    where_sql = ('WHERE ' + ' AND '.join(where)) if where else ''
+
+    conn = _connect_readonly(db_path)
+    try:
+        targets = conn.execute('SELECT kind, name FROM targets ORDER BY id').fetchall()
+        total = conn.execute(f'SELECT COUNT(*) FROM results r {where_sql}', params).fetchone()[0]
+        records = conn.execute(
+            f'SELECT r.* FROM results r {where_sql} ORDER BY r.idx LIMIT ? OFFSET ?',
+            params + [per_page, (page - 1) * per_page]
+        ).fetchall()
+    finally:
+        conn.close()
+
+    rows = []
+    for record in records:
+        hit_targets = [target for target, bit in zip(targets, record['hits']) if bit == '1']
+        rows.append({
+            'index': record['idx'],
+            'prompt': record['prompt'],
+            'response': record['response'],
+            'status': record['status'],
+            'has_brand_mention': bool(record['has_brand_mention']),
+            'has_domain_mention': bool(record['has_domain_mention']),
+            'brands': [name for kind, name in hit_targets if kind == 'brand'],
+            'domains': [name for kind, name in hit_targets if kind == 'domain'],
+        })
+    return total, rows
+
+
+def iter_search_rows(db_path):
+    """逐条读取 (序号, prompt, 回复)，用于写入全文索引"""
+    conn = _connect_readonly(db_path)
+    try:
+        for record in conn.execute('SELECT idx, prompt, response FROM results ORDER BY idx'):
+            yield record['idx'], record['prompt'], record['response']
+    finally:
+        conn.close()
+
+
+def iter_export_rows(db_path, chunk_rows=500):
+    """按导出列顺序逐行生成结果，第一行是表头；列与原先的DataFrame导出一致"""
+    conn = _connect_readonly(db_path)
+    try:
+        targets = conn.execute('SELECT kind, name FROM targets ORDER BY id').fetchall()
+        header = ['Prompt', 'Response', 'Status', 'Has_Brand_Mention', 'Has_Domain_Mention',
+                  'Brand_Mention_Count', 'Domain_Mention_Count']
+        header += [f"{'Brand' if kind == 'brand' else 'Domain'}_{name}" for kind, name in targets]
+        yield header
+
+        cursor = conn.execute(
+            'SELECT prompt, response, status, has_brand_mention, has_domain_mention, '
+            'brand_mentions, domain_mentions, hits FROM results ORDER BY idx'
+        )
+        while True:
+            records = cursor.fetchmany(chunk_rows)
+            if not records:
+                break
+            for record in records:
+                yield list(record)[:7] + [int(bit) for bit in record['hits']]
+    finally:
+        conn.close()
+
+
+def iter_result_csv(db_path, chunk_size=64 * 1024):
+    """逐块生成结果CSV文本
+
+    直接遍历结果库游标，内存占用与结果数量无关；第一块以BOM开头（utf-8-sig）
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    buffer.write('\ufeff')
+    for row in iter_export_rows(db_path):
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
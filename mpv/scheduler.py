@@ -0,0 +1,80 @@
+"""
+定时监测调度器
+后台线程定期检查到期的监测计划，下一次运行时间带随机抖动，避免所有计划同时触发
+"""
+import random
+import threading
+from datetime import datetime, timedelta
+
+# 计划的运行间隔（小时）和并发数范围
+MIN_INTERVAL_HOURS = 1
+MAX_INTERVAL_HOURS = 24 * 365
+MAX_CONCURRENCY = 10
+
+
+def next_run_time(interval_hours, jitter_ratio=0.1, now=None):
+    """计算下一次运行时间：间隔上下浮动 jitter_ratio"""
+    now = now or datetime.now()
+    interval = timedelta(hours=interval_hours).total_seconds()
+    jitter = random.uniform(-interval * jitter_ratio, interval * jitter_ratio)
+    return now + timedelta(seconds=interval + jitter)
+
+
+def first_run_time(poll_interval, now=None):
+    """新建计划的首次运行时间：在接下来几个轮询周期内随机分布"""
+    now = now or datetime.now()
+    return now + timedelta(seconds=random.uniform(0, poll_interval * 3))
+
+
+class MonitorScheduler:
+    """轮询数据库中的到期计划并启动运行
+
+    launch: 回调函数，参数为计划记录（dict），负责创建并启动任务
+    多个进程同时运行调度器时，通过数据库认领保证每次运行只被启动一次
+    """
+
+    def __init__(self, db, launch, poll_interval=60, jitter_ratio=0.1):
+        self.db = db
+        self.launch = launch
+        self.poll_interval = poll_interval
+        self.jitter_ratio = jitter_ratio
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='monitor-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_pending(self, now=None):
+        """启动所有已到期的计划，返回启动的数量"""
+        now = now or datetime.now()
+        launched = 0
+        for schedule in self.db.get_due_schedules(now.isoformat()):
+            try:
+                # 单个计划的间隔数据异常时只跳过该计划，不影响其他到期计划
+                next_run_at = next_run_time(schedule['interval_hours'], self.jitter_ratio, now).isoformat()
+            except (OverflowError, ValueError, TypeError) as e:
+                print(f"计划 {schedule['id']} 的运行间隔无效: {e}")
+                continue
+            if not self.db.claim_schedule(schedule['id'], schedule['next_run_at'], next_run_at):
+                continue  # 已被其他进程认领
+            try:
+                self.launch(schedule)
+                launched += 1
+            except Exception as e:
+                print(f"定时任务启动失败 (计划 {schedule['id']}): {e}")
+        return launched
+
+    def _loop(self):
+        # 轮询间隔本身也加入少量抖动，多个进程不会同时查询
+        while not self._stop.wait(self.poll_interval * random.uniform(0.9, 1.1)):
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"调度器运行失败: {e}")
@@ -0,0 +1,149 @@
+"""
+分片执行：把一个任务的prompt拆到多个子进程，每个子进程运行独立的事件循环
+JSON解析和品牌匹配的CPU开销因此分摊到多个核心，请求速率由跨进程共享的限速器控制
+"""
+import time
+import queue
+import asyncio
+import multiprocessing
+
+from analysis import batch_query_llms
+from result_store import ResultSink, MergedResults, iter_prompts
+
+# 子进程通过共享整数读取暂停/取消请求
+STOP_CODES = {None: 0, 'paused': 1, 'cancelled': 2}
+STOP_REASONS = {code: reason for reason, code in STOP_CODES.items()}
+
+
+class SharedRateLimiter:
+    """跨进程共享的全局限速器：所有分片合计每秒最多发出rate个请求"""
+
+    def __init__(self, ctx, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = ctx.Value('d', 0.0, lock=False)
+        self._lock = ctx.Lock()
+
+    async def wait(self):
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class ShardProgress:
+    """子进程中的进度对象，把计数事件发回父进程，接口与TaskProgress一致"""
+
+    def __init__(self, stop_flag, events):
+        self._stop_flag = stop_flag
+        self._events = events
+
+    @property
+    def stop_reason(self):
+        return STOP_REASONS.get(self._stop_flag.value)
+
+    def request_started(self):
+        self._events.put(('started',))
+
+    def request_finished(self, latency, success):
+        self._events.put(('finished', latency, success))
+
+    def request_aborted(self):
+        self._events.put(('aborted',))
+
+
+def get_shard_paths(results_path, shard_count):
+    """每个分片独立的结果文件，例如 <task_id>.shard0.results.jsonl"""
+    base = results_path[:-len('.results.jsonl')]
+    return [f'{base}.shard{shard}.results.jsonl' for shard in range(shard_count)]
+
+
+def plan_shard_count(shard_count, concurrency, total_prompts):
+    """实际使用的分片数：不超过任务总并发和prompt数，保证每个分片至少分到1个并发和1个prompt"""
+    return max(1, min(shard_count, concurrency, total_prompts))
+
+
+def split_concurrency(concurrency, shard_count):
+    """把任务总并发精确分配到各分片，余数分给前面的分片，各分片合计等于concurrency"""
+    base, extra = divmod(concurrency, shard_count)
+    return [base + (1 if shard < extra else 0) for shard in range(shard_count)]
+
+
+def run_shard(shard, shard_count, prompts_file, sink_path, api_config, brands, domains,
+              concurrency, request_delay, stop_flag, events, rate_limiter):
+    """子进程入口：处理序号 index % shard_count == shard 的prompt"""
+    sink = ResultSink(sink_path, brands, domains)
+    progress = ShardProgress(stop_flag, events)
+    prompts = ((index, prompt) for index, prompt in iter_prompts(prompts_file)
+               if index % shard_count == shard)
+    try:
+        asyncio.run(batch_query_llms(prompts, api_config, brands, domains, progress, sink,
+                                     concurrency, request_delay, rate_limiter))
+    finally:
+        sink.close()
+
+
+def open_shard_results(results_path, shard_count, brands, domains):
+    """打开各分片的结果文件并合并"""
+    return MergedResults([ResultSink(path, brands, domains)
+                          for path in get_shard_paths(results_path, shard_count)])
+
+
+def run_sharded(progress, shard_count, prompts_file, results_path, api_config, brands, domains,
+                concurrency=3, request_delay=0.5, rate_limit=None):
+    """在shard_count个子进程中执行任务，返回合并后的结果集
+
+    progress: 父进程中的TaskProgress，子进程的计数事件会汇总到这里，
+    对它发出的暂停/取消请求也会同步给所有子进程
+    concurrency: 任务总并发，精确分配到各分片（见split_concurrency），shard_count应先经plan_shard_count限制
+    rate_limit: 所有分片合计的每秒请求上限，为空时不限速
+    """
+    ctx = multiprocessing.get_context('spawn')
+    stop_flag = ctx.Value('i', 0, lock=False)
+    events = ctx.Queue()
+    rate_limiter = SharedRateLimiter(ctx, rate_limit) if rate_limit else None
+    # 修复前保存的检查点中分片数可能超过并发数，恢复时仍按原分片数执行，每个分片至少1个并发
+    shard_concurrency = [max(1, share) for share in split_concurrency(concurrency, shard_count)]
+
+    processes = [
+        ctx.Process(
+            target=run_shard,
+            args=(shard, shard_count, prompts_file, sink_path, api_config, brands, domains,
+                  shard_concurrency[shard], request_delay, stop_flag, events, rate_limiter),
+            daemon=True,
+        )
+        for shard, sink_path in enumerate(get_shard_paths(results_path, shard_count))
+    ]
+    for process in processes:
+        process.start()
+
+    def handle(event):
+        if event[0] == 'started':
+            progress.request_started()
+        elif event[0] == 'finished':
+            progress.request_finished(event[1], event[2])
+        else:
+            progress.request_aborted()
+
+    # 子进程运行期间持续汇总进度，并转发暂停/取消请求
+    while any(process.is_alive() for process in processes):
+        stop_flag.value = STOP_CODES[progress.stop_reason]
+        try:
+            handle(events.get(timeout=0.2))
+        except queue.Empty:
+            continue
+
+    for process in processes:
+        process.join()
+    while True:
+        try:
+            handle(events.get_nowait())
+        except queue.Empty:
+            break
+
+    failed = [shard for shard, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f'分片 {failed} 执行失败')
+
+    return open_shard_results(results_path, shard_count, brands, domains)
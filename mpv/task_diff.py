@@ -0,0 +1,144 @@
+"""
+任务结果对比
+按prompt哈希对齐两个任务的结果库，用numpy向量运算统计每个品牌/域名的新增和丢失提及、提及率变化以及发生翻转的prompt
+"""
+import sqlite3
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+def _hits_matrix(hits, target_count):
+    """命中位串列一次性转换为 行数×目标数 的布尔矩阵"""
+    if not target_count or hits.empty:
+        return np.zeros((len(hits), target_count), dtype=bool)
+    raw = np.frombuffer(''.join(hits).encode('ascii'), dtype=np.uint8)
+    return raw.reshape(len(hits), target_count) == ord('1')
+
+
+def load_result_frame(db_path):
+    """读取结果库，返回 (targets, frame, hits)
+
+    frame含key(prompt哈希)/idx/prompt/success列，hits为与frame行对应的命中矩阵
+    同一任务中重复的prompt只保留第一条
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        targets = [tuple(row) for row in conn.execute('SELECT kind, name FROM targets ORDER BY id')]
+        frame = pd.read_sql_query('SELECT idx, prompt, status, hits FROM results ORDER BY idx', conn)
+    finally:
+        conn.close()
+
+    frame['key'] = pd.util.hash_array(frame['prompt'].to_numpy(dtype=object))
+    frame = frame.drop_duplicates('key', ignore_index=True)
+    hits = _hits_matrix(frame['hits'], len(targets))
+    frame = frame.assign(success=frame['status'].eq('success')).drop(columns=['hits', 'status'])
+    return targets, frame, hits
+
+
+class TaskDiff:
+    """两个任务结果的对比，A为基准任务，B为对比任务
+
+    只比较两个任务都请求成功的prompt和两个任务都监测的品牌/域名，避免把请求失败或配置变化误判为提及变化
+    """
+
+    def __init__(self, db_a, db_b):
+        targets_a, frame_a, hits_a = load_result_frame(db_a)
+        targets_b, frame_b, hits_b = load_result_frame(db_b)
+
+        merged = frame_a.reset_index().merge(frame_b.reset_index(), on='key', suffixes=('_a', '_b'))
+        position_b = {target: i for i, target in enumerate(targets_b)}
+        self.targets = [target for target in targets_a if target in position_b]
+        columns_a = [i for i, target in enumerate(targets_a) if target in position_b]
+        columns_b = [position_b[target] for target in self.targets]
+
+        success_a = merged['success_a'].to_numpy()
+        success_b = merged['success_b'].to_numpy()
+        comparable = success_a & success_b
+        before = hits_a[merged['index_a'].to_numpy()][:, columns_a] & comparable[:, None]
+        after = hits_b[merged['index_b'].to_numpy()][:, columns_b] & comparable[:, None]
+        gained = after & ~before
+        lost = before & ~after
+
+        self.counts = {
+            'prompts_a': len(frame_a),
+            'prompts_b': len(frame_b),
+            'matched': len(merged),
+            'compared': int(comparable.sum()),
+            'only_a': len(frame_a) - len(merged),
+            'only_b': len(frame_b) - len(merged),
+            'newly_failed': int((success_a & ~success_b).sum()),
+            'recovered': int((~success_a & success_b).sum()),
+        }
+        self.stats = self._target_stats(before, after, gained, lost)
+
+        # 只保留发生翻转的行，分页时再把命中矩阵转换为品牌/域名名称
+        flipped = (gained | lost).any(axis=1)
+        self.flipped = merged.loc[flipped, ['idx_a', 'idx_b', 'prompt_a']].reset_index(drop=True)
+        self.gained = gained[flipped]
+        self.lost = lost[flipped]
+        self.counts['flipped'] = len(self.flipped)
+
+    def _target_stats(self, before, after, gained, lost):
+        compared = self.counts['compared']
+        count_a, count_b = before.sum(axis=0), after.sum(axis=0)
+        gained_count, lost_count = gained.sum(axis=0), lost.sum(axis=0)
+        stats = []
+        for i, (kind, name) in enumerate(self.targets):
+            rate_a = round(count_a[i] / compared * 100, 2) if compared else 0
+            rate_b = round(count_b[i] / compared * 100, 2) if compared else 0
+            stats.append({
+                'kind': kind,
+                'name': name,
+                'mention_count_a': int(count_a[i]),
+                'mention_count_b': int(count_b[i]),
+                'mention_rate_a': rate_a,
+                'mention_rate_b': rate_b,
+                'rate_delta': round(rate_b - rate_a, 2),
+                'gained': int(gained_count[i]),
+                'lost': int(lost_count[i]),
+            })
+        return stats
+
+    def summary(self):
+        return {'counts': self.counts, 'targets': self.stats}
+
+    def flipped_rows(self, offset=0, limit=50, target=None, change=None):
+        """分页返回翻转的prompt，返回 (符合条件的总数, 当前页的行)
+
+        target: (kind, name) 只看该品牌/域名发生变化的行
+        change: 'gained' / 'lost' 只看新增或丢失提及的行
+        """
+        if target is not None and target not in self.targets:
+            return 0, []
+        columns = [self.targets.index(target)] if target is not None else slice(None)
+        if change == 'gained':
+            mask = self.gained[:, columns].any(axis=1)
+        elif change == 'lost':
+            mask = self.lost[:, columns].any(axis=1)
+        else:
+            mask = (self.gained[:, columns] | self.lost[:, columns]).any(axis=1)
+
+        positions = np.flatnonzero(mask)
+        page = positions[offset:offset + limit]
+        rows = []
+        for position in page:
+            record = self.flipped.iloc[position]
+            rows.append({
+                'index_a': int(record['idx_a']),
+                'index_b': int(record['idx_b']),
+                'prompt': record['prompt_a'],
+                'gained': self._names(self.gained[position]),
+                'lost': self._names(self.lost[position]),
+            })
+        return len(positions), rows
+
+    def _names(self, bits):
+        return [{'kind': kind, 'name': name} for (kind, name), bit in zip(self.targets, bits) if bit]
+
+
+@lru_cache(maxsize=8)
+def load_task_diff(hash_a, hash_b, db_a, db_b):
+    """按两个结果的内容哈希缓存对比结果，翻页和筛选不再重新计算"""
+    return TaskDiff(db_a, db_b)
@@ -0,0 +1,68 @@
+"""
+任务进度写回缓冲
+逐条prompt上报的进度先在内存中按任务合并，定时或攒够一定数量后在一个事务中批量写入数据库，避免每条进度一次提交
+"""
+import atexit
+import threading
+
+
+class ProgressBuffer:
+    """按任务合并进度更新的写回缓冲
+
+    flush_fn: 接收 [(task_id, completed_prompts), ...] 并在一个事务中写入
+    每隔flush_interval秒，或累计flush_count次更新后，由后台线程写入；进程退出前写入剩余的更新
+    """
+
+    def __init__(self, flush_fn, flush_interval=2.0, flush_count=200):
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self._pending = {}
+        self._updates = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 同一时间只有一个批次在写入
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def report(self, task_id, completed_prompts):
+        """记录任务的最新进度，只保留最大值"""
+        with self._lock:
+            self._pending[task_id] = max(self._pending.get(task_id, 0), completed_prompts)
+            self._updates += 1
+            due = self._updates >= self.flush_count
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if due:
+            self._wakeup.set()
+
+    def take(self, task_id):
+        """取出任务尚未写入的进度（没有时返回None），交给调用方同步写入
+
+        会等待正在写入的批次完成，之后的同步写入不会被旧进度覆盖
+        """
+        with self._flush_lock:
+            with self._lock:
+                return self._pending.pop(task_id, None)
+
+    def flush(self):
+        """立即写入所有缓冲的进度，写入失败时放回缓冲等待下次重试"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._updates = self._pending, {}, 0
+            if not batch:
+                return
+            try:
+                self.flush_fn(list(batch.items()))
+            except Exception as e:
+                print(f"写入任务进度失败: {e}")
+                with self._lock:
+                    for task_id, completed_prompts in batch.items():
+                        self._pending[task_id] = max(self._pending.get(task_id, 0), completed_prompts)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
@@ -12,9 +12,10 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
 try:
-    from app import app
+    from app import app, start_background_services
     # 确保应用对象可用
     application = app
+    start_background_services()
     
     if __name__ == "__main__":
         # 如果直接运行此文件，启动开发服务器